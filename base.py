@@ -1,14 +1,27 @@
-import re, os, tempfile, sys, shutil, time, ConfigParser, logging
+import re, os, tempfile, sys, shutil, time, ConfigParser, logging, threading, signal, socket, subprocess, gzip
+from ccmlib import common
 from ccmlib.cluster import Cluster
 from unittest import TestCase
+import timing
+from ingest import TokenAwareWriter, DEFAULT_MAX_IN_FLIGHT, pinned_cluster
+from bulkload import SSTableBulkLoader
+from datahelp import ExpectedData, create_rows, parse_storage_state
+from datasetcache import DatasetCache, cluster_topology, dataset_key, table_id
+from loadrunner import LoadRunner
+from pagehelp import PagedQuery, run_paged_queries
+from gclog import parse_gc_log
+from servermetrics import metrics_delta, parse_cfstats, parse_tpstats
+from scaling import DEFAULT_NODES, DEFAULT_RFS, DEFAULT_CLS, MatrixCell, format_matrix, matrix_cells
 
 # java
-from com.datastax.driver.core import Cluster as JCluster
+from com.datastax.driver.core import Cluster as JCluster, ConsistencyLevel, SimpleStatement
 
 logging.basicConfig(stream=sys.stderr)
 
 LOG_SAVED_DIR="logs"
 LAST_LOG = os.path.join(LOG_SAVED_DIR, "last")
+# oldest saved runs are removed once LOG_SAVED_DIR grows past this
+LOG_SAVED_MAX_BYTES = int(os.environ.get('LOG_SAVED_MAX_MB', '1024')) * 1024 * 1024
 
 LAST_TEST_DIR='last_test_dir'
 
@@ -25,6 +38,59 @@ KEEP_LOGS = os.environ.get('KEEP_LOGS', '').lower() in ('yes', 'true')
 KEEP_TEST_DIR = os.environ.get('KEEP_TEST_DIR', '').lower() in ('yes', 'true')
 PRINT_DEBUG = os.environ.get('PRINT_DEBUG', '').lower() in ('yes', 'true')
 DISABLE_VNODES = os.environ.get('DISABLE_VNODES', '').lower() in ('yes', 'true')
+CAPTURE_NODETOOL = os.environ.get('CAPTURE_NODETOOL', '').lower() in ('yes', 'true')
+# seconds a node gets to shut down after SIGTERM before it is killed
+STOP_GRACE_PERIOD = float(os.environ.get('STOP_GRACE_PERIOD', '10'))
+# reuse the sstables of table data created by earlier tests (see datasetcache.py)
+DATASET_CACHE = os.environ.get('DATASET_CACHE', '').lower() in ('yes', 'true')
+DATASET_CACHE_DIR = os.environ.get('DATASET_CACHE_DIR', os.path.expanduser('~/.cassandra-dtest-jython/dataset-cache'))
+DATASET_CACHE_MAX_BYTES = int(os.environ.get('DATASET_CACHE_MAX_MB', '4096')) * 1024 * 1024
+# run the scaling matrix tests (see scaling.py), which take a long time
+SCALING_MATRIX = os.environ.get('SCALING_MATRIX', '').lower() in ('yes', 'true')
+# snapshot nodetool tpstats and cfstats of every node around each test (see servermetrics.py)
+SERVER_METRICS = os.environ.get('SERVER_METRICS', '').lower() in ('yes', 'true')
+# fail tests with a GC pause longer than this many milliseconds on any node, unless they set gc_pause_budget
+GC_PAUSE_BUDGET_MS = int(os.environ['GC_PAUSE_BUDGET_MS']) if os.environ.get('GC_PAUSE_BUDGET_MS') else None
+# loop the suite for this many minutes, reusing clusters between tests (see noserunner.py and soak.py)
+SOAK_MINUTES = float(os.environ.get('SOAK_MINUTES', '0'))
+# comma separated profile names, applied after the ones a test class asks for
+CLUSTER_PROFILES = [p.strip() for p in os.environ.get('CLUSTER_PROFILES', '').split(',') if p.strip()]
+
+# Named cluster configurations that test classes can combine through their
+# cluster_profiles attribute. Each profile may set cassandra.yaml options
+# ('config'), extra JVM arguments for every node ('jvm_args') and the heap
+# size as a (MAX_HEAP_SIZE, HEAP_NEWSIZE) pair ('heap'). Profiles are applied
+# in order, so later ones override earlier ones.
+PROFILES = {
+    'fast-boot': {
+        # a single token per node and no waiting around for the ring to settle
+        'config': {
+            'num_tokens': None,
+            'hinted_handoff_enabled': False,
+        },
+        'jvm_args': [
+            '-Dcassandra.ring_delay_ms=1000',
+            '-Dcassandra.skip_wait_for_gossip_to_settle=0',
+        ],
+    },
+    'paging-stress': {
+        # keep caches out of the way so pages are served from memtables/sstables
+        'config': {
+            'key_cache_size_in_mb': 0,
+            'row_cache_size_in_mb': 0,
+            'compaction_throughput_mb_per_sec': 0,
+        },
+        'heap': ('1G', '200M'),
+    },
+    'tiny-heap': {
+        'config': {
+            'key_cache_size_in_mb': 0,
+            'row_cache_size_in_mb': 0,
+            'compaction_throughput_mb_per_sec': 16,
+        },
+        'heap': ('256M', '64M'),
+    },
+}
 
 LOG = logging.getLogger()
 
@@ -34,6 +100,206 @@ def debug(msg):
     if PRINT_DEBUG:
         print msg
 
+def process_rss_kb(pid):
+    """
+    Resident set size of a process in kB, or None if it can't be read
+    (not running, or not on linux).
+    """
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, TypeError):
+        pass
+    return None
+
+def run_in_parallel(func, items):
+    """
+    Calls func(item) for each item in its own thread and returns the results
+    in the same order. If any call raised, the first exception is re-raised
+    once every thread is done.
+    """
+    results = [None] * len(items)
+    errors = []
+
+    def run(idx, item):
+        try:
+            results[idx] = func(item)
+        except Exception:
+            errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=run, args=(idx, item)) for idx, item in enumerate(items)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+def wait_for_binary_interface(node, timeout=120):
+    """
+    Readiness probe: waits until the node accepts connections on its native
+    protocol port.
+    """
+    deadline = time.time() + timeout
+    while True:
+        s = socket.socket()
+        try:
+            s.connect(node.network_interfaces['binary'])
+            return
+        except socket.error:
+            if time.time() > deadline:
+                raise RuntimeError("%s did not open its binary interface within %ss" % (node.name, timeout))
+            time.sleep(0.1)
+        finally:
+            s.close()
+
+def nodetool_output(node, cmd):
+    """
+    Like node.nodetool(cmd), but returns what nodetool printed
+    (stdout and stderr) instead of letting it through.
+    """
+    cdir = node.get_cassandra_dir()
+    nodetool = common.join_bin(cdir, 'bin', 'nodetool')
+    env = common.make_cassandra_env(cdir, node.get_path())
+    args = [ nodetool, '-h', node.address(), '-p', str(node.jmx_port) ] + cmd.split()
+    p = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return p.communicate()[0]
+
+def grep_log_from(node, expr, mark=0):
+    """
+    Like node.grep_log(expr), but only for the lines logged after mark
+    (a node.mark_log()), or all of them if the log was rotated since.
+    """
+    matchings = []
+    pattern = re.compile(expr)
+    if not os.path.exists(node.logfilename()):
+        return matchings
+    with open(node.logfilename()) as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(mark if mark <= f.tell() else 0)
+        for line in f:
+            m = pattern.search(line)
+            if m:
+                matchings.append((line, m))
+    return matchings
+
+# saved log directories still being written, which must not be evicted
+_saving_log_dirs = set()
+_saving_log_lock = threading.Lock()
+
+def save_logs(nodes, capture_nodetool=False):
+    """
+    Saves the log of each node in a new LOG_SAVED_DIR/<millis> directory
+    and points LAST_LOG at it. Returns the background thread finishing
+    the job, so the caller can go on removing the cluster right away.
+
+    Logs are hardlinked when possible. Otherwise they're opened here (so
+    they stay readable once the cluster directory is gone) and gzipped
+    by the background thread, which then evicts the oldest saved runs
+    to keep LOG_SAVED_DIR under LOG_SAVED_MAX_BYTES. With capture_nodetool,
+    the output of nodetool status and tpstats is saved too, which has to
+    happen before returning since it needs the nodes up.
+    """
+    if not os.path.exists(LOG_SAVED_DIR):
+        os.mkdir(LOG_SAVED_DIR)
+    basedir = str(int(time.time() * 1000))
+    dir = os.path.join(LOG_SAVED_DIR, basedir)
+    os.mkdir(dir)
+    with _saving_log_lock:
+        _saving_log_dirs.add(dir)
+
+    to_compress = []
+    try:
+        for node in nodes:
+            log = node.logfilename()
+            if not os.path.exists(log):
+                continue
+            try:
+                os.link(log, os.path.join(dir, node.name + ".log"))
+            except (OSError, AttributeError):
+                # most likely the test directory is on another filesystem
+                to_compress.append((open(log, 'rb'), os.path.join(dir, node.name + ".log.gz")))
+
+        if capture_nodetool:
+            def capture(node):
+                for cmd in ('status', 'tpstats'):
+                    with open(os.path.join(dir, '%s.%s.txt' % (node.name, cmd)), 'w') as f:
+                        f.write(nodetool_output(node, cmd))
+            run_in_parallel(capture, [node for node in nodes if node.is_running()])
+
+        if os.path.lexists(LAST_LOG):
+            os.unlink(LAST_LOG)
+        os.symlink(basedir, LAST_LOG)
+    except:
+        with _saving_log_lock:
+            _saving_log_dirs.discard(dir)
+        for src, _ in to_compress:
+            src.close()
+        raise
+
+    def finish():
+        try:
+            for src, dest in to_compress:
+                try:
+                    out = gzip.open(dest, 'wb')
+                    try:
+                        shutil.copyfileobj(src, out, 1024 * 1024)
+                    finally:
+                        out.close()
+                finally:
+                    src.close()
+        except Exception as e:
+            print "Error saving log:", str(e)
+        finally:
+            with _saving_log_lock:
+                _saving_log_dirs.discard(dir)
+                evict_saved_logs(LOG_SAVED_MAX_BYTES)
+        debug("saved logs in {}".format(dir))
+
+    thread = threading.Thread(target=finish, name='save-logs-' + basedir)
+    thread.start()
+    return thread
+
+def evict_saved_logs(max_bytes):
+    """
+    Removes the oldest saved runs from LOG_SAVED_DIR until it is no bigger
+    than max_bytes. The newest run and runs still being saved are kept.
+    """
+    runs = sorted((int(name), os.path.join(LOG_SAVED_DIR, name)) for name in os.listdir(LOG_SAVED_DIR)
+                  if name.isdigit() and os.path.isdir(os.path.join(LOG_SAVED_DIR, name)))
+    sizes = {}
+    for _, path in runs:
+        sizes[path] = sum(os.path.getsize(os.path.join(root, f))
+                          for root, _, files in os.walk(path) for f in files)
+    total = sum(sizes.values())
+    for _, path in runs[:-1]:
+        if total <= max_bytes:
+            break
+        if path in _saving_log_dirs:
+            continue
+        shutil.rmtree(path)
+        total -= sizes[path]
+        debug("evicted saved logs {}".format(path))
+
+# in soak mode, the cluster of the last test, kept for the next one if it has the same configuration
+_soak_cluster = None
+
+def cleanup_soak_cluster():
+    """Stops and removes the cluster soak mode kept for the next test, if any."""
+    global _soak_cluster
+    kept, _soak_cluster = _soak_cluster, None
+    if kept is None:
+        return
+    kept['cluster'].stop(gently=False)
+    if not KEEP_TEST_DIR:
+        kept['cluster'].remove()
+        os.rmdir(kept['test_path'])
+    if os.path.exists(LAST_TEST_DIR):
+        os.remove(LAST_TEST_DIR)
+
 class ConnectionProxy(object):
     """
     Wraps a com.datastax.driver.core.Session to
@@ -55,7 +321,15 @@ class HybridTester(TestCase):
     """
     Supports testing with python/ccmlib
     and the java driver (via jython).
+
+    Subclasses can set cluster_profiles to a sequence of PROFILES names
+    to pick the cluster configuration, e.g. ('fast-boot', 'tiny-heap'),
+    and gc_pause_budget to the longest GC pause (in ms) a node may take
+    during their tests (GC_PAUSE_BUDGET_MS otherwise).
     """
+    cluster_profiles = ()
+    gc_pause_budget = None
+
     def __init__(self, *argv, **kwargs):
         # if False, then scan the log of each node for errors after every test.
         self.allow_log_errors = False
@@ -64,9 +338,12 @@ class HybridTester(TestCase):
             del kwargs['cluster_options']
         except KeyError:
             self.cluster_options = None
+        # per-node start and stop durations of the last cluster lifecycle operations
+        self.lifecycle_stats = {}
         super(HybridTester, self).__init__(*argv, **kwargs)
         
     def __get_cluster(self, name='test'):
+        self.num_tokens = None
         self.test_path = tempfile.mkdtemp(prefix='dtest-')
         debug("cluster ccm directory: "+self.test_path)
         try:
@@ -79,13 +356,48 @@ class HybridTester(TestCase):
                 cdir = DEFAULT_DIR
             cluster = Cluster(self.test_path, name, cassandra_dir=cdir)
         if cluster.version() >= "1.2":
-            if DISABLE_VNODES:
-                cluster.set_configuration_options(values={'num_tokens': None})
-            else:
-                cluster.set_configuration_options(values={'initial_token': None, 'num_tokens': 256})
+            self.__set_num_tokens(cluster, None if DISABLE_VNODES else 256)
         return cluster
 
+    def __set_num_tokens(self, cluster, num_tokens):
+        # ccm keeps its configuration private, so it is remembered here
+        self.num_tokens = num_tokens
+        if num_tokens is None:
+            cluster.set_configuration_options(values={'num_tokens': None})
+        else:
+            cluster.set_configuration_options(values={'initial_token': None, 'num_tokens': num_tokens})
+
+    def __apply_profiles(self):
+        """
+        Applies the profiles named by cluster_profiles and $CLUSTER_PROFILES
+        to self.cluster, remembering the jvm args to start nodes with.
+        """
+        self.profile_names = list(self.cluster_profiles) + CLUSTER_PROFILES
+        self.cluster_jvm_args = []
+        heap = None
+        for name in self.profile_names:
+            try:
+                profile = PROFILES[name]
+            except KeyError:
+                raise ValueError("Unknown cluster profile '%s' (known profiles: %s)" % (name, ', '.join(sorted(PROFILES))))
+            config = dict(profile.get('config', {}))
+            if 'num_tokens' in config:
+                if self.cluster.version() >= "1.2":
+                    self.__set_num_tokens(self.cluster, config['num_tokens'])
+                del config['num_tokens']
+            if config:
+                self.cluster.set_configuration_options(values=config)
+            self.cluster_jvm_args.extend(profile.get('jvm_args', []))
+            heap = profile.get('heap', heap)
+
+        if heap is not None:
+            # ccm appends a cassandra.in.sh found in the cluster directory to
+            # the one of every node, and cassandra-env.sh honors these
+            with open(os.path.join(self.cluster.get_path(), 'cassandra.in.sh'), 'w') as f:
+                f.write('MAX_HEAP_SIZE="%s"\nHEAP_NEWSIZE="%s"\n' % heap)
+
     def setUp(self):
+        timing.start(self.id(), 'setup')
         debug("Preparing to run: {}".format(self.id()))
         
         # cleaning up if a previous execution didn't trigger tearDown (which
@@ -95,6 +407,8 @@ class HybridTester(TestCase):
             with open(LAST_TEST_DIR) as f:
                 self.test_path = f.readline().strip('\n')
                 name = f.readline()
+            # unless soak mode kept it for this test
+            if _soak_cluster is None or _soak_cluster['test_path'] != self.test_path:
                 try:
                     self.cluster = Cluster.load(self.test_path, name)
                     # Avoid waiting too long for node to be marked down
@@ -103,24 +417,100 @@ class HybridTester(TestCase):
                     # after a restart, /tmp will be emptied so we'll get an IOError when loading the old cluster here
                     pass
 
+        self.reused_cluster = SOAK_MINUTES > 0 and self.__reuse_soak_cluster()
+        if not self.reused_cluster:
+            self.__new_cluster()
+        # where the logs of a kept cluster were, so only this test's errors count
+        self.log_marks = dict((node.name, node.mark_log()) for node in self.cluster.nodelist()) \
+            if self.reused_cluster else {}
+        self.test_started = time.time()
+        self.gc_stats = None
+        self.connections = []
+        self.runners = []
+        self.boot_stats = None
+        self.matrix_results = None
+        self.server_metrics_before = None
+        self.server_metrics = None
+        self.storage_states = []
+        self.phase_timings = None
+        timing.begin(timing.DEFAULT_PHASE)
+
+    def __soak_key(self):
+        # tests with the same key can share a cluster
+        return [list(self.cluster_profiles) + CLUSTER_PROFILES, sorted((self.cluster_options or {}).items())]
+
+    def __reuse_soak_cluster(self):
+        """Takes the cluster soak mode kept from the previous test, if it is configured the same."""
+        global _soak_cluster
+        if _soak_cluster is None:
+            return False
+        if _soak_cluster['key'] != self.__soak_key():
+            cleanup_soak_cluster()
+            return False
+        self.cluster = _soak_cluster['cluster']
+        self.test_path = _soak_cluster['test_path']
+        self.profile_names = _soak_cluster['profile_names']
+        self.cluster_jvm_args = _soak_cluster['jvm_args']
+        self.num_tokens = _soak_cluster['num_tokens']
+        _soak_cluster = None
+        return True
+
+    def __keep_for_soak(self):
+        """
+        Keeps the cluster for the next test, with the keyspaces of this one
+        dropped. Returns False if it isn't fit for reuse (a node is down).
+        """
+        global _soak_cluster
+        nodes = self.cluster.nodelist()
+        if not nodes or not all(node.is_running() for node in nodes):
+            return False
+        address, port = nodes[0].network_interfaces['binary']
+        cluster = pinned_cluster(address, port)
+        try:
+            session = cluster.connect()
+            for row in session.execute("SELECT keyspace_name FROM system.schema_keyspaces"):
+                name = row.getString('keyspace_name')
+                if not name.startswith('system'):
+                    session.execute('DROP KEYSPACE "%s"' % name)
+        except:
+            # java exceptions aren't Exceptions
+            debug("not reusing the cluster: %s" % (sys.exc_info()[1],))
+            return False
+        finally:
+            cluster.shutdown()
+        _soak_cluster = {'key': self.__soak_key(), 'cluster': self.cluster, 'test_path': self.test_path,
+                         'profile_names': self.profile_names, 'jvm_args': self.cluster_jvm_args,
+                         'num_tokens': self.num_tokens}
+        return True
+
+    def __new_cluster(self):
+        """Creates self.cluster, configured for the test but not populated."""
         self.cluster = self.__get_cluster()
         # self.__setup_cobertura()
         # the failure detector can be quite slow in such tests with quick start/stop
         self.cluster.set_configuration_options(values={'phi_convict_threshold': 5})
 
         timeout = 10000
+        if self.cluster_options is None:
+            if self.cluster.version() < "1.2":
+                self.cluster.set_configuration_options(values={'rpc_timeout_in_ms': timeout})
+            else:
+                self.cluster.set_configuration_options(values={
+                    'read_request_timeout_in_ms' : timeout,
+                    'range_request_timeout_in_ms' : timeout,
+                    'write_request_timeout_in_ms' : timeout,
+                    'truncate_request_timeout_in_ms' : timeout,
+                    'request_timeout_in_ms' : timeout
+                })
+        self.__apply_profiles()
         if self.cluster_options is not None:
+            # explicit options win over the selected profiles
             self.cluster.set_configuration_options(values=self.cluster_options)
-        elif self.cluster.version() < "1.2":
-            self.cluster.set_configuration_options(values={'rpc_timeout_in_ms': timeout})
-        else:
-            self.cluster.set_configuration_options(values={
-                'read_request_timeout_in_ms' : timeout,
-                'range_request_timeout_in_ms' : timeout,
-                'write_request_timeout_in_ms' : timeout,
-                'truncate_request_timeout_in_ms' : timeout,
-                'request_timeout_in_ms' : timeout
-            })
+            self.num_tokens = self.cluster_options.get('num_tokens', self.num_tokens)
+        if SOAK_MINUTES > 0:
+            # keyspaces are dropped between the tests sharing a cluster, which
+            # would otherwise leave a snapshot of each behind
+            self.cluster.set_configuration_options(values={'auto_snapshot': False})
 
         with open(LAST_TEST_DIR, 'w') as f:
             f.write(self.test_path + '\n')
@@ -129,10 +519,120 @@ class HybridTester(TestCase):
             self.cluster.set_log_level("DEBUG")
         if TRACE:
             self.cluster.set_log_level("TRACE")
-        self.connections = []
-        self.runners = []    
+
+    def start_cluster(self, nodes):
+        """
+        Populates and starts the cluster with the jvm args of the selected
+        profiles, recording boot time and the resident memory of each node
+        in self.boot_stats.
+
+        All node JVMs are launched at once and the call returns when every
+        node has its binary interface open and sees all the others UP, so
+        the boot costs about as much as the slowest node.
+
+        In soak mode, a cluster kept from the previous test is reused if it
+        has as many nodes, all up.
+        """
+        if self.reused_cluster:
+            nodelist = self.cluster.nodelist()
+            if len(nodelist) == nodes and all(node.is_running() for node in nodelist):
+                debug("reusing the cluster of the previous test")
+                if SERVER_METRICS:
+                    self.server_metrics_before = self.snapshot_server_metrics()
+                return self.cluster
+            self.__replace_cluster()
+            self.reused_cluster = False
+        self.cluster.populate(nodes)
+        nodelist = self.cluster.nodelist()
+        start = time.time()
+
+        def launch_node(node):
+            node.start(jvm_args=self.cluster_jvm_args)
+
+        def wait_for_node(node):
+            wait_for_binary_interface(node)
+            others = [other for other in nodelist if other is not node]
+            if others:
+                node.watch_log_for_alive(others)
+            return time.time() - start
+
+        with timing.phase('cluster_boot'):
+            run_in_parallel(launch_node, nodelist)
+        with timing.phase('readiness_wait'):
+            durations = run_in_parallel(wait_for_node, nodelist)
+        boot_time = time.time() - start
+        self.lifecycle_stats['start'] = dict((node.name, d) for node, d in zip(nodelist, durations))
+
+        rss = dict((node.name, process_rss_kb(node.pid)) for node in self.cluster.nodelist())
+        self.boot_stats = {
+            'profiles': self.profile_names,
+            'nodes': nodes,
+            'boot_time': boot_time,
+            'node_start_time': self.lifecycle_stats['start'],
+            'rss_kb': rss,
+        }
+        debug("cluster boot with profiles {}: {:.2f}s, rss (kB): {}".format(
+            ', '.join(self.profile_names) or '(none)', boot_time,
+            ', '.join('{}={}'.format(name, rss[name]) for name in sorted(rss))))
+        self.__report_lifecycle('start')
+        if SERVER_METRICS:
+            self.server_metrics_before = self.snapshot_server_metrics()
+        return self.cluster
+
+    def snapshot_server_metrics(self):
+        """Metrics snapshot (see servermetrics.py) of every running node, by node name."""
+        def snapshot(node):
+            metrics = parse_tpstats(nodetool_output(node, 'tpstats'))
+            metrics.update(parse_cfstats(nodetool_output(node, 'cfstats')))
+            return metrics
+
+        nodes = [node for node in self.cluster.nodelist() if node.is_running()]
+        with timing.phase('server_metrics'):
+            return dict(zip([node.name for node in nodes], run_in_parallel(snapshot, nodes)))
+
+    def __capture_server_metrics(self):
+        """Sets self.server_metrics to what changed on each node since the cluster started."""
+        after = self.snapshot_server_metrics()
+        self.server_metrics = dict((name, metrics_delta(self.server_metrics_before.get(name, {}), metrics))
+                                   for name, metrics in after.items())
+        for name in sorted(self.server_metrics):
+            notable = sorted((metric, value) for metric, value in self.server_metrics[name].items()
+                             if 'tombstone' in metric or 'local_read' in metric or metric.startswith('dropped.'))
+            debug("server metrics of {}: {}".format(name, ', '.join('%s=%s' % item for item in notable) or 'nothing notable'))
+
+    def stop_cluster(self, gently=True, grace=STOP_GRACE_PERIOD):
+        """
+        Stops all running nodes in parallel. When gently, each node gets a
+        SIGTERM and grace seconds to shut down before being sent SIGKILL.
+        """
+        nodelist = self.cluster.nodelist()
+
+        def stop_node(node):
+            start = time.time()
+            if not node.is_running():
+                return 0.0
+            if gently:
+                os.kill(node.pid, signal.SIGTERM)
+                deadline = start + grace
+                while node.is_running() and time.time() < deadline:
+                    time.sleep(0.1)
+            if node.is_running():
+                os.kill(node.pid, signal.SIGKILL)
+                while node.is_running():
+                    time.sleep(0.1)
+            return time.time() - start
+
+        durations = run_in_parallel(stop_node, nodelist)
+        self.lifecycle_stats['stop'] = dict((node.name, d) for node, d in zip(nodelist, durations))
+        self.__report_lifecycle('stop')
+
+    def __report_lifecycle(self, operation):
+        durations = self.lifecycle_stats[operation]
+        debug("node {} durations: {}".format(operation,
+            ', '.join('{}={:.2f}s'.format(name, durations[name]) for name in sorted(durations))))
 
     def tearDown(self):
+        timing.begin('teardown')
         for con in self.connections:
             con.close()
 
@@ -143,52 +643,237 @@ class HybridTester(TestCase):
                 pass
 
         failed = sys.exc_info() != (None, None, None)
+        if self.server_metrics_before is not None:
+            try:
+                self.__capture_server_metrics()
+            except Exception as e:
+                print "Error capturing server metrics:", str(e)
         try:
             for node in self.cluster.nodelist():
                 if self.allow_log_errors == False:
-                    errors = list(self.__filter_errors([ msg for msg, i in node.grep_log("ERROR")]))
+                    errors = list(self.__filter_errors([ msg for msg, i in
+                                                         grep_log_from(node, "ERROR", self.log_marks.get(node.name, 0))]))
                     if len(errors) is not 0:
                         failed = True
                         raise AssertionError('Unexpected error in %s node log: %s' % (node.name, errors))
+            self.gc_stats = self.__gc_stats()
+            budget = self.gc_pause_budget if self.gc_pause_budget is not None else GC_PAUSE_BUDGET_MS
+            over = [(name, stats['max_ms']) for name, stats in sorted(self.gc_stats.items())
+                    if budget is not None and stats['max_ms'] > budget]
+            if over:
+                failed = True
+                raise AssertionError('GC pauses over the %dms budget: %s' % (
+                    budget, ', '.join('%s paused %dms' % item for item in over)))
         finally:
             try:
                 if failed or KEEP_LOGS:
                     # means the test failed. Save the logs for inspection.
-                    if not os.path.exists(LOG_SAVED_DIR):
-                        os.mkdir(LOG_SAVED_DIR)
-                    logs = [ (node.name, node.logfilename()) for node in self.cluster.nodes.values() ]
-                    if len(logs) is not 0:
-                        basedir = str(int(time.time() * 1000))
-                        dir = os.path.join(LOG_SAVED_DIR, basedir)
-                        os.mkdir(dir)
-                        for name, log in logs:
-                            shutil.copyfile(log, os.path.join(dir, name + ".log"))
-                        if os.path.exists(LAST_LOG):
-                            os.unlink(LAST_LOG)
-                        os.symlink(basedir, LAST_LOG)
+                    if len(self.cluster.nodes) is not 0:
+                        save_logs(self.cluster.nodes.values(), capture_nodetool=CAPTURE_NODETOOL)
             except Exception as e:
                     print "Error saving log:", str(e)
             finally:
-                self.__cleanup_cluster()
+                if not (SOAK_MINUTES > 0 and not failed and self.__keep_for_soak()):
+                    self.__cleanup_cluster()
+                self.phase_timings = timing.stop()
+                if self.phase_timings is not None and self.boot_stats is not None:
+                    self.phase_timings['boot_stats'] = self.boot_stats
+                if self.phase_timings is not None and self.matrix_results is not None:
+                    self.phase_timings['scaling_matrix'] = self.matrix_results
+                if self.phase_timings is not None and self.server_metrics is not None:
+                    self.phase_timings['server_metrics'] = self.server_metrics
+                if self.phase_timings is not None and self.gc_stats:
+                    self.phase_timings['gc'] = self.gc_stats
+                if self.phase_timings is not None and self.storage_states:
+                    self.phase_timings['storage_states'] = self.storage_states
+
+    def __gc_stats(self):
+        """GC pauses of each node during the test, from its log (see gclog.py)."""
+        stats = {}
+        end = time.time()
+        for node in self.cluster.nodelist():
+            if not os.path.exists(node.logfilename()):
+                continue
+            with open(node.logfilename()) as f:
+                stats[node.name] = parse_gc_log(f, self.test_started, end).as_dict()
+            debug("gc of {}: {total_ms}ms over {collections} collections, longest {max_ms}ms, "
+                  "{heap_warnings} heap warnings".format(node.name, **stats[node.name]))
+        return stats
+
     def __cleanup_cluster(self):
-        if KEEP_TEST_DIR:
-            # Just kill it, leave the files where they are:
-            self.cluster.stop(gently=False)
-        else:
-            # Cleanup everything:
+        # kill every node at once rather than one after the other
+        self.stop_cluster(gently=False)
+        if not KEEP_TEST_DIR:
+            # Cleanup everything, otherwise leave the files where they are:
             self.cluster.remove()
             os.rmdir(self.test_path)
         os.remove(LAST_TEST_DIR)
         
     def cql_connection(self, node, keyspace=None, user=None, password=None):
-        cluster = JCluster.builder().addContactPoint(node.address()).build()
-        session = cluster.connect()
+        with timing.phase('connect'):
+            cluster = JCluster.builder().addContactPoint(node.address()).build()
+            session = cluster.connect()
         
         proxy = ConnectionProxy(session)
         self.connections.append(proxy)
         return proxy
     
+    def token_aware_writer(self, keyspace, nodes=None, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """
+        Returns a row writer for create_rows sending every insert to one of
+        its replicas, through all the (given) nodes at once.
+        """
+        with timing.phase('connect'):
+            writer = TokenAwareWriter(nodes or self.cluster.nodelist(), keyspace,
+                                      max_in_flight=max_in_flight, log=debug)
+        self.connections.append(writer)
+        return writer
+
+    def ring_tokens(self, node=None):
+        """
+        Tokens of every node of the ring, from the driver's metadata of the
+        cluster as seen through node (the first one by default): the end
+        of each of its token ranges.
+        """
+        node = node or self.cluster.nodelist()[0]
+        address, port = node.network_interfaces['binary']
+        cluster = pinned_cluster(address, port)
+        try:
+            # the metadata is filled in on connecting
+            cluster.connect()
+            return [int(token_range.getEnd().getValue()) for token_range in cluster.getMetadata().getTokenRanges()]
+        finally:
+            cluster.shutdown()
+
+    def start_load(self, cursor, workload, rate=100):
+        """
+        Starts a LoadRunner sending the writes of workload through cursor
+        in the background, stopped by tearDown if the test doesn't.
+        """
+        runner = LoadRunner(cursor, workload, rate=rate, log=debug)
+        self.runners.append(runner)
+        runner.start()
+        return runner
+
+    def bulk_loader(self, cursor, keyspace):
+        """
+        Returns an SSTableBulkLoader for tables of keyspace, reporting how
+        loads compare to INSERTs when debugging.
+        """
+        return SSTableBulkLoader(self.cluster, cursor, keyspace, log=debug)
+
+    def create_cached_rows(self, cursor, keyspace, table, data, format_funcs=None, seed=0, writer=None):
+        """
+        Like create_rows (writing through writer if given), but with
+        DATASET_CACHE=yes the sstables of data created by an earlier test
+        with the same schema, seed and ring are restored instead.
+        """
+        topology = cluster_topology(self.cluster, self.num_tokens) if DATASET_CACHE else None
+        if topology is None:
+            return create_rows(data, writer or cursor, table, format_funcs=format_funcs, seed=seed)
+
+        ks_meta = cursor.getCluster().getMetadata().getKeyspace(keyspace)
+        schema = [ks_meta.asCQLQuery(), ks_meta.getTable(table).asCQLQuery()]
+        key = dataset_key(schema, data, seed, format_funcs, topology)
+        cache = DatasetCache(DATASET_CACHE_DIR, DATASET_CACHE_MAX_BYTES, log=debug)
+        nodes = self.cluster.nodelist()
+        with timing.phase('ingest'):
+            cf_id = table_id(cursor, keyspace, table)
+            if cache.restore(key, nodes, keyspace, table, cf_id):
+                return ExpectedData(data, format_funcs=format_funcs, seed=seed)
+        expected = create_rows(data, writer or cursor, table, format_funcs=format_funcs, seed=seed)
+        cache.store(key, nodes, keyspace, table, cf_id)
+        return expected
+
+    def run_matrix(self, setup, query, formatters, nodes=DEFAULT_NODES, rfs=DEFAULT_RFS, cls=DEFAULT_CLS,
+                   fetch_size=5000, queries=1, workers=1):
+        """
+        Runs a scaling matrix (see scaling.py). For each node count, a new
+        cluster is started; for each replication factor a keyspace is
+        created and setup(cursor) creates the table data, returning it
+        (as create_rows does) if the results should be checked. The query
+        is then paged through at each consistency level, queries times at
+        once over workers threads. Returns the MatrixCells, which also go
+        to the phase timings of the test.
+        """
+        cells = []
+        combinations = matrix_cells(nodes, rfs, cls)
+        for node_count in sorted(set(n for n, _, _ in combinations)):
+            if self.cluster.nodelist():
+                self.__replace_cluster()
+            self.start_cluster(node_count)
+            cursor = self.cql_connection(self.cluster.nodelist()[0]).cursor()
+            for rf in sorted(set(rf for n, rf, _ in combinations if n == node_count)):
+                self.create_ks(cursor, 'scaling_rf%d' % rf, rf)
+                expected = setup(cursor)
+                timing.begin(timing.DEFAULT_PHASE)
+                for cl in [cl for n, r, cl in combinations if (n, r) == (node_count, rf)]:
+                    paged = [PagedQuery(SimpleStatement(query).setFetchSize(fetch_size)
+                                        .setConsistencyLevel(ConsistencyLevel.valueOf(cl)),
+                                        expected=expected.digest() if expected is not None else None)
+                             for _ in range(queries)]
+                    stats = run_paged_queries(cursor, paged, formatters, workers=workers)
+                    failed = [q for q in paged if not q.ok()]
+                    error = None
+                    if failed:
+                        error = failed[0].error or "%d rows not matching the %d expected" % (
+                            failed[0].rows, failed[0].expected.count)
+                    cells.append(MatrixCell(node_count, rf, cl, stats, error))
+        debug("scaling matrix:\n" + format_matrix(cells))
+        self.matrix_results = [cell.as_dict() for cell in cells]
+        return cells
+
+    def __replace_cluster(self):
+        """Throws the cluster away for a new, empty one."""
+        for con in self.connections:
+            con.close()
+        self.connections = []
+        self.__cleanup_cluster()
+        self.__new_cluster()
+        self.log_marks = {}
+
+    def create_rows_in_state(self, cursor, keyspace, table, data, state, format_funcs=None, seed=0, writer=None):
+        """
+        Like create_rows (writing through writer if given), leaving the
+        data in a storage state (see datahelp.parse_storage_state) on
+        every node: in memtables, flushed, flushed in N sstables (with
+        autocompaction disabled for the table) or major compacted. The
+        sstable count of each node is added to self.storage_states.
+        """
+        name, sstables = parse_storage_state(state)
+        nodes = [node for node in self.cluster.nodelist() if node.is_running()]
+
+        def flush(rows=None):
+            with timing.phase('storage_setup'):
+                run_in_parallel(lambda node: node.nodetool('flush %s %s' % (keyspace, table)), nodes)
+
+        chunk_rows = None
+        if name == 'sstables':
+            with timing.phase('storage_setup'):
+                run_in_parallel(lambda node: node.nodetool('disableautocompaction %s %s' % (keyspace, table)), nodes)
+            rows = len(ExpectedData(data, format_funcs=format_funcs, seed=seed))
+            chunk_rows = max(-(-rows // sstables), 1)
+        expected = create_rows(data, writer or cursor, table, format_funcs=format_funcs, seed=seed,
+                               chunk_rows=chunk_rows, on_chunk=flush)
+        if name != 'memtable':
+            # the last chunk of 'sstables:N' is usually flushed already, which is harmless
+            flush()
+        if name == 'compacted':
+            with timing.phase('storage_setup'):
+                run_in_parallel(lambda node: node.nodetool('compact %s %s' % (keyspace, table)), nodes)
+
+        counts = {}
+        for node in nodes:
+            metrics = parse_cfstats(nodetool_output(node, 'cfstats'))
+            counts[node.name] = metrics.get('%s.%s.sstable_count' % (keyspace, table))
+        self.storage_states.append({'state': state, 'table': '%s.%s' % (keyspace, table), 'sstables': counts})
+        debug("{}.{} left {}: sstables {}".format(keyspace, table, state,
+              ', '.join('{}={}'.format(node_name, counts[node_name]) for node_name in sorted(counts))))
+        return expected
+
     def create_ks(self, cursor, name, rf):
+        # the DDL that usually follows (CREATE TABLE...) is counted as schema setup too
+        timing.begin('schema_setup')
         cursor.execute(
             """
             CREATE KEYSPACE {ks_name}
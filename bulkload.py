@@ -0,0 +1,177 @@
+"""
+Bulk loads table data (see datahelp) by writing sstables offline with
+Cassandra's CQLSSTableWriter and loading them into the cluster, rather
+than sending an INSERT per row. Multi-million row fixtures take minutes
+through CQL but seconds this way.
+
+The table must exist in the cluster. The values are serialized with the
+column types of the driver's schema metadata, so they go through the
+same conversions as the INSERT path.
+
+    loader = SSTableBulkLoader(self.cluster, cursor, 'test_paging_size')
+    expected_data = loader.load('paging_test', data, format_funcs=(str, cql_str))
+"""
+import glob, os, shutil, subprocess, tempfile, time
+
+from ccmlib import common
+import timing
+from datahelp import ExpectedData, parse_headers_into_list
+from datasetcache import table_data_dir, table_id
+from ingest import serialize_literal
+
+# java
+from java.io import File
+from java.lang import ClassLoader, Thread
+from java.net import URLClassLoader
+from java.util import ArrayList
+
+WRITER_CLASS = 'org.apache.cassandra.io.sstable.CQLSSTableWriter'
+DEFAULT_PARTITIONER = 'org.apache.cassandra.dht.Murmur3Partitioner'
+# memory the writer sorts rows in before writing out an sstable
+WRITER_BUFFER_MB = 64
+
+_loaders = {}
+
+def cassandra_class_loader(cassandra_dir):
+    """
+    Class loader for the jars of a Cassandra install or source build,
+    isolated from the driver's classpath (they disagree on guava, netty...).
+    """
+    if cassandra_dir not in _loaders:
+        paths = sorted(glob.glob(os.path.join(cassandra_dir, 'lib', '*.jar')))
+        paths += sorted(glob.glob(os.path.join(cassandra_dir, 'build', '*.jar')))
+        classes = os.path.join(cassandra_dir, 'build', 'classes', 'main')
+        if os.path.isdir(classes):
+            paths.append(classes)
+        if not paths:
+            raise RuntimeError("No Cassandra jars in %s" % cassandra_dir)
+        urls = [File(path).toURI().toURL() for path in paths]
+        # parent is the bootstrap/extension loader, not jython's classpath
+        _loaders[cassandra_dir] = URLClassLoader(urls, ClassLoader.getSystemClassLoader().getParent())
+    return _loaders[cassandra_dir]
+
+class SSTableBulkLoader(object):
+    """
+    Writes table data to sstables and loads them into the cluster, either
+    streaming them with sstableloader ('sstableloader') or copying them
+    to every node and running nodetool refresh ('refresh'), which skips
+    streaming but leaves every node with all the data.
+    """
+    def __init__(self, cluster, cursor, keyspace, partitioner=DEFAULT_PARTITIONER, log=None):
+        self.cluster = cluster
+        self.cursor = cursor
+        self.keyspace = keyspace
+        self.partitioner = partitioner
+        self.log = log
+        # timings of the last load
+        self.stats = None
+
+    def _table_metadata(self, table):
+        meta = self.cursor.getCluster().getMetadata().getKeyspace(self.keyspace)
+        meta = meta.getTable(table) if meta is not None else None
+        if meta is None:
+            raise RuntimeError("Table %s.%s doesn't exist" % (self.keyspace, table))
+        return meta
+
+    def write_sstables(self, table, headers, rows, directory):
+        """Writes rows (lists of CQL literals) to sstables in directory, returns the row count."""
+        meta = self._table_metadata(table)
+        types = [meta.getColumn(header).getType() for header in headers]
+        loader = cassandra_class_loader(self.cluster.get_cassandra_dir())
+        writer_class = loader.loadClass(WRITER_CLASS)
+        partitioner = loader.loadClass(self.partitioner)()
+        insert = "INSERT INTO {ks}.{table} ({cols}) VALUES ({markers})".format(
+            ks=self.keyspace, table=table, cols=', '.join(headers), markers=', '.join(['?'] * len(headers)))
+
+        # cassandra looks some classes up through the context class loader
+        thread = Thread.currentThread()
+        previous_loader = thread.getContextClassLoader()
+        thread.setContextClassLoader(loader)
+        count = 0
+        try:
+            writer = writer_class.builder().inDirectory(directory).forTable(meta.asCQLQuery()).using(insert) \
+                .withPartitioner(partitioner).withBufferSizeInMB(WRITER_BUFFER_MB).build()
+            try:
+                for row in rows:
+                    writer.rawAddRow(ArrayList([serialize_literal(t, literal) for t, literal in zip(types, row)]))
+                    count += 1
+            finally:
+                writer.close()
+        finally:
+            thread.setContextClassLoader(previous_loader)
+        return count
+
+    def load(self, table, data, format_funcs=None, seed=0, method='sstableloader', compare_inserts=0):
+        """
+        Loads the data into table and returns it as an ExpectedData, like
+        create_rows. With compare_inserts, also times INSERTs of that many
+        of the rows (rewriting them as they are) to report the speedup.
+        """
+        headers = parse_headers_into_list(data)
+        values = ExpectedData(data, format_funcs=format_funcs, seed=seed)
+        workdir = tempfile.mkdtemp(prefix='dtest-bulkload-')
+        # sstableloader takes the keyspace and table from the path
+        directory = os.path.join(workdir, self.keyspace, table)
+        os.makedirs(directory)
+        try:
+            with timing.phase('ingest'):
+                start = time.time()
+                rows = self.write_sstables(table, headers, values, directory)
+                written = time.time()
+                if method == 'sstableloader':
+                    self._stream(directory)
+                elif method == 'refresh':
+                    self._refresh(table, directory)
+                else:
+                    raise ValueError("Unknown bulk load method %s" % method)
+                loaded = time.time()
+        finally:
+            shutil.rmtree(workdir)
+
+        self.stats = {
+            'rows': rows,
+            'method': method,
+            'write_seconds': written - start,
+            'load_seconds': loaded - written,
+            'rows_per_sec': rows / (loaded - start) if loaded > start else 0.0,
+        }
+        if compare_inserts:
+            self.stats['insert_rows_per_sec'] = self._insert_rate(table, headers, values[:compare_inserts])
+        if self.log is not None:
+            self.log("bulk loaded {rows} rows with {method}: {write_seconds:.1f}s writing, "
+                     "{load_seconds:.1f}s loading, {rows_per_sec:.0f} rows/s".format(**self.stats)
+                     + (" vs {:.0f} rows/s with INSERTs".format(self.stats['insert_rows_per_sec'])
+                        if compare_inserts else ''))
+        return values
+
+    def _stream(self, directory):
+        node = self.cluster.nodelist()[0]
+        cdir = self.cluster.get_cassandra_dir()
+        env = common.make_cassandra_env(cdir, node.get_path())
+        hosts = ','.join(n.network_interfaces['binary'][0] for n in self.cluster.nodelist() if n.is_running())
+        p = subprocess.Popen([common.join_bin(cdir, 'bin', 'sstableloader'), '-d', hosts, directory],
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = p.communicate()[0]
+        if p.returncode != 0:
+            raise RuntimeError("sstableloader failed:\n" + output)
+
+    def _refresh(self, table, directory):
+        files = os.listdir(directory)
+        cf_id = table_id(self.cursor, self.keyspace, table)
+        for node in self.cluster.nodelist():
+            # data/<ks>/<table>, or data/<ks>/<table>-<cf_id> from 2.1 on
+            table_dir = table_data_dir(node, self.keyspace, table, cf_id)
+            for name in files:
+                target = os.path.join(table_dir, name)
+                if os.path.exists(target):
+                    raise RuntimeError("%s already has %s, bulk load into an empty table" % (node.name, name))
+                shutil.copy(os.path.join(directory, name), target)
+            node.nodetool('refresh %s %s' % (self.keyspace, table))
+
+    def _insert_rate(self, table, headers, rows):
+        start = time.time()
+        for row in rows:
+            self.cursor.execute("INSERT INTO {ks}.{table} ({cols}) values ({vals})".format(
+                ks=self.keyspace, table=table, cols=', '.join(headers), vals=', '.join(row)))
+        elapsed = time.time() - start
+        return len(rows) / elapsed if elapsed else 0.0
@@ -1,4 +1,5 @@
-import re
+import hashlib, itertools, re, uuid
+import timing
 
 def strip(val):
     # remove spaces and pipes from beginning/end
@@ -52,29 +53,267 @@ def parse_row_into_list(row, format_funcs=None):
     else:
         return [l.strip() for l in row_cells]
 
-def parse_data_into_lists(data, format_funcs=None):
-    # throw out leading/trailing space and pipes
-    # so we can split on the data without getting
-    # extra empty fields
-    rows = map(strip, data.split('\n'))
-    
-    # remove any remaining empty lines (i.e. '') from data
-    rows = filter(None, rows)
-    
-    # remove headers
-    rows.pop(0)
-    
+# generator cells, like @seq or @text(36), produce a different value for
+# every row from a seed and the row's index in the dataset, so the same
+# data can be generated again without having been kept around
+GENERATOR_RE = re.compile(r'^@(\w+)(?:\(([^)]*)\))?$')
+# rows generated at a time
+GENERATOR_CHUNK = 1000
+# 2014-05-13 16:53:20 UTC, @timestamp values start from it by default
+DEFAULT_TIMESTAMP = 1400000000000
+
+def _hashes(seed, column, start, count):
+    # md5 of every (seed, column, row index), sharing the hash of the prefix
+    prefix = hashlib.md5('%s:%s:' % (seed, column))
+    hashes = []
+    for index in xrange(start, start + count):
+        h = prefix.copy()
+        h.update(str(index))
+        hashes.append(h)
+    return hashes
+
+def gen_seq(seed, column, start, count, first=0):
+    first = int(first)
+    return [str(first + index) for index in xrange(start, start + count)]
+
+def gen_uuid(seed, column, start, count):
+    return [str(uuid.UUID(bytes=h.digest(), version=4)) for h in _hashes(seed, column, start, count)]
+
+def gen_text(seed, column, start, count, length=36):
+    length = int(length)
     values = []
-    
+    for h in _hashes(seed, column, start, count):
+        text = h.hexdigest()
+        while len(text) < length:
+            h.update(text)
+            text += h.hexdigest()
+        values.append("'%s'" % text[:length])
+    return values
+
+def gen_timestamp(seed, column, start, count, first=DEFAULT_TIMESTAMP, step=1000):
+    first, step = int(first), int(step)
+    return [str(first + index * step) for index in xrange(start, start + count)]
+
+GENERATORS = {
+    'seq': gen_seq,
+    'uuid': gen_uuid,
+    'text': gen_text,
+    'timestamp': gen_timestamp,
+}
+
+def parse_generator(cell):
+    """
+    Returns a function of (seed, column, start, count) generating the CQL
+    literals of a generator cell, or None if the cell is a plain value.
+    """
+    m = GENERATOR_RE.match(cell)
+    if not m:
+        return None
+    try:
+        gen = GENERATORS[m.group(1)]
+    except KeyError:
+        raise ValueError("Unknown generator %s, expected one of %s" % (cell, ', '.join(sorted(GENERATORS))))
+    args = [arg.strip() for arg in m.group(2).split(',')] if m.group(2) else []
+    return lambda seed, column, start, count: gen(seed, column, start, count, *args)
+
+def parse_data_spec(data):
+    """
+    Returns the rows of the data as (count, cells) pairs, a row without
+    a multiplier having a count of 1.
+    """
+    rows = filter(None, map(strip, data.split('\n')))
+    rows.pop(0)
+
+    spec = []
     for row in rows:
-        if row_has_multiplier(row):
-            values.extend(parse_row_into_list(row, format_funcs=format_funcs))
+        row_cells = [l.strip() for l in row.split('|')]
+        count = get_row_multiplier(row)
+        if count is None:
+            spec.append((1, row_cells))
         else:
-            values.append(parse_row_into_list(row, format_funcs=format_funcs))
-    
-    return values
+            spec.append((count, row_cells[1:]))
+    return spec
+
+def has_generators(cells):
+    return any(GENERATOR_RE.match(cell) for cell in cells)
+
+def generate_rows(cells, start, count, seed=0, format_funcs=None):
+    """
+    Yields the rows start to start + count of a row with generator cells,
+    GENERATOR_CHUNK at a time. The other cells are formatted once and
+    shared by every row, so format_funcs must not be random for them.
+    """
+    columns = []
+    for idx, cell in enumerate(cells):
+        gen = parse_generator(cell)
+        if gen is not None:
+            columns.append(gen)
+        else:
+            columns.append(format_funcs[idx](cell) if format_funcs else cell)
+
+    for chunk_start in xrange(start, start + count, GENERATOR_CHUNK):
+        chunk_count = min(GENERATOR_CHUNK, start + count - chunk_start)
+        values = [col(seed, idx, chunk_start, chunk_count) if callable(col) else [col] * chunk_count
+                  for idx, col in enumerate(columns)]
+        for row in zip(*values):
+            yield list(row)
+
+class RowDigest(object):
+    """
+    Order independent digest of rows: the sum of the md5 of every row,
+    so rows can be added one page at a time, in any order, and the same
+    rows (duplicates included) always give the same digest.
+    """
+    def __init__(self, rows=()):
+        self.count = 0
+        self.total = 0
+        self.update(rows)
 
-def create_rows(data, cursor, table_name, format_funcs=None, prefix='', postfix=''):
+    def add(self, row):
+        self.count += 1
+        self.total = (self.total + int(hashlib.md5(flatten_row(row)).hexdigest(), 16)) % (1 << 128)
+
+    def update(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def merge(self, other):
+        """Adds the rows of another digest, as if they had been added here."""
+        self.count += other.count
+        self.total = (self.total + other.total) % (1 << 128)
+
+    def hexdigest(self):
+        return '%032x' % self.total
+
+    def __eq__(self, other):
+        return isinstance(other, RowDigest) and (self.count, self.total) == (other.count, other.total)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<RowDigest of %d rows %s>' % (self.count, self.hexdigest())
+
+class ExpectedData(object):
+    """
+    The rows of some table data, as create_rows wrote them. Rows with
+    generator cells aren't stored but generated again when needed, so
+    a fixture of millions of rows takes about no memory. Other rows are
+    stored, as their format_funcs may be random.
+
+    Behaves like a list of rows: len, indexing, slicing (giving another
+    ExpectedData), iteration, `in` and == with lists. Rows a test expects
+    besides the data can be added with append, extend or +.
+    """
+    def __init__(self, data=None, format_funcs=None, seed=0):
+        self.format_funcs = format_funcs
+        self.seed = seed
+        # (count, first generated row index, cells, stored rows), where
+        # stored rows is None for generated rows and the single row
+        # repeated count times for rows with neither generators nor format_funcs
+        self._segments = []
+        if data is not None:
+            index = 0
+            for count, cells in parse_data_spec(data):
+                if has_generators(cells):
+                    self._segments.append((count, index, cells, None))
+                elif format_funcs:
+                    rows = [[format_funcs[idx](cell) for idx, cell in enumerate(cells)] for _ in xrange(count)]
+                    self._segments.append((count, None, None, rows))
+                else:
+                    self._segments.append((count, None, None, [list(cells)]))
+                index += count
+
+    def _segment_rows(self, segment, start, stop):
+        count, index, cells, rows = segment
+        if rows is None:
+            return generate_rows(cells, index + start, stop - start, seed=self.seed, format_funcs=self.format_funcs)
+        if len(rows) == 1 and count > 1:
+            return (list(rows[0]) for _ in xrange(stop - start))
+        return iter(rows[start:stop])
+
+    def _copy(self, segments):
+        copy = ExpectedData(format_funcs=self.format_funcs, seed=self.seed)
+        copy._segments = segments
+        return copy
+
+    def __len__(self):
+        return sum(segment[0] for segment in self._segments)
+
+    def __iter__(self):
+        for segment in self._segments:
+            for row in self._segment_rows(segment, 0, segment[0]):
+                yield row
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return list(self)[key]
+            segments = []
+            offset = 0
+            for segment in self._segments:
+                count, index, cells, rows = segment
+                lo, hi = max(start - offset, 0), min(stop - offset, count)
+                if lo < hi:
+                    if rows is None:
+                        segments.append((hi - lo, index + lo, cells, None))
+                    elif len(rows) == 1 and count > 1:
+                        segments.append((hi - lo, None, None, rows))
+                    else:
+                        segments.append((hi - lo, None, None, rows[lo:hi]))
+                offset += count
+            return self._copy(segments)
+
+        length = len(self)
+        if key < 0:
+            key += length
+        if not 0 <= key < length:
+            raise IndexError('ExpectedData index out of range')
+        for segment in self._segments:
+            if key < segment[0]:
+                return next(self._segment_rows(segment, key, key + 1))
+            key -= segment[0]
+
+    def __contains__(self, row):
+        return any(row == other for other in self)
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, ExpectedData)) or len(self) != len(other):
+            return False
+        return all(mine == list(theirs) for mine, theirs in itertools.izip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __add__(self, rows):
+        copy = self._copy(list(self._segments))
+        copy.extend(rows)
+        return copy
+
+    def append(self, row):
+        self._segments.append((1, None, None, [row]))
+
+    def extend(self, rows):
+        rows = list(rows)
+        if rows:
+            self._segments.append((len(rows), None, None, rows))
+
+    def digest(self):
+        return RowDigest(self)
+
+    def __repr__(self):
+        return '<ExpectedData of %d rows>' % len(self)
+
+def parse_data_into_lists(data, format_funcs=None, seed=0):
+    """
+    Returns the rows of the data as lists of CQL values. Rows of the
+    same data and seed have the same generated values.
+    """
+    return list(ExpectedData(data, format_funcs=format_funcs, seed=seed))
+
+def create_rows(data, cursor, table_name, format_funcs=None, prefix='', postfix='', seed=0,
+                chunk_rows=None, on_chunk=None):
     """
     Creates db rows using given cursor, with table name provided,
     using data formatted like:
@@ -84,26 +323,57 @@ def create_rows(data, cursor, table_name, format_funcs=None, prefix='', postfix=
     
     format_funcs is a list of functions to call to format each column
     first function used for column1, second function used for column2...
-    returns the formatted data as it would have been sent to the db.
+    they aren't called for generator cells (@seq, @uuid, @text(N)...),
+    whose values come from the seed.
+    cursor can also be a row writer, with write_row(statement, table_name,
+    headers, values) and flush(), like ingest.TokenAwareWriter.
+    with chunk_rows, on_chunk(rows written so far) is called every
+    chunk_rows rows, once they are all written (e.g. to flush them).
+    returns the formatted data as it would have been sent to the db,
+    as an ExpectedData generating the rows again when they're needed.
     """
     headers = parse_headers_into_list(data)
-    values = parse_data_into_lists(data, format_funcs=format_funcs)
+    values = ExpectedData(data, format_funcs=format_funcs, seed=seed)
     
-    # build the CQL and execute it
-    statements = []
+    # a row writer (see ingest.py) decides where each insert goes
+    write_row = getattr(cursor, 'write_row', None)
     
-    for valueset in values:
-        statements.append(
-            "{prefix} INSERT INTO {table} ({cols}) values ({vals}) {postfix}".format(
+    # build the CQL and execute it, a row at a time
+    with timing.phase('ingest'):
+        for count, valueset in enumerate(values, 1):
+            stmt = "{prefix} INSERT INTO {table} ({cols}) values ({vals}) {postfix}".format(
                 prefix=prefix, table=table_name, cols=', '.join(headers), vals=', '.join(valueset), postfix=postfix
                 )
-            )
-    
-    for stmt in statements:
-        cursor.execute(stmt)
+            if write_row is not None:
+                write_row(stmt, table_name, headers, valueset)
+            else:
+                cursor.execute(stmt)
+            if chunk_rows and count % chunk_rows == 0 and on_chunk is not None:
+                if write_row is not None:
+                    cursor.flush()
+                on_chunk(count)
+        if write_row is not None:
+            cursor.flush()
     
     return values
 
+# what parse_storage_state accepts
+STORAGE_STATES = ('memtable', 'flushed', 'sstables:N', 'compacted')
+
+def parse_storage_state(state):
+    """
+    Parses a storage state for table data: 'memtable' (left as written),
+    'flushed', 'sstables:N' (flushed in N sstables) or 'compacted' (flushed
+    then major compacted). Returns (name, sstables), sstables being N for
+    'sstables:N' and None otherwise.
+    """
+    name, _, count = state.partition(':')
+    if name == 'sstables' and count.isdigit() and int(count) > 0:
+        return name, int(count)
+    if name in ('memtable', 'flushed', 'compacted') and not count:
+        return name, None
+    raise ValueError("Unknown storage state %s (expected one of %s)" % (state, ', '.join(STORAGE_STATES)))
+
 def cql_str(val):
     """
     Changes "val" to "'val'", so the inner values
@@ -113,17 +383,14 @@ def cql_str(val):
 
 def flatten_into_set(iterable):
     # use flatten() then convert to a set for set comparisons
-    return set(flatten(iterable))
+    return set(flatten_row(sublist) for sublist in iterable)
+
+def flatten_row(row):
+    # [1, one, bananas] -> 1__one__bananas
+    return '__'.join(str(item) for item in row)
 
 def flatten(iterable):
     # flattens a nested list like: [[1, one, bananas], [2, two, oranges]]
     # into: [1__one__bananas, 2__two__oranges] (all elements cast as str)
     # why? so the lists can be compared more easily
-    
-    flattened = []
-    
-    for sublist in iterable:
-        items = [str(item) for item in sublist]
-        flattened.append('__'.join(items))
-    
-    return flattened
+    return [flatten_row(sublist) for sublist in iterable]
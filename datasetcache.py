@@ -0,0 +1,159 @@
+"""
+On-disk cache of seeded table data. The first test to create some data
+snapshots the table on every node and keeps the sstables; later tests
+creating the same data (same schema, table data, seed and ring) link the
+sstables back into their nodes and refresh the table instead of inserting
+the rows again.
+
+Only rings with fixed tokens can be cached (no vnodes, as with the
+fast-boot profile): with random tokens the data lands on other nodes
+every run. The format_funcs of cached data must not be random, as the
+rows are rebuilt from the table data rather than stored.
+"""
+import hashlib, json, os, re, shutil, time
+
+# snapshot tag of the sstables being cached
+SNAPSHOT_TAG = 'dtest-dataset-cache'
+
+def dataset_key(schema, data, seed, format_funcs, topology):
+    """
+    Key of some table data: a hash of the keyspace and table schema, the
+    table data and seed (and the names of the format_funcs) and the ring.
+    """
+    funcs = [getattr(f, '__name__', repr(f)) for f in format_funcs or ()]
+    key = json.dumps([schema, data.strip(), seed, funcs, topology], sort_keys=True)
+    return hashlib.sha1(key).hexdigest()
+
+def cluster_topology(cluster, num_tokens=None):
+    """
+    What decides where data lives in a ccm cluster, given the num_tokens
+    its nodes were configured with: version, partitioner and the nodes
+    with their tokens. None when the tokens are random.
+    """
+    if num_tokens is not None and int(num_tokens) > 1:
+        return None
+    nodes = [(node.name, node.network_interfaces['storage'][0], str(node.initial_token)) for node in cluster.nodelist()]
+    if any(token == 'None' for _, _, token in nodes):
+        return None
+    return [cluster.version(), cluster.partitioner, nodes]
+
+# 2.1 on: <table>-<cfid>
+TABLE_DIR_RE = re.compile(r'^(\w+)-([0-9a-f]{32})$')
+
+def table_id(session, keyspace, table):
+    """The cf_id of a table (as in its 2.1 data directory name), or None before 2.0."""
+    try:
+        rows = session.execute("SELECT cf_id FROM system.schema_columnfamilies "
+                               "WHERE keyspace_name = '%s' AND columnfamily_name = '%s'" % (keyspace, table)).all()
+    except:
+        # java exceptions included: no such column
+        return None
+    return str(rows[0].getUUID('cf_id')).replace('-', '') if rows else None
+
+def table_data_dir(node, keyspace, table, cf_id=None):
+    """
+    Data directory of a table on node: data/<ks>/<table> up to 2.0, or
+    data/<ks>/<table>-<cf_id> from 2.1 on, cf_id (see table_id) telling
+    the live directory from those of dropped tables of the same name.
+    Fails rather than guess when the table has no directory, or several.
+    """
+    ks_dir = os.path.join(node.get_path(), 'data', keyspace)
+    for name in [table] + (['%s-%s' % (table, cf_id)] if cf_id is not None else []):
+        if os.path.isdir(os.path.join(ks_dir, name)):
+            return os.path.join(ks_dir, name)
+    found = sorted(name for name in (os.listdir(ks_dir) if os.path.isdir(ks_dir) else [])
+                   if TABLE_DIR_RE.match(name) and TABLE_DIR_RE.match(name).group(1) == table)
+    if len(found) == 1 and cf_id is None:
+        return os.path.join(ks_dir, found[0])
+    raise RuntimeError("Can't tell the data directory of %s.%s on %s (cf_id %s, found %s)" % (
+        keyspace, table, node.name, cf_id, ', '.join(found) or 'none'))
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # different file systems
+        shutil.copy2(src, dst)
+
+class DatasetCache(object):
+    """
+    Cache entries are directories named by dataset_key, with the sstables
+    of each node in a sub directory named after it. The least recently
+    used entries are removed to keep the cache under max_bytes.
+    """
+    def __init__(self, directory, max_bytes, log=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.log = log or (lambda msg: None)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def restore(self, key, nodes, keyspace, table, cf_id=None):
+        """
+        Loads the cached sstables of key into the (empty) table on every
+        node. Returns False if there are none. cf_id is the table's, which
+        locates its data directory from 2.1 on (see table_data_dir).
+        """
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return False
+        start = time.time()
+        for node in nodes:
+            source = os.path.join(entry, node.name)
+            target = table_data_dir(node, keyspace, table, cf_id)
+            for name in os.listdir(source):
+                if os.path.exists(os.path.join(target, name)):
+                    raise RuntimeError("%s already has %s, restore into an empty table" % (node.name, name))
+                _link_or_copy(os.path.join(source, name), os.path.join(target, name))
+            node.nodetool('refresh %s %s' % (keyspace, table))
+        # marks the entry as recently used
+        os.utime(entry, None)
+        self.log("restored {}.{} from dataset cache {} in {:.1f}s".format(keyspace, table, key, time.time() - start))
+        return True
+
+    def store(self, key, nodes, keyspace, table, cf_id=None):
+        """Snapshots the table on every node and keeps the sstables under key."""
+        entry = self._entry(key)
+        partial = entry + '.partial'
+        if os.path.exists(partial):
+            shutil.rmtree(partial)
+        for node in nodes:
+            node.nodetool('snapshot -cf %s -t %s %s' % (table, SNAPSHOT_TAG, keyspace))
+            snapshot = os.path.join(table_data_dir(node, keyspace, table, cf_id), 'snapshots', SNAPSHOT_TAG)
+            try:
+                if not os.path.isdir(snapshot):
+                    raise RuntimeError("No snapshot of %s.%s on %s" % (keyspace, table, node.name))
+                target = os.path.join(partial, node.name)
+                os.makedirs(target)
+                for name in os.listdir(snapshot):
+                    _link_or_copy(os.path.join(snapshot, name), os.path.join(target, name))
+            finally:
+                node.nodetool('clearsnapshot -t %s %s' % (SNAPSHOT_TAG, keyspace))
+        # another test may have stored it meanwhile
+        if os.path.exists(entry):
+            shutil.rmtree(partial)
+        else:
+            os.rename(partial, entry)
+        self.log("stored {}.{} in dataset cache {}".format(keyspace, table, key))
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and not name.endswith('.partial'):
+                size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+                entries.append((os.path.getmtime(path), path, size))
+        entries.sort()
+        total = sum(size for _, _, size in entries)
+        # the most recent entry is always kept
+        for _, path, size in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path)
+            total -= size
+            self.log("evicted dataset cache {}".format(path))
@@ -0,0 +1,372 @@
+"""
+In-memory stand-in for the parts of the DataStax java driver the harness
+uses (Session, SimpleStatement, ResultSet, Row and traces), so PageFetcher,
+datahelp and the other helpers can be unit tested without a cluster.
+
+FakeSession understands the CQL the paging tests send:
+
+    CREATE TABLE t ( ... PRIMARY KEY (...) )
+    INSERT INTO t (cols) values (vals) [USING TTL n]
+    SELECT * FROM t [WHERE col = v [AND col IN (v, ...)]] [ORDER BY col ASC]
+                    [LIMIT n] [ALLOW FILTERING]
+    SELECT * FROM t WHERE token(cols) > n AND token(cols) <= m
+    DELETE FROM t WHERE col = v [AND ...]
+
+Other statements (USE, CREATE KEYSPACE/INDEX...) are accepted and ignored.
+Rows come back sorted by primary key, and each page is read from the
+current table contents after the last row returned, so changes made
+between pages show up like they would on a real cluster.
+"""
+import hashlib, re, struct, threading, time, uuid
+from collections import deque
+
+DEFAULT_FETCH_SIZE = 5000
+
+UUID_RE = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+
+CREATE_TABLE_RE = re.compile(r'^\s*create\s+table\s+(\w+)\s*\((.*)\)(\s+with\s+.*)?\s*$', re.I | re.S)
+INSERT_RE = re.compile(r'^\s*insert\s+into\s+(\w+)\s*\(([^)]*)\)\s*values\s*\((.*)\)\s*(using\s+ttl\s+(\d+))?\s*$', re.I | re.S)
+SELECT_RE = re.compile(r'^\s*select\s+\*\s+from\s+(\w+)(\s+where\s+(.*?))?(\s+order\s+by\s+\w+\s+(asc|desc))?'
+                       r'(\s+limit\s+(\d+))?(\s+allow\s+filtering)?\s*$', re.I | re.S)
+DELETE_RE = re.compile(r'^\s*delete\s+from\s+(\w+)\s+where\s+(.*?)\s*$', re.I | re.S)
+CONDITION_RE = re.compile(r'^\s*(\w+)\s*(?:=\s*(.+?)|\s+in\s*\((.*)\))\s*$', re.I | re.S)
+TOKEN_CONDITION_RE = re.compile(r'^\s*token\s*\(([^)]*)\)\s*(>|>=|<|<=)\s*(-?\d+)\s*$', re.I)
+
+class FakeDriverError(Exception):
+    """Raised for CQL the fake driver doesn't understand."""
+
+def parse_literal(literal):
+    """Turns a CQL literal into the python value a row getter returns."""
+    literal = literal.strip()
+    if literal.startswith("'") and literal.endswith("'") and len(literal) >= 2:
+        return literal[1:-1].replace("''", "'")
+    if literal.lower() in ('true', 'false'):
+        return literal.lower() == 'true'
+    if literal.lower() == 'null':
+        return None
+    if UUID_RE.match(literal):
+        return uuid.UUID(literal)
+    try:
+        return int(literal)
+    except ValueError:
+        pass
+    try:
+        return float(literal)
+    except ValueError:
+        raise FakeDriverError("Unsupported literal: %s" % literal)
+
+def fake_token(values):
+    """Token of some partition key values, a signed 64 bit int like Murmur3's (but not the same)."""
+    token = struct.unpack('>q', hashlib.md5(repr(tuple(values))).digest()[:8])[0]
+    # like Murmur3Partitioner, no key gets the lowest token
+    return token if token != -2 ** 63 else 2 ** 63 - 1
+
+def split_values(values):
+    """Splits a comma separated list of CQL literals, minding quoted commas."""
+    return [v.strip() for v in re.findall(r"(?:'(?:[^']|'')*'|[^,'])+", values)]
+
+class FakeStatement(object):
+    """Stand-in for SimpleStatement."""
+    def __init__(self, query):
+        self.query = query
+        self.fetch_size = 0
+        self.consistency_level = None
+        self.tracing = False
+
+    def enableTracing(self):
+        self.tracing = True
+        return self
+
+    def getQueryString(self):
+        return self.query
+
+    def setFetchSize(self, fetch_size):
+        self.fetch_size = fetch_size
+        return self
+
+    def getFetchSize(self):
+        return self.fetch_size
+
+    def setConsistencyLevel(self, consistency_level):
+        self.consistency_level = consistency_level
+        return self
+
+    def getConsistencyLevel(self):
+        return self.consistency_level
+
+class FakeAddress(object):
+    def __init__(self, address):
+        self.address = address
+
+    def getHostAddress(self):
+        return self.address
+
+class FakeTraceEvent(object):
+    def __init__(self, description, source, elapsed):
+        self.description = description
+        self.source = FakeAddress(source)
+        self.elapsed = elapsed
+
+    def getDescription(self):
+        return self.description
+
+    def getSource(self):
+        return self.source
+
+    def getSourceElapsedMicros(self):
+        return self.elapsed
+
+class FakeQueryTrace(object):
+    """Stand-in for QueryTrace: a page read on a single node, 1 microsecond per row."""
+    def __init__(self, rows):
+        self.events = [FakeTraceEvent('Parsing select', '127.0.0.1', 10),
+                       FakeTraceEvent('Merging data from memtables and 1 sstables', '127.0.0.1', 20),
+                       FakeTraceEvent('Read %d live and 0 tombstoned cells' % rows, '127.0.0.1', 20 + rows)]
+
+    def getDurationMicros(self):
+        return self.events[-1].elapsed + 5
+
+    def getCoordinator(self):
+        return FakeAddress('127.0.0.1')
+
+    def getEvents(self):
+        return self.events
+
+class FakeExecutionInfo(object):
+    def __init__(self, trace):
+        self.trace = trace
+
+    def getQueryTrace(self):
+        return self.trace
+
+class FakeRow(object):
+    """Stand-in for Row, with getters returning the stored python values."""
+    def __init__(self, values):
+        self.values = values
+
+    def _get(self, name):
+        return self.values.get(name)
+
+    getString = getUUID = getBool = getInt = getLong = getDouble = getFloat = getDate = _get
+
+    def isNull(self, name):
+        return self.values.get(name) is None
+
+    def __repr__(self):
+        return 'FakeRow(%r)' % (self.values,)
+
+class FakeTable(object):
+    def __init__(self, name, partition_key=None, clustering=()):
+        self.name = name
+        # without a CREATE TABLE, every insert is its own row
+        self.partition_key = tuple(partition_key) if partition_key is not None else None
+        self.clustering = tuple(clustering)
+        self.rows = {}
+        self._sequence = 0
+
+    def key(self, values):
+        if self.partition_key is None:
+            self._sequence += 1
+            return (self._sequence,)
+        return tuple(values.get(col) for col in self.partition_key + self.clustering)
+
+    def live_rows(self):
+        """(key, values) pairs sorted by primary key, leaving expired rows out."""
+        now = time.time()
+        return sorted((key, values) for key, (values, expires) in self.rows.items()
+                      if expires is None or expires > now)
+
+class FakeResultSet(object):
+    """
+    Stand-in for ResultSet. Pages are fetched synchronously, by
+    isExhausted(), one() or iteration, with the fetch size the statement
+    has at that time (DEFAULT_FETCH_SIZE if it is not positive).
+    """
+    def __init__(self, session, statement=None, query=None):
+        self.session = session
+        self.statement = statement
+        self.query = query
+        self.available = deque()
+        self.execution_infos = []
+        self.fully_fetched = query is None
+        self.pages_fetched = 0
+        # key of the last row fetched, pages resume after it
+        self._last_key = None
+        self._returned = 0
+        if query is not None:
+            self.fetchMoreResults()
+
+    def fetchMoreResults(self):
+        if self.fully_fetched:
+            return
+        self.pages_fetched += 1
+        self.session._before_page(self.pages_fetched)
+
+        fetch_size = self.statement.getFetchSize()
+        if fetch_size <= 0:
+            fetch_size = DEFAULT_FETCH_SIZE
+        table, matches, limit = self.query
+        remaining = None if limit is None else limit - self._returned
+        with self.session.lock:
+            rows = [(key, values) for key, values in table.live_rows()
+                    if (self._last_key is None or key > self._last_key) and matches(values)]
+        if remaining is not None:
+            rows = rows[:remaining]
+
+        page = rows[:fetch_size]
+        self.available.extend(FakeRow(values) for _, values in page)
+        self.execution_infos.append(FakeExecutionInfo(FakeQueryTrace(len(page)) if self.statement.tracing else None))
+        self._returned += len(page)
+        if page:
+            self._last_key = page[-1][0]
+        self.fully_fetched = len(rows) <= fetch_size
+
+    def isExhausted(self):
+        if not self.available:
+            self.fetchMoreResults()
+        return not self.available
+
+    def isFullyFetched(self):
+        return self.fully_fetched
+
+    def getAllExecutionInfo(self):
+        return list(self.execution_infos)
+
+    def getAvailableWithoutFetching(self):
+        return len(self.available)
+
+    def one(self):
+        if self.isExhausted():
+            return None
+        return self.available.popleft()
+
+    def all(self):
+        return list(self)
+
+    def __iter__(self):
+        while not self.isExhausted():
+            yield self.one()
+
+class FakeSession(object):
+    """
+    Stand-in for Session, keeping tables in memory.
+
+    latency is the number of seconds every page fetch takes, or a function
+    of the page number (1 for the first page of a result set) returning it.
+    failures maps page numbers to the exception fetching that page raises,
+    or is a function of the page number that raises (or returns one).
+    Sessions can be shared by threads, like the driver's.
+    """
+    def __init__(self, latency=0, failures=None):
+        self.latency = latency
+        self.failures = failures
+        self.tables = {}
+        self.closed = False
+        self.lock = threading.RLock()
+
+    def _before_page(self, page_number):
+        latency = self.latency(page_number) if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+        if callable(self.failures):
+            error = self.failures(page_number)
+        else:
+            error = (self.failures or {}).get(page_number)
+        if error is not None:
+            raise error
+
+    def table(self, name):
+        try:
+            return self.tables[name.lower()]
+        except KeyError:
+            raise FakeDriverError("unconfigured columnfamily %s" % name)
+
+    def execute(self, statement):
+        if isinstance(statement, basestring):
+            statement = FakeStatement(statement)
+        query = statement.getQueryString()
+        for regex, handler in ((SELECT_RE, self._select), (INSERT_RE, self._insert),
+                               (DELETE_RE, self._delete), (CREATE_TABLE_RE, self._create_table)):
+            m = regex.match(query)
+            if m:
+                with self.lock:
+                    return handler(statement, m)
+        # USE, CREATE KEYSPACE, CREATE INDEX...
+        return FakeResultSet(self)
+
+    def close(self):
+        self.closed = True
+
+    def _create_table(self, statement, m):
+        name, body = m.group(1).lower(), m.group(2)
+        pk = re.search(r'primary\s+key\s*\((.*)\)', body, re.I | re.S)
+        if pk:
+            parts = pk.group(1)
+            nested = re.match(r'\s*\(([^)]*)\)\s*,?(.*)$', parts, re.S)
+            if nested:
+                partition_key = [c.strip().lower() for c in nested.group(1).split(',')]
+                rest = nested.group(2)
+            else:
+                cols = parts.split(',')
+                partition_key, rest = [cols[0].strip().lower()], ','.join(cols[1:])
+            clustering = [c.strip().lower() for c in rest.split(',') if c.strip()]
+        else:
+            inline = re.search(r'(\w+)\s+\w+\s+primary\s+key', body, re.I)
+            if not inline:
+                raise FakeDriverError("No primary key in: %s" % statement.getQueryString())
+            partition_key, clustering = [inline.group(1).lower()], []
+        self.tables[name] = FakeTable(name, partition_key, clustering)
+        return FakeResultSet(self)
+
+    def _insert(self, statement, m):
+        name = m.group(1).lower()
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name)
+        table = self.tables[name]
+        cols = [c.strip().lower() for c in m.group(2).split(',')]
+        values = dict(zip(cols, [parse_literal(v) for v in split_values(m.group(3))]))
+        expires = time.time() + int(m.group(5)) if m.group(5) else None
+        table.rows[table.key(values)] = (values, expires)
+        return FakeResultSet(self)
+
+    def _conditions(self, where):
+        """Returns a function telling whether a row matches the where clause."""
+        if not where:
+            return lambda values: True
+        conditions = []
+        for condition in re.split(r'\s+and\s+', where.strip(), flags=re.I):
+            m = TOKEN_CONDITION_RE.match(condition)
+            if m:
+                conditions.append(self._token_condition(m))
+                continue
+            m = CONDITION_RE.match(condition)
+            if not m:
+                raise FakeDriverError("Unsupported condition: %s" % condition)
+            if m.group(2) is not None:
+                accepted = [parse_literal(m.group(2))]
+            else:
+                accepted = [parse_literal(v) for v in split_values(m.group(3))]
+            conditions.append(lambda values, col=m.group(1).lower(), accepted=accepted: values.get(col) in accepted)
+        return lambda values: all(condition(values) for condition in conditions)
+
+    def _token_condition(self, m):
+        cols = [c.strip().lower() for c in m.group(1).split(',')]
+        op, bound = m.group(2), int(m.group(3))
+        compare = {'>': lambda t: t > bound, '>=': lambda t: t >= bound,
+                   '<': lambda t: t < bound, '<=': lambda t: t <= bound}[op]
+        return lambda values: compare(fake_token([values.get(col) for col in cols]))
+
+    def _select(self, statement, m):
+        if m.group(5) and m.group(5).lower() == 'desc':
+            raise FakeDriverError("ORDER BY ... DESC is not supported")
+        table = self.table(m.group(1))
+        limit = int(m.group(7)) if m.group(7) else None
+        return FakeResultSet(self, statement, (table, self._conditions(m.group(3)), limit))
+
+    def _delete(self, statement, m):
+        table = self.table(m.group(1))
+        matches = self._conditions(m.group(2))
+        for key, (values, _) in table.rows.items():
+            if matches(values):
+                del table.rows[key]
+        return FakeResultSet(self)
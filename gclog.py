@@ -0,0 +1,88 @@
+"""
+GC pauses and heap pressure from a node's system.log: the GCInspector
+lines Cassandra logs for collections that took long enough (2.0 and 2.1
+formats) and its "Heap is N full" warnings.
+
+    report = parse_gc_log(open(node.logfilename()), start, end)
+    report.total_ms, report.max_ms, report.heap_warnings
+
+HybridTester reports these per node for every test, and fails tests whose
+longest pause exceeds gc_pause_budget milliseconds, when it is set.
+"""
+import re, time
+
+TIMESTAMP_RE = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3})')
+# 2.0: GC for ParNew: 234 ms for 1 collections, 123456 used; max is 1046937600
+GC_RE = re.compile(r'GCInspector.*GC for (\w+): (\d+) ms for (\d+) collections, (\d+) used; max is (\d+)')
+# 2.1: ParNew GC in 234ms.  CMS Old Gen: ...  or  G1 Young Generation GC in 234ms.  G1 Eden Space: ...
+GC_21_RE = re.compile(r'GCInspector.* - (.+?) GC in (\d+)ms')
+HEAP_RE = re.compile(r'Heap is ([\d.]+) full')
+
+def log_time(line):
+    """Time of a log line, in seconds since the epoch, or None."""
+    m = TIMESTAMP_RE.search(line)
+    if m is None:
+        return None
+    return time.mktime(time.strptime(m.group(1), '%Y-%m-%d %H:%M:%S')) + int(m.group(2)) / 1000.0
+
+class GCReport(object):
+    """GC pauses of a node: (time, collector, ms) for each GCInspector line."""
+    def __init__(self):
+        self.pauses = []
+        self.collections = 0
+        # (time, fraction of the heap used)
+        self.heap_warnings = []
+        # highest fraction of the heap seen used after a collection
+        self.max_heap_used = None
+
+    @property
+    def total_ms(self):
+        return sum(ms for _, _, ms in self.pauses)
+
+    @property
+    def max_ms(self):
+        return max([ms for _, _, ms in self.pauses] or [0])
+
+    def by_collector(self):
+        """Total pause per collector."""
+        totals = {}
+        for _, collector, ms in self.pauses:
+            totals[collector] = totals.get(collector, 0) + ms
+        return totals
+
+    def as_dict(self):
+        return {
+            'total_ms': self.total_ms,
+            'max_ms': self.max_ms,
+            'collections': self.collections,
+            'by_collector': self.by_collector(),
+            'heap_warnings': len(self.heap_warnings),
+            'max_heap_used': self.max_heap_used,
+        }
+
+def parse_gc_log(lines, start=None, end=None):
+    """GCReport of the log lines logged between start and end (epoch seconds), if given."""
+    report = GCReport()
+    for line in lines:
+        if 'GCInspector' not in line:
+            continue
+        when = log_time(line)
+        if when is not None and ((start is not None and when < start) or (end is not None and when > end)):
+            continue
+        m = GC_RE.search(line)
+        if m:
+            report.pauses.append((when, m.group(1), int(m.group(2))))
+            report.collections += int(m.group(3))
+            used = float(m.group(4)) / int(m.group(5)) if int(m.group(5)) else None
+            if used is not None and (report.max_heap_used is None or used > report.max_heap_used):
+                report.max_heap_used = used
+            continue
+        m = GC_21_RE.search(line)
+        if m:
+            report.pauses.append((when, m.group(1), int(m.group(2))))
+            report.collections += 1
+            continue
+        m = HEAP_RE.search(line)
+        if m:
+            report.heap_warnings.append((when, float(m.group(1))))
+    return report
@@ -0,0 +1,855 @@
+"""
+Unit tests of the harness itself (datahelp, PageFetcher...), run against
+the in-memory fake driver so they need neither a cluster nor the java driver.
+"""
+import os, shutil, tempfile, time
+import unittest
+
+import datahelp, timing
+from datahelp import ExpectedData, RowDigest, create_rows, cql_str, parse_data_into_lists, parse_storage_state
+from datasetcache import DatasetCache, SNAPSHOT_TAG, cluster_topology, dataset_key, table_data_dir
+from fakedriver import FakeSession, FakeStatement
+from loadrunner import LoadRunner, MixedWrites
+from rowdiff import diff_rows
+from scaling import MatrixCell, format_matrix, matrix_cells
+from gclog import log_time, parse_gc_log
+from tracehelp import event_kind, format_summary, merge_summaries, summarize_trace
+from soak import detect_drift, paging_sample, slope, steady_growth
+from servermetrics import metrics_delta, parse_cfstats, parse_tpstats
+from pagehelp import (FetchSizeTuner, PageFetcher, PageAssertionMixin, PagedQuery, PagingChecker, TokenRangeScan, run_paged_queries,
+                      split_token_ranges, MIN_TOKEN, MAX_TOKEN)
+
+FORMATTERS = [('id', 'getInt', str), ('value', 'getString', cql_str)]
+
+class TestFakeDriverPaging(unittest.TestCase, PageAssertionMixin):
+    def make_session(self, rows=9, **kwargs):
+        session = FakeSession(**kwargs)
+        session.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
+        # one row at a time for unique clustering values, as a multiplier repeats the same row
+        expected = []
+        for i in range(rows):
+            expected.extend(create_rows(
+                "|id|value|\n|1 |v%05d|" % i, session, 'paging_test', format_funcs=(str, cql_str)))
+        return session, expected
+
+    def test_pages_follow_fetch_size(self):
+        session, expected = self.make_session(rows=9)
+        results = session.execute(FakeStatement("select * from paging_test").setFetchSize(5))
+
+        pf = PageFetcher(results, formatters=FORMATTERS)
+        pf.get_all_pages()
+        self.assertEqual(pf.pagecount(), 2)
+        self.assertEqual(pf.num_results_all_pages(), [5, 4])
+        self.assertEqualIgnoreOrder(expected, pf.all_data())
+
+    def test_equal_results_to_page_size(self):
+        session, expected = self.make_session(rows=5)
+        results = session.execute(FakeStatement("select * from paging_test").setFetchSize(5))
+
+        pf = PageFetcher(results, formatters=FORMATTERS)
+        pf.get_all_pages()
+        self.assertEqual(pf.num_results_all_pages(), [5])
+        self.assertTrue(results.isExhausted())
+        self.assertTrue(results.isFullyFetched())
+
+    def test_zero_fetch_size_uses_default(self):
+        session, _ = self.make_session(rows=5001)
+        results = session.execute(FakeStatement("select * from paging_test").setFetchSize(0))
+
+        pf = PageFetcher(results, formatters=FORMATTERS)
+        pf.get_all_pages()
+        self.assertEqual(pf.num_results_all_pages(), [5000, 1])
+
+    def test_fetch_size_change_applies_to_next_page(self):
+        session, _ = self.make_session(rows=20)
+        stmt = FakeStatement("select * from paging_test where id = 1").setFetchSize(10)
+        results = session.execute(stmt)
+
+        pf = PageFetcher(results, formatters=FORMATTERS)
+        pf.get_page()
+        stmt.setFetchSize(3)
+        pf.get_all_pages()
+        self.assertEqual(pf.num_results_all_pages(), [10, 3, 3, 3, 1])
+
+    def test_limit_and_in_restriction(self):
+        session, _ = self.make_session(rows=9)
+        create_rows("|id|value|\n|2 |other|", session, 'paging_test', format_funcs=(str, cql_str))
+
+        results = session.execute(FakeStatement("select * from paging_test where id in (1, 2) limit 8").setFetchSize(5))
+        pf = PageFetcher(results, formatters=FORMATTERS)
+        pf.get_all_pages()
+        self.assertEqual(pf.num_results_all_pages(), [5, 3])
+
+    def test_writes_between_pages_are_seen_after_the_paging_position(self):
+        session, expected = self.make_session(rows=10)
+        results = session.execute(FakeStatement("select * from paging_test").setFetchSize(5))
+        pf = PageFetcher(results, formatters=FORMATTERS)
+        pf.get_page()
+
+        # sorts before the rows already paged, so it must not show up
+        session.execute("insert into paging_test (id, value) values (1, 'a')")
+        # sorts after them
+        session.execute("insert into paging_test (id, value) values (1, 'z')")
+        pf.get_all_pages()
+        self.assertEqualIgnoreOrder(pf.all_data(), expected + [['1', "'z'"]])
+
+    def test_injected_failure(self):
+        session, _ = self.make_session(rows=10, failures={2: RuntimeError('replica down')})
+        results = session.execute(FakeStatement("select * from paging_test").setFetchSize(5))
+        pf = PageFetcher(results, formatters=FORMATTERS)
+        pf.get_page()
+        with self.assertRaisesRegexp(RuntimeError, 'replica down'):
+            pf.get_remaining_pages()
+
+    def test_injected_latency(self):
+        session, _ = self.make_session(rows=10, latency=lambda page: 0.05 if page > 1 else 0)
+        results = session.execute(FakeStatement("select * from paging_test").setFetchSize(5))
+        pf = PageFetcher(results, formatters=FORMATTERS)
+
+        start = time.time()
+        pf.get_all_pages()
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_page_fetches_are_paging_time(self):
+        session, _ = self.make_session(rows=10, latency=0.01)
+        results = session.execute(FakeStatement("select * from paging_test").setFetchSize(1))
+        timing.start('test_page_fetches_are_paging_time')
+        try:
+            PageFetcher(results, formatters=FORMATTERS).get_all_pages()
+        finally:
+            timings = timing.stop()
+        self.assertGreaterEqual(timings['phases']['paging'], 0.09)
+        self.assertLess(timings['phases'].get('test', 0.0), 0.01)
+
+class TestGeneratorColumns(unittest.TestCase):
+    data = """
+          | id   | value     | ts         |
+      *2500| @seq | @text(40) | @timestamp |
+          | 0    | fixed     | @uuid      |
+        """
+
+    def test_same_seed_same_data(self):
+        self.assertEqual(parse_data_into_lists(self.data, seed=7), parse_data_into_lists(self.data, seed=7))
+        self.assertNotEqual(parse_data_into_lists(self.data, seed=7), parse_data_into_lists(self.data, seed=8))
+
+    def test_values_across_chunks(self):
+        rows = parse_data_into_lists(self.data)
+        self.assertEqual(len(rows), 2501)
+        self.assertGreater(len(rows), datahelp.GENERATOR_CHUNK)
+        self.assertEqual([row[0] for row in rows[:2500]], [str(i) for i in range(2500)])
+        self.assertEqual(rows[1][2], str(datahelp.DEFAULT_TIMESTAMP + 1000))
+        self.assertEqual(len(set(row[1] for row in rows)), 2501)
+        self.assertTrue(all(len(row[1]) == 42 and row[1][0] == "'" for row in rows[:2500]))
+
+    def test_format_funcs_skip_generator_cells(self):
+        rows = parse_data_into_lists(self.data, format_funcs=(str, cql_str, str))
+        self.assertEqual(rows[-1][:2], ['0', "'fixed'"])
+        self.assertEqual(rows[0][1], parse_data_into_lists(self.data)[0][1])
+
+    def test_generated_rows_are_inserted(self):
+        session = FakeSession()
+        session.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
+        expected = create_rows("""
+              | id | value     |
+         *1200| 1  | @text(36) |
+            """, session, 'paging_test', format_funcs=(str, cql_str), seed=3)
+        self.assertEqual(len(session.table('paging_test').rows), 1200)
+        self.assertEqual(expected, parse_data_into_lists("|id|value|\n*1200|1|@text(36)|", seed=3))
+
+    def test_row_writer(self):
+        class RecordingWriter(object):
+            def __init__(self):
+                self.rows, self.flushed = [], 0
+            def write_row(self, statement, table, headers, values):
+                self.rows.append((table, headers, values))
+            def flush(self):
+                self.flushed += 1
+
+        writer = RecordingWriter()
+        expected = create_rows("|id|value|\n*3|@seq|x|", writer, 'paging_test', format_funcs=(str, cql_str))
+        self.assertEqual(writer.rows, [('paging_test', ['id', 'value'], row) for row in expected])
+        self.assertEqual(writer.flushed, 1)
+
+    def test_chunk_callback(self):
+        session = FakeSession()
+        chunks = []
+        create_rows("|id|value|\n*25|@seq|x|", session, 'paging_test', format_funcs=(str, cql_str),
+                    chunk_rows=10, on_chunk=lambda rows: chunks.append((rows, len(session.table('paging_test').rows))))
+        self.assertEqual(chunks, [(10, 10), (20, 20)])
+
+    def test_storage_states(self):
+        self.assertEqual(parse_storage_state('memtable'), ('memtable', None))
+        self.assertEqual(parse_storage_state('compacted'), ('compacted', None))
+        self.assertEqual(parse_storage_state('sstables:8'), ('sstables', 8))
+        for state in ('sstables', 'sstables:0', 'flushed:2', 'disk'):
+            with self.assertRaisesRegexp(ValueError, 'Unknown storage state'):
+                parse_storage_state(state)
+
+    def test_unknown_generator(self):
+        with self.assertRaisesRegexp(ValueError, 'Unknown generator @nope'):
+            parse_data_into_lists("|id|\n*2|@nope|")
+
+class TestExpectedData(unittest.TestCase):
+    data = """
+           | id | value     |
+       *1500| 1  | @text(10) |
+           | 2  | two       |
+       *3   | 3  | three     |
+       *2000| 4  | @seq      |
+        """
+
+    def test_behaves_like_the_list_of_rows(self):
+        expected = ExpectedData(self.data, format_funcs=(str, cql_str), seed=5)
+        rows = parse_data_into_lists(self.data, format_funcs=(str, cql_str), seed=5)
+        self.assertEqual(len(expected), len(rows))
+        self.assertEqual(expected, rows)
+        self.assertEqual(list(expected), rows)
+        for key in (slice(None, 5), slice(1499, 1505), slice(1400, 2000), slice(-10, None), slice(0, 20, 3)):
+            self.assertEqual(list(expected[key]), rows[key])
+        self.assertEqual(list(expected[1000:3000][400:600]), rows[1400:1600])
+        self.assertEqual(expected[1500], ['2', "'two'"])
+        self.assertEqual(expected[-1], rows[-1])
+        self.assertTrue(['3', "'three'"] in expected)
+        self.assertFalse(['3', "'four'"] in expected)
+
+    def test_generated_rows_are_not_stored(self):
+        expected = ExpectedData("|id|value|\n*1000000|1|@text(36)|", format_funcs=(str, cql_str))
+        self.assertEqual(len(expected), 1000000)
+        self.assertEqual(expected[999999:], [expected[-1]])
+
+    def test_append_extend_and_add(self):
+        expected = ExpectedData(self.data)[:2]
+        expected.append(['9', 'nine'])
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(len(expected + [['10', 'ten']]), 4)
+        expected.extend([['11', 'eleven']])
+        self.assertEqual(expected[-2:], [['9', 'nine'], ['11', 'eleven']])
+
+    def test_digest_ignores_order(self):
+        expected = ExpectedData(self.data, seed=1)
+        rows = list(expected)
+        self.assertEqual(expected.digest(), RowDigest(reversed(rows)))
+        self.assertNotEqual(expected.digest(), RowDigest(rows[1:]))
+        self.assertNotEqual(expected.digest(), RowDigest(rows + rows[:1]))
+
+    def test_page_fetcher_digest(self):
+        session = FakeSession()
+        session.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
+        expected = create_rows("""
+              | id | value     |
+         *2000| 1  | @text(36) |
+         *1000| 2  | @text(36) |
+            """, session, 'paging_test', format_funcs=(str, cql_str))
+        pf = PageFetcher(session.execute(FakeStatement("select * from paging_test").setFetchSize(700)), formatters=FORMATTERS)
+        pf.get_page()
+        self.assertNotEqual(pf.digest, expected.digest())
+        pf.get_remaining_pages()
+        self.assertEqual(pf.digest, expected.digest())
+
+class TestPagingChecker(unittest.TestCase, PageAssertionMixin):
+    def test_int_ids(self):
+        checker = PagingChecker(key=lambda row: int(row[0]), count=20, first=100)
+        checker.add_page([[i] for i in range(100, 105)])
+        checker.add_page([[i] for i in range(104, 110)])
+        # 110 to 112 are skipped
+        checker.add_page([[i] for i in range(113, 120)] + [[500]])
+        report = checker.finish()
+        self.assertFalse(report.ok())
+        self.assertEqual(report.rows, 19)
+        self.assertEqual(report.duplicates, [(104, 2)])
+        self.assertEqual(report.missing, [(110, [2, 3]), (111, [2, 3]), (112, [2, 3])])
+        self.assertEqual(report.unexpected, [(500, 3)])
+        with self.assertRaisesRegexp(AssertionError, '1 duplicated.*3 missing.*1 unexpected'):
+            self.assertPagedExactlyOnce(checker)
+
+    def test_million_int_ids(self):
+        checker = PagingChecker(key=lambda row: row[0], count=1000000)
+        for start in range(0, 1000000, 5000):
+            checker.add_page([[i] for i in xrange(start, start + 5000)])
+        self.assertEqual(len(checker.bits), 125000)
+        self.assertPagedExactlyOnce(checker)
+
+    def test_other_ids(self):
+        keys = ['key%d' % i for i in range(1000)]
+        checker = PagingChecker(key=lambda row: row[0], capacity=len(keys))
+        checker.add_page([[key] for key in keys[:600]])
+        checker.add_page([[key] for key in keys[599:900]])
+        report = checker.finish(expected_ids=keys)
+        self.assertFalse(report.ok())
+        self.assertIn(('key599', 2), checker.suspects)
+        self.assertGreater(report.missing_count, 90)
+        self.assertTrue(all(int(key[3:]) >= 900 and pages == [] for key, pages in report.missing))
+
+        checker = PagingChecker(key=lambda row: row[0], capacity=len(keys))
+        checker.add_page([[key] for key in keys])
+        self.assertPagedExactlyOnce(checker, expected_ids=keys)
+
+    def test_many_missing_ids(self):
+        checker = PagingChecker(key=lambda row: row[0], count=200000)
+        # 1000 pages of the first half of the ids
+        for start in range(0, 100000, 100):
+            checker.add_page([[i] for i in xrange(start, start + 100)])
+        started = time.time()
+        report = checker.finish()
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(report.missing_count, 100000)
+        self.assertEqual(len(report.missing), checker.max_reported)
+        self.assertEqual(report.missing[0], (100000, [1000]))
+
+    def test_missing_id_with_repeated_hashes(self):
+        checker = PagingChecker(key=lambda row: row[0], capacity=1)
+        # a missing id two of whose hashes land on the same counter
+        missing = next(key for key in ('missing%d' % i for i in xrange(1000))
+                       if len(set(checker._hashes(key))) < len(checker._hashes(key)))
+        repeated = [slot for slot in checker._hashes(missing) if checker._hashes(missing).count(slot) > 1][0]
+        # seen ids setting its counters, the repeated one to 1 only
+        seen = []
+        for key in ('seen%d' % i for i in xrange(1000)):
+            slots = set(checker._slots(key))
+            covered = set().union(*[set(checker._slots(other)) for other in seen])
+            if (repeated in slots and repeated in covered) or not slots - covered:
+                continue
+            seen.append(key)
+            if set(checker._hashes(missing)) <= covered | slots:
+                break
+        checker.add_page([[key] for key in seen])
+        # taken out of the filter first, it passes as a false positive and
+        # seen ids sharing its counters are reported missing instead
+        report = checker.finish(expected_ids=[missing] + seen)
+        self.assertFalse(report.ok())
+        self.assertGreater(report.missing_count, 0)
+
+    def test_saturated_counters(self):
+        keys = ['key%d' % i for i in range(1000)]
+        # far too small, so counters overflow
+        checker = PagingChecker(key=lambda row: row[0], capacity=1)
+        checker.add_page([[key] for key in keys])
+        report = checker.finish(expected_ids=keys)
+        self.assertTrue(report.ok(), str(report))
+        self.assertGreater(report.saturated, 0)
+        self.assertIn("saturated", str(report))
+
+    def test_page_fetcher_without_data(self):
+        session, _ = TestFakeDriverPaging('test_pages_follow_fetch_size').make_session(rows=12)
+        checker = PagingChecker(key=lambda row: int(row[1][2:-1]), count=12)
+        pf = PageFetcher(session.execute(FakeStatement("select * from paging_test").setFetchSize(5)),
+                         formatters=FORMATTERS, keep_data=False, checker=checker)
+        pf.get_all_pages()
+        self.assertEqual(pf.num_results_all_pages(), [5, 5, 2])
+        self.assertEqual(pf.all_data(), [])
+        self.assertPagedExactlyOnce(checker)
+
+class TestFetchSizeTuner(unittest.TestCase, PageAssertionMixin):
+    def setUp(self):
+        self.session = FakeSession(latency=lambda page: 0.002 if page > 1 else 0)
+        self.session.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
+        # rows of 1 + 12 bytes when formatted
+        self.expected = create_rows("""
+              | id | value     |
+          *500| 1  | @text(10) |
+            """, self.session, 'paging_test', format_funcs=(str, cql_str))
+
+    def test_target_bytes(self):
+        stmt = FakeStatement("select * from paging_test").setFetchSize(5)
+        logged = []
+        tuner = FetchSizeTuner(stmt, target_bytes=13 * 40, min_size=1, log=logged.append)
+        pf = PageFetcher(self.session.execute(stmt), FORMATTERS, tuner=tuner)
+        pf.get_all_pages()
+        # doubles up to 40 rows a page, then stays there
+        self.assertEqual(pf.num_results_all_pages()[:6], [5, 10, 20, 40, 40, 40])
+        self.assertEqual(len(logged), pf.pagecount())
+        self.assertIn("page 1: 5 rows of 13 bytes, fetch size 5 -> 10", logged[0])
+        self.assertEqualIgnoreOrder(pf, self.expected)
+
+    def test_target_latency(self):
+        stmt = FakeStatement("select * from paging_test").setFetchSize(50)
+        tuner = FetchSizeTuner(stmt, target_latency=10, max_size=150)
+        pf = PageFetcher(self.session.execute(stmt), FORMATTERS, tuner=tuner)
+        pf.get_all_pages()
+        # no latency for the first page, then pages are too fast
+        self.assertEqual(tuner.decisions[0][3], None)
+        self.assertEqual(tuner.decisions[0][4], 50)
+        self.assertEqual(pf.num_results_all_pages(), [50, 50, 100, 150, 150])
+        self.assertEqual(pf.digest, self.expected.digest())
+
+    def test_latency_leaves_out_the_caller(self):
+        stmt = FakeStatement("select * from paging_test").setFetchSize(100)
+        tuner = FetchSizeTuner(stmt, target_latency=10)
+        pf = PageFetcher(self.session.execute(stmt), FORMATTERS, tuner=tuner)
+        while pf.get_page() is not None:
+            # the test's own work between pages
+            time.sleep(0.05)
+        latencies = [decision[3] for decision in tuner.decisions[1:]]
+        self.assertTrue(latencies)
+        self.assertTrue(all(0.002 <= latency < 0.04 for latency in latencies), latencies)
+
+    def test_needs_a_target(self):
+        with self.assertRaises(ValueError):
+            FetchSizeTuner(FakeStatement("select * from paging_test"))
+
+class TestConcurrentPaging(unittest.TestCase, PageAssertionMixin):
+    def test_queries_are_checked(self):
+        session = FakeSession(latency=0.001)
+        session.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
+        expected = create_rows("""
+              | id | value     |
+          *300| 1  | @text(10) |
+          *200| 2  | @text(10) |
+            """, session, 'paging_test', format_funcs=(str, cql_str))
+        digests = {1: expected[:300].digest(), 2: expected[300:].digest()}
+
+        queries = [PagedQuery(FakeStatement("select * from paging_test where id = %d" % (i % 2 + 1)).setFetchSize(10 + i),
+                              expected=digests[i % 2 + 1]) for i in range(40)]
+        stats = run_paged_queries(session, queries, FORMATTERS, workers=8)
+        self.assertPagedQueriesOk(queries)
+        self.assertEqual(stats['rows'], 20 * 300 + 20 * 200)
+        self.assertEqual(queries[0].pages, 30)
+        self.assertEqual(len(queries[0].page_latencies), 30)
+        self.assertGreater(stats['page_latency']['p50'], 0)
+
+        queries = [PagedQuery(FakeStatement("select * from paging_test where id = 1"), expected=digests[2]),
+                   PagedQuery(FakeStatement("select * from nope"))]
+        run_paged_queries(session, queries, FORMATTERS)
+        with self.assertRaisesRegexp(AssertionError, '2 of 2 paged queries failed.*300 rows not matching the 200 expected.*unconfigured columnfamily nope'):
+            self.assertPagedQueriesOk(queries)
+
+    def test_split_token_ranges(self):
+        self.assertEqual(split_token_ranges([]), [(MIN_TOKEN, MAX_TOKEN)])
+        # balanced ccm tokens start at the lowest one
+        self.assertEqual(split_token_ranges(['-9223372036854775808', '0']), [(MIN_TOKEN, 0), (0, MAX_TOKEN)])
+        ranges = split_token_ranges([100, -100, 100], splits=4)
+        self.assertEqual(len(ranges), 12)
+        self.assertEqual(ranges[0][0], MIN_TOKEN)
+        self.assertEqual(ranges[-1][1], MAX_TOKEN)
+        self.assertTrue(all(start < end for start, end in ranges))
+        self.assertTrue(all(a[1] == b[0] for a, b in zip(ranges, ranges[1:])))
+        self.assertIn((50, 100), ranges)
+
+    def test_token_range_scan(self):
+        session = FakeSession()
+        session.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
+        expected = create_rows("""
+              | id     | value     |
+          *500| @seq   | @text(10) |
+          *100| 7      | @text(10) |
+            """, session, 'paging_test', format_funcs=(str, cql_str))
+
+        scan = TokenRangeScan(session, 'paging_test', 'id', [-2 ** 62, 0, 2 ** 62], FORMATTERS,
+                              FakeStatement, fetch_size=50, splits=3, keep_data=True)
+        stats = scan.run(workers=4)
+        self.assertEqual(len(scan.queries), 12)
+        self.assertEqual(stats['rows'], 600)
+        self.assertEqual(scan.digest, expected.digest())
+        self.assertEqualIgnoreOrder(scan.all_data(), expected)
+        self.assertEqual(sum(page.count for page in scan.pages), 600)
+
+class TestLoadRunner(unittest.TestCase, PageAssertionMixin):
+    def test_mixed_writes(self):
+        load = MixedWrites('paging_test', {'id': '1'}, 'sometext', 'value', keys=5)
+        writes = [load() for _ in range(200)]
+        self.assertEqual(set(kind for kind, _ in writes), set(['insert', 'update', 'delete', 'ttl']))
+        self.assertEqual(writes[0][0], 'insert')
+        self.assertRegexpMatches(writes[0][1], r"^INSERT INTO paging_test \(id, sometext, value\) values \(1, 'churn-00000\d', 'v1'\)$")
+        deleted = [query for kind, query in writes if kind == 'delete']
+        self.assertTrue(deleted[0].startswith("DELETE FROM paging_test WHERE id = 1 AND sometext = 'churn-00000"))
+        self.assertIn(' USING TTL 1', [query for kind, query in writes if kind == 'ttl'][0])
+        self.assertTrue(MixedWrites.is_churn("'churn-000004'"))
+
+    def test_paging_under_load(self):
+        session = FakeSession(latency=0.002)
+        session.execute("CREATE TABLE paging_test ( id int, sometext text, value text, PRIMARY KEY (id, sometext) )")
+        stable = create_rows("""
+              | id | sometext  | value |
+          *300| 1  | @text(10) | 'x'   |
+            """, session, 'paging_test', format_funcs=(str, cql_str, str))
+
+        runner = LoadRunner(session, MixedWrites('paging_test', {'id': '1'}, 'sometext', 'value', keys=50), rate=2000)
+        runner.start()
+        try:
+            time.sleep(0.05)
+            stmt = FakeStatement("select * from paging_test where id = 1").setFetchSize(20)
+            pf = PageFetcher(session.execute(stmt), [('id', 'getInt', str), ('sometext', 'getString', cql_str),
+                                                     ('value', 'getString', cql_str)])
+            pf.get_all_pages()
+        finally:
+            stats = runner.stop()
+        self.assertGreater(stats['writes'], 0)
+        self.assertEqual(stats['errors'], 0)
+        self.assertGreater(pf.pagecount(), 15)
+        self.assertPagedUnderLoad(pf, stable, key=lambda row: tuple(row[:2]), volatile=lambda row: MixedWrites.is_churn(row[1]))
+
+        with self.assertRaisesRegexp(AssertionError, '1 rows paged more than once'):
+            self.assertPagedUnderLoad(list(stable) + [stable[0]], stable, key=lambda row: tuple(row[:2]), volatile=lambda row: False)
+        with self.assertRaisesRegexp(AssertionError, 'Rows not written to changed under load'):
+            self.assertPagedUnderLoad(stable[1:], stable, key=lambda row: tuple(row[:2]), volatile=lambda row: False)
+
+class TestScalingMatrix(unittest.TestCase):
+    def test_matrix_cells(self):
+        self.assertEqual(matrix_cells(nodes=(1, 3), rfs=(1, 2), cls=('ONE', 'ALL')),
+                         [(1, 1, 'ONE'), (1, 1, 'ALL'),
+                          (3, 1, 'ONE'), (3, 1, 'ALL'), (3, 2, 'ONE'), (3, 2, 'ALL')])
+        self.assertEqual(len(matrix_cells()), 45)
+
+    def test_format_matrix(self):
+        session = FakeSession()
+        session.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
+        create_rows("""
+              | id | value     |
+          *100| 1  | @text(10) |
+            """, session, 'paging_test', format_funcs=(str, cql_str))
+        stats = run_paged_queries(session, [PagedQuery(FakeStatement("select * from paging_test"))], FORMATTERS)
+        cells = [MatrixCell(3, 2, 'QUORUM', stats), MatrixCell(3, 3, 'ALL', error='Not enough replicas')]
+        lines = format_matrix(cells).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertRegexpMatches(lines[1], r'^    3   2  QUORUM +\d+ +\d\.\d{3}s +\d\.\d{3}s$')
+        self.assertEqual(lines[2], '    3   3  ALL      failed: Not enough replicas')
+        self.assertEqual(cells[0].as_dict()['rows'], 100)
+        self.assertEqual(cells[1].as_dict(), {'nodes': 3, 'rf': 3, 'cl': 'ALL', 'error': 'Not enough replicas'})
+
+TPSTATS = """\
+Pool Name                    Active   Pending      Completed   Blocked  All time blocked
+ReadStage                         0         0             %d         0                 0
+MutationStage                     1         0           3000         0                %d
+
+Message type           Dropped
+RANGE_SLICE                  0
+READ                         %d
+"""
+
+CFSTATS = """\
+Keyspace: system
+\tRead Count: 40
+\t\tTable: local
+\t\tLocal read count: 40
+----------------
+Keyspace: test_paging_size
+\tRead Count: 5
+\t\tTable: paging_test
+\t\tSSTable count: 2
+\t\tSpace used (live), bytes: 53412
+\t\tLocal read count: %d
+\t\tLocal read latency: 1.250 ms
+\t\tLocal write count: 1000
+\t\tAverage tombstones per slice (last five minutes): %s
+\t\tBloom filter false ratio: NaN
+\t\tMemtable cell count: %d
+\t\tCompacted partition mean bytes: 310
+----------------
+"""
+
+class TestServerMetrics(unittest.TestCase):
+    def test_parse_tpstats(self):
+        metrics = parse_tpstats(TPSTATS % (10, 0, 2))
+        self.assertEqual(metrics['tpstats.ReadStage.completed'], 10)
+        self.assertEqual(metrics['tpstats.MutationStage.active'], 1)
+        self.assertEqual(metrics['tpstats.MutationStage.all_time_blocked'], 0)
+        self.assertEqual(metrics['dropped.READ'], 2)
+        self.assertEqual(len(metrics), 12)
+
+    def test_parse_cfstats(self):
+        metrics = parse_cfstats(CFSTATS % (5, '0.0', 4990))
+        self.assertEqual(metrics, {
+            'test_paging_size.paging_test.sstable_count': 2,
+            'test_paging_size.paging_test.space_used_bytes': 53412,
+            'test_paging_size.paging_test.local_read_count': 5,
+            'test_paging_size.paging_test.local_read_latency': 1.25,
+            'test_paging_size.paging_test.local_write_count': 1000,
+            'test_paging_size.paging_test.average_tombstones_per_slice': 0.0,
+            'test_paging_size.paging_test.memtable_cell_count': 4990,
+            'test_paging_size.paging_test.compacted_partition_mean_bytes': 310,
+        })
+
+    def test_metrics_delta(self):
+        before = parse_tpstats(TPSTATS % (10, 7, 0))
+        before.update(parse_cfstats(CFSTATS % (5, '0.0', 4990)))
+        # flushed
+        after = parse_tpstats(TPSTATS % (25, 9, 3))
+        after.update(parse_cfstats(CFSTATS % (8, '499.5', 0)))
+        after['unknown.metric'] = 12
+        self.assertEqual(metrics_delta(before, after), {
+            'tpstats.ReadStage.completed': 15,
+            'tpstats.MutationStage.active': 1,
+            'tpstats.MutationStage.all_time_blocked': 2,
+            'dropped.READ': 3,
+            'test_paging_size.paging_test.sstable_count': 2,
+            'test_paging_size.paging_test.space_used_bytes': 53412,
+            'test_paging_size.paging_test.local_read_count': 3,
+            'test_paging_size.paging_test.local_read_latency': 1.25,
+            'test_paging_size.paging_test.average_tombstones_per_slice': 499.5,
+            'test_paging_size.paging_test.compacted_partition_mean_bytes': 310,
+        })
+
+GC_LOG = """\
+ INFO [main] 2014-05-20 10:12:00,000 CassandraDaemon.java (line 160) JVM vendor/version: Java HotSpot(TM) 64-Bit Server VM/1.7.0_55
+ INFO [ScheduledTasks:1] 2014-05-20 10:12:01,000 GCInspector.java (line 116) GC for ParNew: 120 ms for 1 collections, 400000000 used; max is 1000000000
+ INFO [ScheduledTasks:1] 2014-05-20 10:12:10,500 GCInspector.java (line 116) GC for ParNew: 250 ms for 2 collections, 600000000 used; max is 1000000000
+ WARN [ScheduledTasks:1] 2014-05-20 10:12:11,000 GCInspector.java (line 142) Heap is 0.8123 full.  You may need to reduce memtable and/or cache sizes.
+ INFO [ScheduledTasks:1] 2014-05-20 10:12:12,000 GCInspector.java (line 116) GC for ConcurrentMarkSweep: 1400 ms for 1 collections, 500000000 used; max is 1000000000
+INFO  [Service Thread] 2014-05-20 10:12:13,000 GCInspector.java:258 - ParNew GC in 300ms.  CMS Old Gen: 1 -> 2; Par Eden Space: 3 -> 4
+INFO  [Service Thread] 2014-05-20 10:12:14,000 GCInspector.java:258 - G1 Young Generation GC in 210ms.  G1 Eden Space: 5 -> 0
+"""
+
+class TestGCLog(unittest.TestCase):
+    def test_whole_log(self):
+        report = parse_gc_log(GC_LOG.splitlines())
+        self.assertEqual([(collector, ms) for _, collector, ms in report.pauses],
+                         [('ParNew', 120), ('ParNew', 250), ('ConcurrentMarkSweep', 1400), ('ParNew', 300),
+                          ('G1 Young Generation', 210)])
+        stats = report.as_dict()
+        self.assertEqual(stats['total_ms'], 2280)
+        self.assertEqual(stats['max_ms'], 1400)
+        self.assertEqual(stats['collections'], 6)
+        self.assertEqual(stats['by_collector'], {'ParNew': 670, 'ConcurrentMarkSweep': 1400, 'G1 Young Generation': 210})
+        self.assertEqual(stats['heap_warnings'], 1)
+        self.assertEqual(report.heap_warnings[0][1], 0.8123)
+        self.assertEqual(stats['max_heap_used'], 0.6)
+
+    def test_time_window(self):
+        start = log_time('2014-05-20 10:12:10,000')
+        report = parse_gc_log(GC_LOG.splitlines(), start, start + 2.5)
+        self.assertEqual([ms for _, _, ms in report.pauses], [250, 1400])
+        self.assertEqual(len(report.heap_warnings), 1)
+        self.assertEqual(parse_gc_log([], start).as_dict()['max_ms'], 0)
+
+class TestTracing(unittest.TestCase):
+    EVENTS = [
+        ('Parsing select * from paging_test where id = 1', '127.0.0.1', 100),
+        ('Sending message to /127.0.0.2', '127.0.0.1', 300),
+        ('Message received from /127.0.0.1', '127.0.0.2', 50),
+        ('Executing single-partition query on paging_test', '127.0.0.2', 150),
+        ('Merging memtable tombstones', '127.0.0.2', 400),
+        ('Merging data from memtables and 3 sstables', '127.0.0.2', 2400),
+        ('Read 100 live and 250 tombstoned cells', '127.0.0.2', 5400),
+        ('Enqueuing response to /127.0.0.1', '127.0.0.2', 5500),
+        ('Message received from /127.0.0.2', '127.0.0.1', 6300),
+    ]
+
+    def test_event_kind(self):
+        self.assertEqual(event_kind('Merging memtable tombstones'), 'memtable')
+        self.assertEqual(event_kind('Merging data from memtables and 3 sstables'), 'sstable')
+        self.assertEqual(event_kind('Bloom filter allows skipping sstable 4'), 'sstable')
+        self.assertEqual(event_kind('Enqueuing response to /127.0.0.1'), 'messaging')
+        self.assertEqual(event_kind('Read 100 live and 250 tombstoned cells'), 'other')
+
+    def test_summarize_trace(self):
+        summary = summarize_trace(6500, '127.0.0.1', self.EVENTS)
+        self.assertEqual(summary['duration_ms'], 6.5)
+        for key, expected in (('nodes', {'127.0.0.1': 6.3, '127.0.0.2': 5.5}),
+                              ('by_kind', {'other': 3.2, 'messaging': 6.35, 'memtable': 0.25, 'sstable': 2.0})):
+            self.assertEqual(sorted(summary[key]), sorted(expected))
+            for name in expected:
+                self.assertAlmostEqual(summary[key][name], expected[name])
+        self.assertEqual((summary['live_cells'], summary['tombstones'], summary['sstables']), (100, 250, 3))
+
+        total = merge_summaries([summary, summary])
+        self.assertEqual(total['traces'], 2)
+        self.assertEqual(total['tombstones'], 500)
+        self.assertAlmostEqual(total['nodes']['127.0.0.2'], 11.0)
+        self.assertIn('13.0ms, 200 live cells, 500 tombstones, 6 sstables', format_summary(total))
+
+    def test_traced_pages(self):
+        session = FakeSession()
+        create_rows("""
+              | id | value     |
+           *25| 1  | @text(10) |
+            """, session, 'paging_test', format_funcs=(str, cql_str))
+        stmt = FakeStatement("select * from paging_test").setFetchSize(10).enableTracing()
+        pf = PageFetcher(session.execute(stmt), FORMATTERS, trace=True)
+        pf.get_all_pages()
+        self.assertEqual([summary['live_cells'] for summary in pf.traces], [10, 10, 5])
+        self.assertEqual(pf.trace_summary()['live_cells'], 25)
+        self.assertEqual(pf.trace_summary()['traces'], 3)
+
+        pf = PageFetcher(session.execute(FakeStatement("select * from paging_test")), FORMATTERS, trace=True)
+        pf.get_all_pages()
+        self.assertEqual(pf.traces, [None])
+        self.assertEqual(pf.trace_summary()['traces'], 0)
+
+class TestSoak(unittest.TestCase):
+    def samples(self, passes, speed=lambda n: 1000.0, heap=lambda n: 100, rss=lambda n: {'node1': 5000},
+                cluster=lambda n: '/tmp/c1'):
+        return [{'time': n * 60.0 + i, 'pass': n, 'test': test, 'heap_used': heap(n), 'rss_kb': rss(n),
+                 'cluster': cluster(n),
+                 'rows_per_sec': speed(n) * (i + 1), 'page_latency': 100.0 / speed(n)}
+                for n in range(1, passes + 1) for i, test in enumerate(('a', 'b', 'c'))]
+
+    def test_paging_sample(self):
+        timings = {'phases': {'paging': 2.0},
+                   'counters': {'paged_rows': 1000, 'pages': 10, 'fetched_pages': 9, 'fetch_seconds': 0.9}}
+        self.assertEqual(paging_sample(timings), {'rows_per_sec': 500.0, 'page_latency': 0.1})
+        timings = {'phases': {'paging': 2.0}, 'counters': {'paged_rows': 1000, 'pages': 1}}
+        self.assertEqual(paging_sample(timings), {'rows_per_sec': 500.0, 'page_latency': None})
+        self.assertEqual(paging_sample({'phases': {}, 'counters': {}}), None)
+        self.assertEqual(paging_sample(None), None)
+
+    def test_steady_growth(self):
+        self.assertAlmostEqual(slope([(0, 1), (1, 3), (2, 5)]), 2.0)
+        self.assertAlmostEqual(steady_growth([(t, 100 + 10 * t) for t in range(10)]), 0.9)
+        # collected heap
+        self.assertEqual(steady_growth([(t, 100 + 50 * (t % 3)) for t in range(12)]), 0.0)
+        self.assertEqual(steady_growth([(0, 100), (1, 200)]), 0.0)
+
+    def test_no_drift(self):
+        self.assertEqual(detect_drift(self.samples(6)), [])
+
+    def test_drift(self):
+        flags = detect_drift(self.samples(6, speed=lambda n: 1000.0 / n, heap=lambda n: 100 + 10 * n,
+                                          rss=lambda n: {'node1': 5000, 'node2': 5000 + 500 * n}))
+        self.assertEqual(len(flags), 4)
+        self.assertRegexpMatches(flags[0], r'^paging throughput dropped to 2\d% of the first passes \(median over 3 tests\)$')
+        self.assertTrue(flags[1].startswith('page latency rose'))
+        self.assertTrue(flags[2].startswith('client heap grew steadily'))
+        self.assertTrue(flags[3].startswith('resident memory of node2 grew steadily'))
+
+    def test_node_memory_by_cluster(self):
+        # a bigger cluster later on isn't a node growing
+        samples = self.samples(6, rss=lambda n: dict(('node%d' % i, 5000) for i in range(1, 2 if n < 4 else 4)),
+                               cluster=lambda n: '/tmp/c1' if n < 4 else '/tmp/c2')
+        self.assertEqual(detect_drift(samples), [])
+        samples = self.samples(6, rss=lambda n: {'node1': 5000 if n < 4 else 9000},
+                               cluster=lambda n: '/tmp/c1' if n < 4 else '/tmp/c2')
+        self.assertEqual(detect_drift(samples), [])
+
+class TestRowDiff(unittest.TestCase, PageAssertionMixin):
+    def test_missing_extra_and_duplicated(self):
+        expected = [[str(i), 'v%d' % i] for i in range(10)]
+        actual = list(reversed(expected[2:])) + [['3', 'v3'], ['42', 'v\t42\n']]
+        diff = diff_rows(expected, actual, actual_pages=[4, 4, 2])
+        self.assertFalse(diff.ok())
+        self.assertEqual((diff.expected_rows, diff.actual_rows), (10, 10))
+        self.assertEqual(diff.missing, [('0__v0', [0]), ('1__v1', [1])])
+        self.assertEqual(diff.extra, [('42__v\t42\n', [(3, 2)])])
+        self.assertEqual(diff.duplicated_count, 1)
+        self.assertEqual(diff.duplicated, [('3__v3', [(2, 3), (3, 1)])])
+
+    def test_spills_to_disk(self):
+        expected = ([str(i)] for i in xrange(5000))
+        actual = ([str(i)] for i in xrange(4999, 0, -1))
+        diff = diff_rows(expected, actual, spill_rows=300, max_reported=5)
+        self.assertEqual(diff.missing, [('0', [0])])
+        self.assertEqual((diff.extra_count, diff.duplicated_count), (0, 0))
+
+    def test_assertion_message(self):
+        session, expected = TestFakeDriverPaging('test_pages_follow_fetch_size').make_session(rows=12)
+        pf = PageFetcher(session.execute(FakeStatement("select * from paging_test").setFetchSize(5)), formatters=FORMATTERS)
+        pf.get_all_pages()
+        self.assertEqualIgnoreOrder(expected, pf)
+        with self.assertRaisesRegexp(AssertionError, r"1 extra:\n  1__'v00011' \(at \(3, 2\)\)"):
+            self.assertEqualIgnoreOrder(expected[:-1], pf)
+        with self.assertRaisesRegexp(AssertionError, '1 duplicated'):
+            self.assertEqualIgnoreOrder(expected, pf.all_data() + pf.all_data()[:1])
+
+class FakeNode(object):
+    """Node with a data directory, whose nodetool knows snapshots and refresh."""
+    def __init__(self, name, path, cf_id=None):
+        self.name = name
+        self.path = path
+        # the table's, with a 2.1 data directory layout
+        self.cf_id = cf_id
+        self.commands = []
+
+    def get_path(self):
+        return self.path
+
+    def nodetool(self, cmd):
+        self.commands.append(cmd)
+        args = cmd.split()
+        if args[0] == 'snapshot':
+            table_dir = table_data_dir(self, args[-1], args[2], self.cf_id)
+            snapshot = os.path.join(table_dir, 'snapshots', args[4])
+            os.makedirs(snapshot)
+            for name in os.listdir(table_dir):
+                if name.endswith('.db'):
+                    shutil.copy(os.path.join(table_dir, name), snapshot)
+        elif args[0] == 'clearsnapshot':
+            for root, dirs, _ in os.walk(os.path.join(self.path, 'data', args[-1])):
+                if args[2] in dirs and root.endswith('snapshots'):
+                    shutil.rmtree(os.path.join(root, args[2]))
+
+class TestDatasetCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='dtest-harness-')
+        self.cache = DatasetCache(os.path.join(self.tmp, 'cache'), max_bytes=1300)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_nodes(self, cluster, sstable_bytes=0, cf_id=None, dropped=()):
+        nodes = []
+        for name in ('node1', 'node2'):
+            node = FakeNode(name, os.path.join(self.tmp, cluster, name), cf_id)
+            # directories of dropped tables of the same name
+            for old_id in dropped:
+                os.makedirs(os.path.join(node.path, 'data', 'ks', 't-' + old_id))
+            table_dir = os.path.join(node.path, 'data', 'ks', 't' if cf_id is None else 't-' + cf_id)
+            os.makedirs(table_dir)
+            if sstable_bytes:
+                with open(os.path.join(table_dir, 'ks-t-jb-1-Data.db'), 'w') as f:
+                    f.write(name[-1] * sstable_bytes)
+            nodes.append(node)
+        return nodes
+
+    def test_key(self):
+        key = dataset_key(['schema'], '|id|\n*5|@seq|', 1, (str,), ['2.0', None, []])
+        self.assertEqual(key, dataset_key(['schema'], '  |id|\n*5|@seq|\n', 1, (str,), ['2.0', None, []]))
+        self.assertNotEqual(key, dataset_key(['schema'], '|id|\n*5|@seq|', 2, (str,), ['2.0', None, []]))
+        self.assertNotEqual(key, dataset_key(['schema'], '|id|\n*6|@seq|', 1, (str,), ['2.0', None, []]))
+        self.assertNotEqual(key, dataset_key(['schema'], '|id|\n*5|@seq|', 1, (cql_str,), ['2.0', None, []]))
+
+    def test_topology(self):
+        class Node(object):
+            network_interfaces = {'storage': ('127.0.0.1', 7000)}
+            def __init__(self, name, token):
+                self.name, self.initial_token = name, token
+        class Cluster(object):
+            partitioner = 'Murmur3Partitioner'
+            def __init__(self, tokens):
+                self.nodes = [Node('node%d' % (i + 1), token) for i, token in enumerate(tokens)]
+            def nodelist(self):
+                return self.nodes
+            def version(self):
+                return '2.0.9'
+        self.assertEqual(cluster_topology(Cluster([0, 100])),
+                         ['2.0.9', 'Murmur3Partitioner', [('node1', '127.0.0.1', '0'), ('node2', '127.0.0.1', '100')]])
+        self.assertEqual(cluster_topology(Cluster([None, None]), num_tokens=256), None)
+        self.assertEqual(cluster_topology(Cluster([None, None])), None)
+
+    def test_store_and_restore(self):
+        self.assertFalse(self.cache.restore('k', self.make_nodes('empty'), 'ks', 't'))
+        self.cache.store('k', self.make_nodes('first', sstable_bytes=10), 'ks', 't')
+
+        nodes = self.make_nodes('second')
+        self.assertTrue(self.cache.restore('k', nodes, 'ks', 't'))
+        for node in nodes:
+            with open(os.path.join(node.path, 'data', 'ks', 't', 'ks-t-jb-1-Data.db')) as f:
+                self.assertEqual(f.read(), node.name[-1] * 10)
+            self.assertEqual(node.commands, ['refresh ks t'])
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'first', 'node1', 'data', 'ks', 't', 'snapshots', SNAPSHOT_TAG)))
+
+    def test_table_directories_of_2_1(self):
+        live, dropped = 'a' * 32, 'b' * 32
+        self.cache.store('k', self.make_nodes('first', sstable_bytes=10, cf_id=live), 'ks', 't', live)
+        nodes = self.make_nodes('second', cf_id=live, dropped=[dropped])
+        self.assertTrue(self.cache.restore('k', nodes, 'ks', 't', live))
+        self.assertEqual(os.listdir(os.path.join(nodes[0].path, 'data', 'ks', 't-' + live)), ['ks-t-jb-1-Data.db'])
+        self.assertEqual(os.listdir(os.path.join(nodes[0].path, 'data', 'ks', 't-' + dropped)), [])
+
+        # no guessing which one is live
+        self.assertEqual(table_data_dir(self.make_nodes('single', cf_id=live)[0], 'ks', 't'),
+                         os.path.join(self.tmp, 'single', 'node1', 'data', 'ks', 't-' + live))
+        with self.assertRaisesRegexp(RuntimeError, "Can't tell the data directory"):
+            table_data_dir(nodes[0], 'ks', 't')
+        with self.assertRaisesRegexp(RuntimeError, "found none"):
+            table_data_dir(nodes[0], 'ks', 'other')
+
+    def test_least_recently_used_are_evicted(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.store(key, self.make_nodes(key, sstable_bytes=200), 'ks', 't')
+            os.utime(os.path.join(self.cache.directory, key), (time.time() - 100 + ord(key), ) * 2)
+        # 'a' is used again, so 'b' goes
+        self.cache.restore('a', self.make_nodes('again'), 'ks', 't')
+        self.cache.store('d', self.make_nodes('d', sstable_bytes=200), 'ks', 't')
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), ['a', 'c', 'd'])
+
+if __name__ == '__main__':
+    unittest.main()
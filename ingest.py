@@ -0,0 +1,194 @@
+"""
+Token aware ingest: every insert goes to a node that is a replica of the
+row's partition, and all nodes coordinate writes at the same time, instead
+of the node of the test's connection coordinating every write.
+
+A TokenAwareWriter can be given to create_rows in place of a cursor:
+
+    writer = self.token_aware_writer('test_paging_size')
+    expected_data = create_rows(data, writer, 'paging_test', format_funcs=(str, cql_str))
+
+Writes are asynchronous, with at most max_in_flight of them outstanding
+per node; create_rows returns once all of them are acknowledged.
+"""
+import threading, time
+
+# java
+from java.nio import ByteBuffer
+from com.datastax.driver.core import Cluster as JCluster, SimpleStatement
+from com.datastax.driver.core.policies import RoundRobinPolicy, WhiteListPolicy
+from com.google.common.util.concurrent import FutureCallback, Futures
+from java.net import InetSocketAddress
+
+# outstanding writes per coordinator
+DEFAULT_MAX_IN_FLIGHT = 128
+# how long to wait for a new table to show up in the driver's schema metadata
+SCHEMA_WAIT = 10
+
+def serialize_literal(data_type, literal):
+    """
+    Serializes a CQL literal the way data_type stores it, for a routing key
+    (with DataType.parse/serialize, which driver 3 dropped for codecs).
+    """
+    literal = literal.strip()
+    if literal.startswith("'") and literal.endswith("'") and len(literal) >= 2:
+        literal = literal[1:-1].replace("''", "'")
+    return data_type.serialize(data_type.parse(literal))
+
+def routing_key(buffers):
+    """
+    The partition key of a row from its serialized components: the
+    component itself for a single column key, else the composite
+    (length, bytes, end of component) encoding.
+    """
+    if len(buffers) == 1:
+        return buffers[0]
+    key = ByteBuffer.allocate(sum(b.remaining() + 3 for b in buffers))
+    for b in buffers:
+        key.putShort(b.remaining())
+        key.put(b.duplicate())
+        key.put(0)
+    key.flip()
+    return key
+
+def pinned_cluster(address, port):
+    """Driver cluster sending every query to the node at address, and to no other."""
+    return JCluster.builder().addContactPoint(address).withPort(port).withLoadBalancingPolicy(
+        WhiteListPolicy(RoundRobinPolicy(), [InetSocketAddress(address, port)])).build()
+
+class NodeWriter(object):
+    """Session coordinating through a single node, with its write stats."""
+    def __init__(self, name, address, port, keyspace, max_in_flight):
+        self.name = name
+        self.address = address
+        self.cluster = pinned_cluster(address, port)
+        self.session = self.cluster.connect(keyspace)
+        self.slots = threading.Semaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight_seen = 0
+        self.rows = 0
+        self.errors = 0
+        self.first_write = None
+        self.last_ack = None
+
+    def stats(self):
+        elapsed = (self.last_ack - self.first_write) if self.rows and self.last_ack else 0
+        return {
+            'rows': self.rows,
+            'errors': self.errors,
+            'max_in_flight': self.max_in_flight_seen,
+            'seconds': elapsed,
+            'rows_per_sec': self.rows / elapsed if elapsed else 0.0,
+        }
+
+    def close(self):
+        self.cluster.shutdown()
+
+class _Ack(FutureCallback):
+    def __init__(self, writer, node):
+        self.writer = writer
+        self.node = node
+
+    def onSuccess(self, result):
+        self.writer._done(self.node, None)
+
+    def onFailure(self, error):
+        self.writer._done(self.node, error)
+
+class TokenAwareWriter(object):
+    """
+    Row writer for create_rows sending each insert to a replica of its
+    partition, picking the least busy replica when there are several.
+    Tables must exist before rows are written to them.
+    """
+    def __init__(self, nodes, keyspace, max_in_flight=DEFAULT_MAX_IN_FLIGHT, log=None):
+        self.keyspace = keyspace
+        self.log = log
+        self.nodes = {}
+        for node in nodes:
+            address, port = node.network_interfaces['binary']
+            self.nodes[address] = NodeWriter(node.name, address, port, keyspace, max_in_flight)
+        self.metadata = self.nodes.values()[0].cluster.getMetadata()
+        self.partition_keys = {}
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.error = None
+        self._next = 0
+
+    def _partition_key(self, table):
+        """(column name, DataType) of the partition key columns of table."""
+        if table not in self.partition_keys:
+            deadline = time.time() + SCHEMA_WAIT
+            while True:
+                ks = self.metadata.getKeyspace(self.keyspace)
+                meta = ks.getTable(table) if ks is not None else None
+                if meta is not None:
+                    break
+                if time.time() > deadline:
+                    raise RuntimeError("Table %s.%s isn't in the driver's schema metadata" % (self.keyspace, table))
+                time.sleep(0.1)
+            self.partition_keys[table] = [(col.getName(), col.getType()) for col in meta.getPartitionKey()]
+        return self.partition_keys[table]
+
+    def coordinator(self, table, headers, values):
+        """The NodeWriter a row should be sent to."""
+        row = dict(zip([h.lower() for h in headers], values))
+        key = routing_key([serialize_literal(data_type, row[name]) for name, data_type in self._partition_key(table)])
+        replicas = [self.nodes[host.getAddress().getHostAddress()] for host in self.metadata.getReplicas(self.keyspace, key)
+                    if host.getAddress().getHostAddress() in self.nodes]
+        if replicas:
+            return min(replicas, key=lambda node: node.in_flight)
+        # none of the replicas is one of ours, spread the writes
+        self._next += 1
+        return self.nodes.values()[self._next % len(self.nodes)]
+
+    def write_row(self, statement, table, headers, values):
+        if self.error is not None:
+            self.flush()
+        node = self.coordinator(table, headers, values)
+        node.slots.acquire()
+        with node.lock:
+            node.in_flight += 1
+            node.max_in_flight_seen = max(node.max_in_flight_seen, node.in_flight)
+            if node.first_write is None:
+                node.first_write = time.time()
+        with self.condition:
+            self.pending += 1
+        Futures.addCallback(node.session.executeAsync(SimpleStatement(statement)), _Ack(self, node))
+
+    def _done(self, node, error):
+        with node.lock:
+            node.in_flight -= 1
+            node.last_ack = time.time()
+            if error is None:
+                node.rows += 1
+            else:
+                node.errors += 1
+        node.slots.release()
+        with self.condition:
+            if error is not None and self.error is None:
+                self.error = error
+            self.pending -= 1
+            self.condition.notifyAll()
+
+    def flush(self):
+        """Waits for every write sent so far, raising the first that failed."""
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+            error, self.error = self.error, None
+        if self.log is not None:
+            self.log("token aware ingest: " + ', '.join(
+                '{}={} rows ({:.0f}/s)'.format(node.name, node.rows, node.stats()['rows_per_sec'])
+                for node in sorted(self.nodes.values(), key=lambda node: node.name)))
+        if error is not None:
+            raise error
+
+    def stats(self):
+        """Per node write stats, by node name."""
+        return dict((node.name, node.stats()) for node in self.nodes.values())
+
+    def close(self):
+        for node in self.nodes.values():
+            node.close()
@@ -0,0 +1,147 @@
+"""
+Background write load, to page through a table while it is being written
+to rather than between single synchronous mutations.
+
+A LoadRunner thread sends the statements of a workload at a fixed rate.
+MixedWrites is a workload of inserts, updates, deletes and TTL'd inserts
+of a range of "churn" rows of a partition, leaving its other rows alone,
+so pages can be checked for those while the churn rows come and go:
+
+    load = MixedWrites('paging_test', {'id': '1'}, 'sometext', 'value')
+    runner = self.start_load(cursor, load, rate=500)
+    ...page through the partition...
+    stats = runner.stop()
+
+Runners started with HybridTester.start_load are stopped by tearDown.
+"""
+import random, sys, threading, time
+import timing
+from pagehelp import percentile
+
+# relative frequency of each kind of write in MixedWrites
+DEFAULT_MIX = (('insert', 4), ('update', 3), ('delete', 2), ('ttl', 1))
+# clustering values of churn rows start with this
+CHURN_PREFIX = 'churn-'
+
+class MixedWrites(object):
+    """
+    Random writes to the churn rows of a partition of table: partition
+    maps the partition key columns to CQL literals, clustering is the
+    text column holding the churn keys ('churn-000042') and value a text
+    column the updates change. Updates are upserting INSERTs, like
+    UPDATE is in CQL.
+    """
+    def __init__(self, table, partition, clustering, value, keys=1000, mix=DEFAULT_MIX, ttl=1, seed=0):
+        self.table = table
+        self.partition = sorted(partition.items())
+        self.clustering = clustering
+        self.value = value
+        self.keys = keys
+        self.ttl = ttl
+        self.random = random.Random(seed)
+        self.kinds = [kind for kind, weight in mix for _ in range(weight)]
+        # churn keys written and not deleted (some may have expired)
+        self.live = set()
+        self._written = 0
+
+    @staticmethod
+    def is_churn(clustering_value):
+        return str(clustering_value).strip("'").startswith(CHURN_PREFIX)
+
+    def _insert(self, key, ttl=None):
+        self._written += 1
+        self.live.add(key)
+        cols = [col for col, _ in self.partition] + [self.clustering, self.value]
+        vals = [literal for _, literal in self.partition] + ["'%s%06d'" % (CHURN_PREFIX, key), "'v%d'" % self._written]
+        return "INSERT INTO {table} ({cols}) values ({vals}){ttl}".format(
+            table=self.table, cols=', '.join(cols), vals=', '.join(vals),
+            ttl=' USING TTL %d' % ttl if ttl else '')
+
+    def __call__(self):
+        """Returns the kind and CQL of the next write."""
+        kind = self.random.choice(self.kinds)
+        if kind in ('update', 'delete') and not self.live:
+            kind = 'insert'
+        if kind == 'insert':
+            return kind, self._insert(self.random.randrange(self.keys))
+        if kind == 'ttl':
+            return kind, self._insert(self.random.randrange(self.keys), ttl=self.ttl)
+        key = self.random.choice(sorted(self.live))
+        if kind == 'update':
+            return kind, self._insert(key)
+        self.live.discard(key)
+        where = ' AND '.join('%s = %s' % (col, literal) for col, literal in self.partition)
+        return kind, "DELETE FROM {table} WHERE {where} AND {clustering} = '{prefix}{key:06d}'".format(
+            table=self.table, where=where, clustering=self.clustering, prefix=CHURN_PREFIX, key=key)
+
+class LoadRunner(threading.Thread):
+    """
+    Thread sending the writes of workload (a callable returning the kind
+    and CQL of the next write) through session, rate times a second,
+    until stopped. Failed writes are counted, the first one kept in error.
+    """
+    def __init__(self, session, workload, rate=100, log=None):
+        threading.Thread.__init__(self, name='load-runner')
+        self.daemon = True
+        self.session = session
+        self.workload = workload
+        self.rate = rate
+        self.log = log
+        self.stopping = threading.Event()
+        self.ops = {}
+        self.errors = 0
+        self.error = None
+        self.latencies = []
+        self.started = self.stopped = None
+
+    def run(self):
+        self.started = time.time()
+        sent = 0
+        while not self.stopping.is_set():
+            # keeps to the rate overall, without bursting after a slow write
+            delay = self.started + sent / float(self.rate) - time.time()
+            if delay > 0:
+                self.stopping.wait(delay)
+                continue
+            if delay < -1:
+                self.started -= delay + 1
+            kind, statement = self.workload()
+            sent += 1
+            start = time.time()
+            try:
+                self.session.execute(statement)
+                self.ops[kind] = self.ops.get(kind, 0) + 1
+            except:
+                # java exceptions aren't Exceptions
+                self.errors += 1
+                if self.error is None:
+                    self.error = sys.exc_info()[1]
+            self.latencies.append(time.time() - start)
+            timing.count('load_writes')
+        self.stopped = time.time()
+
+    def stop(self, timeout=30):
+        """Stops the writes and returns the stats."""
+        stopped_here = not self.stopping.is_set()
+        self.stopping.set()
+        if self.is_alive():
+            self.join(timeout)
+        stats = self.stats()
+        if stopped_here and self.log is not None:
+            self.log("load runner: {writes} writes ({rate:.0f}/s of {target}/s), {errors} errors, "
+                     "write latency p50 {p50:.3f}s p99 {p99:.3f}s".format(**stats))
+        return stats
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        elapsed = ((self.stopped or time.time()) - self.started) if self.started else 0
+        writes = sum(self.ops.values())
+        return {
+            'writes': writes,
+            'ops': dict(self.ops),
+            'errors': self.errors,
+            'target': self.rate,
+            'rate': writes / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+        }
@@ -1,6 +1,296 @@
+import glob, inspect, json, os, sys, time
+from unittest import TestCase, TestLoader
+from xml.dom import minidom
+
 import nose
+from nose.plugins import Plugin
+
+from soak import detect_drift, paging_sample
+
+# per-test durations of previous runs, used to balance shards
+DURATIONS_FILE = 'test_durations.json'
+# assumed duration of a test that never ran, when there is no history at all
+DEFAULT_TEST_DURATION = 60.0
+# weight of the latest run in the recorded durations
+DURATION_SMOOTHING = 0.5
+# samples and drift of the last soak run
+SOAK_FILE = 'soak.json'
+
+def load_durations(path=DURATIONS_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def update_durations(results, path=DURATIONS_FILE):
+    """
+    Folds the durations of a run (PhaseTiming results) into the history,
+    as a moving average so a single slow run doesn't skew the shards.
+    """
+    durations = load_durations(path)
+    for entry in results:
+        previous = durations.get(entry['test'])
+        if previous is None:
+            durations[entry['test']] = entry['duration']
+        else:
+            durations[entry['test']] = DURATION_SMOOTHING * entry['duration'] + (1 - DURATION_SMOOTHING) * previous
+    with open(path, 'w') as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+
+def merge_durations(timing_files, path=DURATIONS_FILE):
+    """
+    Folds the phase timings files of all the shards of a run into the
+    history at once, sharded runs leaving it alone so that every machine
+    keeps planning from the same one.
+    """
+    results = []
+    for timing_file in timing_files:
+        with open(timing_file) as f:
+            results.extend(json.load(f))
+    update_durations(results, path)
+
+def collect_tests(pattern='*_test.py'):
+    """
+    Returns (test id, cluster config) pairs for the test methods of the
+    TestCase classes in the modules matching pattern. Tests of classes
+    using the same cluster profiles share a cluster config.
+    """
+    tests = []
+    loader = TestLoader()
+    for path in sorted(glob.glob(pattern)):
+        name = os.path.splitext(os.path.basename(path))[0]
+        __import__(name)
+        module = sys.modules[name]
+        for cls_name, cls in inspect.getmembers(module, inspect.isclass):
+            if not issubclass(cls, TestCase) or cls.__module__ != name:
+                continue
+            config = tuple(getattr(cls, 'cluster_profiles', ()))
+            for method in loader.getTestCaseNames(cls):
+                tests.append(('%s.%s.%s' % (name, cls_name, method), config))
+    return tests
+
+def plan_shards(tests, durations, workers):
+    """
+    Splits (test id, cluster config) pairs into `workers` lists of test ids
+    of about equal total duration, using the longest-processing-time-first
+    heuristic: the longest remaining test goes to the least loaded worker.
+    A test goes to a worker that already runs tests with its cluster config
+    instead whenever that doesn't make the slowest worker any slower.
+    Every worker computes the same plan from the same history, so they
+    must all have the same test_durations.json.
+    """
+    known = sorted(durations.get(test_id) for test_id, _ in tests if test_id in durations)
+    default = known[len(known) // 2] if known else DEFAULT_TEST_DURATION
+    cost = lambda test_id: durations.get(test_id, default)
+
+    loads = [0.0] * workers
+    shards = [[] for _ in range(workers)]
+    configs = [set() for _ in range(workers)]
+    for test_id, config in sorted(tests, key=lambda test: (-cost(test[0]), test[0])):
+        least = min(range(workers), key=lambda w: (loads[w], w))
+        bound = max(max(loads), loads[least] + cost(test_id))
+        sharing = [w for w in range(workers) if config in configs[w] and loads[w] + cost(test_id) <= bound]
+        worker = min(sharing, key=lambda w: (loads[w], w)) if sharing else least
+        loads[worker] += cost(test_id)
+        shards[worker].append(test_id)
+        configs[worker].add(config)
+    return [sorted(shard) for shard in shards], loads
+
+def shard_test_names(shard):
+    """
+    Returns the nose names of the tests in shard 'i/N' (1-based) of the
+    suite, reporting the planned load of every worker.
+    """
+    index, workers = [int(part) for part in shard.split('/')]
+    if not 1 <= index <= workers:
+        raise ValueError("Invalid shard %s, expected i/N with 1 <= i <= N" % shard)
+    shards, loads = plan_shards(collect_tests(), load_durations(), workers)
+    for worker, load in enumerate(loads):
+        print "shard %d/%d: %d tests, ~%.0fs%s" % (worker + 1, workers, len(shards[worker]), load,
+                                                   ' <-- this worker' if worker + 1 == index else '')
+    # module.Class.method -> module:Class.method
+    return [test_id.replace('.', ':', 1) for test_id in shards[index - 1]]
+
+class PhaseTiming(Plugin):
+    """
+    Collects the phase timings HybridTester records for each test (see
+    timing.py), writes them to a JSON file, adds them as properties to
+    the xunit report and prints a summary of where the suite's time went.
+    """
+    name = 'phase-timing'
+    # how many of the slowest tests the summary lists
+    slowest = 10
+
+    def __init__(self, update_history=True):
+        super(PhaseTiming, self).__init__()
+        # sharded runs leave the durations history alone, see merge_durations
+        self.update_history = update_history
+
+    def options(self, parser, env):
+        super(PhaseTiming, self).options(parser, env)
+        parser.add_option('--phase-timing-file', action='store', dest='phase_timing_file',
+                          metavar='FILE', default=env.get('NOSE_PHASE_TIMING_FILE', 'phase_timings.json'),
+                          help='Path to the JSON file with the timings of every test [default: phase_timings.json]')
+
+    def configure(self, options, conf):
+        super(PhaseTiming, self).configure(options, conf)
+        if not self.enabled:
+            return
+        self.filename = options.phase_timing_file
+        self.xunit_file = getattr(options, 'xunit_file', None) if getattr(options, 'enable_plugin_xunit', False) else None
+        self.results = []
+        self._started = None
+
+    def startTest(self, test):
+        self._started = time.time()
+
+    def afterTest(self, test):
+        entry = {'test': test.id(), 'duration': time.time() - self._started, 'phases': {}, 'counters': {}}
+        timings = getattr(getattr(test, 'test', None), 'phase_timings', None)
+        if timings:
+            entry.update(timings)
+            entry['test'] = test.id()
+        self.results.append(entry)
+
+    def report(self, stream):
+        if not self.results:
+            return
+        totals = {}
+        for entry in self.results:
+            for phase, secs in entry['phases'].items():
+                totals[phase] = totals.get(phase, 0.0) + secs
+        suite_time = sum(entry['duration'] for entry in self.results)
+
+        stream.writeln()
+        stream.writeln("Time per phase over %d tests (%.1fs):" % (len(self.results), suite_time))
+        for phase, secs in sorted(totals.items(), key=lambda item: -item[1]):
+            stream.writeln("  %-16s %9.1fs %5.1f%%" % (phase, secs, 100.0 * secs / suite_time if suite_time else 0))
+        stream.writeln("Slowest tests:")
+        for entry in sorted(self.results, key=lambda entry: -entry['duration'])[:self.slowest]:
+            top = sorted(entry['phases'].items(), key=lambda item: -item[1])[:3]
+            stream.writeln("  %8.1fs %s (%s)" % (entry['duration'], entry['test'],
+                ', '.join('%s %.1fs' % item for item in top) or 'no phases recorded'))
+
+    def finalize(self, result):
+        if not self.results:
+            return
+        with open(self.filename, 'w') as f:
+            json.dump(self.results, f, indent=2, sort_keys=True)
+        if self.update_history:
+            update_durations(self.results)
+        if self.xunit_file:
+            # the xunit plugin has written its report by now
+            self._add_xunit_properties()
+
+    def _add_xunit_properties(self):
+        by_test = dict((entry['test'], entry) for entry in self.results)
+        doc = minidom.parse(self.xunit_file)
+        for testcase in doc.getElementsByTagName('testcase'):
+            entry = by_test.get('%s.%s' % (testcase.getAttribute('classname'), testcase.getAttribute('name')))
+            if entry is None:
+                continue
+            properties = doc.createElement('properties')
+            values = [('phase.' + phase, secs) for phase, secs in entry['phases'].items()]
+            values += [('counter.' + name, value) for name, value in entry['counters'].items()]
+            for name, value in sorted(values):
+                prop = doc.createElement('property')
+                prop.setAttribute('name', name)
+                prop.setAttribute('value', '%.3f' % value if isinstance(value, float) else str(value))
+                properties.appendChild(prop)
+            testcase.insertBefore(properties, testcase.firstChild)
+        with open(self.xunit_file, 'w') as f:
+            f.write(doc.toxml('utf-8'))
+
+def client_heap_used():
+    """Bytes of heap the JVM running the tests uses, right after a collection."""
+    from java.lang import System
+    from java.lang.management import ManagementFactory
+    System.gc()
+    return ManagementFactory.getMemoryMXBean().getHeapMemoryUsage().getUsed()
+
+class SoakMonitor(Plugin):
+    """
+    Samples the client heap, node memory and paging speed after every
+    test, over all the passes of a soak run (see soak.py).
+    """
+    name = 'soak-monitor'
+
+    def __init__(self):
+        super(SoakMonitor, self).__init__()
+        self.samples = []
+        self.passes = 0
+
+    def afterTest(self, test):
+        from base import process_rss_kb
+        tester = getattr(test, 'test', None)
+        cluster = getattr(tester, 'cluster', None)
+        nodes = [node for node in cluster.nodelist() if node.is_running()] if cluster is not None else []
+        sample = {
+            'time': time.time(),
+            'pass': self.passes,
+            'test': test.id(),
+            'heap_used': client_heap_used(),
+            # nodes are only still up when soak mode keeps the cluster
+            'rss_kb': dict((node.name, process_rss_kb(node.pid)) for node in nodes),
+            # the directory of the cluster, the same as long as it is kept
+            'cluster': getattr(tester, 'test_path', None) if nodes else None,
+            'rows_per_sec': None,
+            'page_latency': None,
+        }
+        sample.update(paging_sample(getattr(tester, 'phase_timings', None)) or {})
+        self.samples.append(sample)
+
+    def finalize(self, result):
+        samples = [sample for sample in self.samples if sample['pass'] == self.passes]
+        speeds = sorted(sample['rows_per_sec'] for sample in samples if sample['rows_per_sec'] is not None)
+        print "soak pass %d: %d tests, client heap %.0fMB, median paging %.0f rows/s" % (
+            self.passes, len(samples), (samples[-1]['heap_used'] if samples else 0) / 1048576.0,
+            speeds[len(speeds) // 2] if speeds else 0)
+
+def soak(argv, minutes):
+    """
+    Runs the tests of argv over and over for minutes, on clusters kept
+    from test to test, then reports drift. Exits with 1 if there is any,
+    or if tests failed in any pass. The durations history is left alone,
+    tests on kept clusters not paying for a boot.
+    """
+    from base import cleanup_soak_cluster
+    monitor = SoakMonitor()
+    deadline = time.time() + minutes * 60
+    failed_passes = []
+    try:
+        while time.time() < deadline:
+            monitor.passes += 1
+            program = nose.main(argv=argv + ['--with-soak-monitor'],
+                                addplugins=[PhaseTiming(update_history=False), monitor], exit=False)
+            if not program.success:
+                failed_passes.append(monitor.passes)
+    finally:
+        cleanup_soak_cluster()
+    flags = detect_drift(monitor.samples)
+    with open(SOAK_FILE, 'w') as f:
+        json.dump({'passes': monitor.passes, 'minutes': minutes, 'samples': monitor.samples, 'drift': flags,
+                   'failed_passes': failed_passes}, f, indent=2, sort_keys=True)
+    print "soak: %d passes in %.0f minutes, %d failed, %s" % (monitor.passes, minutes, len(failed_passes),
+                                                              '; '.join(flags) if flags else 'no drift')
+    sys.exit(1 if flags or failed_passes else 0)
 
 # this script is intended to be run by jython,
 # so we have the java and python dependencies available
 if __name__ == '__main__':
-    nose.main(argv=['paging_test.py', '--with-xunit', '--nocapture', '--nologcapture'])
+    # noserunner.py --merge-durations <phase timings files of every shard>
+    if sys.argv[1:2] == ['--merge-durations']:
+        merge_durations(sys.argv[2:])
+        sys.exit(0)
+    argv = ['paging_test.py', '--with-xunit', '--with-phase-timing', '--nocapture', '--nologcapture']
+    sharded = bool(os.environ.get('SHARD'))
+    # SHARD=i/N runs the i-th of N duration balanced parts of the suite
+    if sharded:
+        names = shard_test_names(os.environ['SHARD'])
+        if not names:
+            sys.exit(0)
+        argv += names
+    # SOAK_MINUTES=n loops the suite for n minutes, see soak.py
+    if float(os.environ.get('SOAK_MINUTES', '0')) > 0:
+        soak(argv, float(os.environ['SOAK_MINUTES']))
+    nose.main(argv=argv, addplugins=[PhaseTiming(update_history=not sharded)])
@@ -0,0 +1,595 @@
+"""
+Helpers to break driver result sets into pages and make assertions on them.
+"""
+import hashlib, Queue, struct, sys, threading, time
+import timing
+from datahelp import RowDigest, flatten_into_set
+from rowdiff import diff_rows
+from tracehelp import merge_summaries, summarize_trace, trace_events
+
+class Page(object):
+    data = None
+    # rows in the page, kept or not
+    count = 0
+    
+    def __init__(self):
+        self.data = []
+
+    def add_row(self, row, formatters):
+        """
+        See PageContainer for an explanation of formatters
+        """
+        if row is None:
+            return
+        
+        values = []
+        
+        for (colname, methodname, cast_func) in formatters:
+            jmethod = getattr(row, methodname)
+            # calls java method to get named column
+            # analogous to: str(row.getInt('id')) but would differ
+            # depending on the provided formatters
+            values.append(
+                cast_func(jmethod(colname))
+                )
+        
+        self.data.append(values)
+                        
+class PagingReport(object):
+    """What a PagingChecker found, with up to PagingChecker.max_reported rows of each kind."""
+    def __init__(self, rows, pages):
+        self.rows = rows
+        self.pages = pages
+        # (id, page number) of rows seen again
+        self.duplicates = []
+        self.duplicates_count = 0
+        # (id, page numbers) of expected rows never seen, with the pages whose ids surround them
+        self.missing = []
+        self.missing_count = 0
+        # (id, page number) of rows that weren't expected at all
+        self.unexpected = []
+        self.unexpected_count = 0
+        # rows of a Bloom filter checker that weren't accounted for
+        self.leftover = False
+        # Bloom filter counters that overflowed, which can't tell leftover rows
+        self.saturated = 0
+
+    def ok(self):
+        return not (self.duplicates_count or self.missing_count or self.unexpected_count or self.leftover)
+
+    def __str__(self):
+        lines = ["%d rows in %d pages" % (self.rows, self.pages)]
+        for name, count, found in (('duplicated', self.duplicates_count, self.duplicates),
+                                   ('missing', self.missing_count, self.missing),
+                                   ('unexpected', self.unexpected_count, self.unexpected)):
+            if count:
+                lines.append("%d %s, e.g. %s" % (count, name, ', '.join(
+                    '%s (page %s)' % (key, page if not isinstance(page, list) else '/'.join(map(str, page)) or '?')
+                    for key, page in found[:10])))
+        if self.leftover:
+            lines.append("some rows seen weren't accounted for by the expected ones")
+        if self.saturated:
+            lines.append("%d Bloom filter counters saturated, leftover rows hashed to them only went unchecked"
+                         % self.saturated)
+        return '; '.join(lines)
+
+class PagingChecker(object):
+    """
+    Checks, page by page, that every row of a paged query comes back
+    exactly once, without keeping the rows around. key is a function
+    of a (formatted) row returning its id.
+
+    With count, ids are the ints first to first + count - 1 and are
+    tracked in a bitmap of count bits (1.2MB for 10M rows), so duplicates,
+    missing and unexpected rows are all exact.
+
+    Otherwise ids can be anything and are counted in a counting Bloom
+    filter sized for capacity ids (a byte per counter, 8 counters per id).
+    Missing and duplicated rows are then found by passing the expected
+    ids to finish(). Rows reported missing are missing, though a few more
+    may hide behind false positives; the duplicates listed are the rows
+    that were probably seen before. Whether all rows came back exactly
+    once (report.ok()) is still exact, barring hash collisions, and
+    unless counters saturated at 255 (report.saturated): those can't be
+    counted back down, so they are left out of the leftover check.
+    """
+    # rows of each kind kept in the report
+    max_reported = 100
+    bloom_hashes = 4
+    bloom_counters_per_id = 8
+
+    def __init__(self, key, count=None, first=0, capacity=None):
+        if count is None and capacity is None:
+            raise ValueError("PagingChecker needs the count of int ids or the capacity of its Bloom filter")
+        self.key = key
+        self.count = count
+        self.first = first
+        if count is not None:
+            self.bits = bytearray((count + 7) // 8)
+        else:
+            self.counters = bytearray(max(capacity, 1) * self.bloom_counters_per_id)
+            # rows that are probably duplicates, Bloom filters having false positives
+            self.suspects = []
+        self.rows = 0
+        self.pages = 0
+        # (page number, lowest id, highest id), to place missing int ids
+        self.page_ranges = []
+        self.report = PagingReport(0, 0)
+
+    def _found(self, kind, key, page):
+        setattr(self.report, kind + '_count', getattr(self.report, kind + '_count') + 1)
+        found = getattr(self.report, kind)
+        if len(found) < self.max_reported:
+            found.append((key, page))
+
+    def _hashes(self, key):
+        digest = hashlib.md5(repr(key)).digest()
+        size = len(self.counters)
+        return [struct.unpack_from('>I', digest, 4 * i)[0] % size for i in range(self.bloom_hashes)]
+
+    def _slots(self, key):
+        # counters of an id, each once even if several hashes land on it
+        return set(self._hashes(key))
+
+    def add_page(self, rows, page=None):
+        """Checks the rows of the next page (or of the given page number)."""
+        self.pages += 1
+        page = self.pages if page is None else page
+        lowest = highest = None
+        for row in rows:
+            self.rows += 1
+            key = self.key(row)
+            if self.count is not None:
+                offset = key - self.first
+                if not 0 <= offset < self.count:
+                    self._found('unexpected', key, page)
+                    continue
+                byte, bit = offset >> 3, 1 << (offset & 7)
+                if self.bits[byte] & bit:
+                    self._found('duplicates', key, page)
+                self.bits[byte] |= bit
+                lowest = key if lowest is None else min(lowest, key)
+                highest = key if highest is None else max(highest, key)
+            else:
+                slots = self._slots(key)
+                if all(self.counters[slot] for slot in slots) and len(self.suspects) < self.max_reported:
+                    self.suspects.append((key, page))
+                for slot in slots:
+                    if self.counters[slot] < 255:
+                        self.counters[slot] += 1
+        if lowest is not None:
+            self.page_ranges.append((page, lowest, highest))
+
+    def finish(self, expected_ids=None):
+        """
+        Returns the PagingReport, looking for missing rows: every id of the
+        range with count, or the expected_ids otherwise.
+        """
+        report = self.report
+        report.rows, report.pages = self.rows, self.pages
+        report.missing, report.missing_count = [], 0
+        if self.count is not None:
+            for byte, value in enumerate(self.bits):
+                if value == 0xff:
+                    continue
+                for bit in range(8):
+                    offset = byte * 8 + bit
+                    if offset < self.count and not value & (1 << bit):
+                        key = self.first + offset
+                        if len(report.missing) < self.max_reported:
+                            self._found('missing', key, [p for p, lo, hi in self.page_ranges if lo <= key <= hi]
+                                        or self._neighbour_pages(key))
+                        else:
+                            # not placed in pages, as it won't be reported
+                            report.missing_count += 1
+        elif expected_ids is not None:
+            # takes the expected ids back out of the filter, so any count
+            # left is for rows seen more often than expected
+            counters = bytearray(self.counters)
+            report.saturated = sum(1 for value in counters if value == 255)
+            expected = 0
+            for key in expected_ids:
+                expected += 1
+                slots = self._slots(key)
+                if not all(counters[slot] for slot in slots):
+                    self._found('missing', key, [])
+                    continue
+                for slot in slots:
+                    if counters[slot] < 255:
+                        counters[slot] -= 1
+            # (some of them may be unexpected rows, which can't be told apart here)
+            report.duplicates_count = max(self.rows - (expected - report.missing_count), 0)
+            report.duplicates = self.suspects if report.duplicates_count else []
+            report.leftover = any(value and value != 255 for value in counters)
+        return report
+
+    def _neighbour_pages(self, key):
+        # the pages right before and after the id
+        before = [(hi, p) for p, lo, hi in self.page_ranges if hi < key]
+        after = [(lo, p) for p, lo, hi in self.page_ranges if lo > key]
+        return [p for _, p in ([max(before)] if before else []) + ([min(after)] if after else [])]
+
+class FetchSizeTuner(object):
+    """
+    Adapts the fetch size of a statement while its results are paged
+    (the driver reads it again for every page), aiming at pages of about
+    target_bytes (of formatted row values) or taking about target_latency
+    seconds to fetch, whichever makes smaller pages. The size changes by
+    at most max_step times per page, within min_size and max_size.
+
+    Each decision is logged and kept in decisions, as (page, rows, bytes
+    per row, fetch latency or None, new fetch size) tuples.
+    """
+    def __init__(self, statement, target_bytes=None, target_latency=None,
+                 min_size=10, max_size=10000, max_step=2.0, log=None):
+        if target_bytes is None and target_latency is None:
+            raise ValueError("FetchSizeTuner needs a target_bytes or target_latency")
+        self.statement = statement
+        self.target_bytes = target_bytes
+        self.target_latency = target_latency
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_step = max_step
+        self.log = log
+        self.decisions = []
+
+    def page_fetched(self, page_number, rows, latency=None):
+        """Picks the fetch size of the next page from one just fetched."""
+        if not rows:
+            return
+        size = self.statement.getFetchSize()
+        row_bytes = sum(len(str(value)) for row in rows for value in row) / float(len(rows))
+        candidates = []
+        if self.target_bytes is not None:
+            candidates.append(self.target_bytes / max(row_bytes, 1.0))
+        if self.target_latency is not None and latency:
+            candidates.append(self.target_latency * len(rows) / latency)
+        if candidates:
+            wanted = min(candidates)
+            if size > 0:
+                wanted = max(size / self.max_step, min(size * self.max_step, wanted))
+            new_size = int(max(self.min_size, min(self.max_size, wanted)))
+            if new_size != size:
+                self.statement.setFetchSize(new_size)
+        else:
+            new_size = size
+        self.decisions.append((page_number, len(rows), row_bytes, latency, new_size))
+        if self.log is not None:
+            self.log("page {}: {} rows of {:.0f} bytes{}, fetch size {} -> {}".format(
+                page_number, len(rows), row_bytes, ' in {:.3f}s'.format(latency) if latency is not None else '',
+                size, new_size))
+
+class PageFetcher(object):
+    """
+    Fethches result rows and breaks into pages.
+    """
+    pages = None
+    formatters = None
+    results = None
+    digest = None
+    checker = None
+    
+    def __init__(self, results, formatters, keep_data=True, checker=None, tuner=None, trace=False):
+        """
+        For a given results set, automagically breaks the results into pages.
+        
+        The formatters value should be provided as a list of tuples, like so:
+        [('id', 'getInt', str), ('value', 'getString', str), ...]
+        This tells the pager where to get the data, how to get it from the java driver,
+        and finally how to cast it for easy comparison.
+
+        digest is a RowDigest of every row fetched so far, to compare
+        with ExpectedData.digest() without going through the rows again.
+        Every page is also fed to checker (a PagingChecker) if given.
+        Without keep_data, the rows of a page are dropped once they have
+        been digested and checked, so huge results can be paged through
+        (all_data() is then empty, but the page counts are right).
+        With a tuner (a FetchSizeTuner), the fetch size is adapted after
+        every page, from the time the driver took to fetch it (so not
+        counting whatever the caller does between pages).
+        With trace, the statement being traced (enableTracing()), the
+        trace of every page is summarized in traces (see tracehelp.py).
+        """
+        self.pages = []
+        self.digest = RowDigest()
+        self.formatters = formatters
+        self.results = results
+        self.keep_data = keep_data
+        self.checker = checker
+        self.tuner = tuner
+        self.trace = trace
+        self.traces = []
+
+    def get_all_pages(self):
+        # get_page does the fetches, so they are timed as the page's
+        with timing.phase('paging'):
+            while self.get_page() is not None:
+                pass
+        
+        return self.pages
+    
+    def get_remaining_pages(self):
+        # for better intent in tests
+        return self.get_all_pages()
+    
+    def get_page(self):
+        """Returns next page"""
+        results = self.results
+        formatters = self.formatters
+        
+        with timing.phase('paging'):
+            # the first page comes with the execute, later ones are fetched
+            # by isExhausted(), which is what the fetch latency times
+            fetching = results.getAvailableWithoutFetching() == 0
+            started = time.time()
+            if not results.isExhausted():
+                latency = time.time() - started if fetching else None
+                if latency is not None:
+                    timing.count('fetched_pages')
+                    timing.count('fetch_seconds', latency)
+                page = Page()
+                self.pages.append(page)
+
+                while results.getAvailableWithoutFetching() > 0:
+                    page.add_row(results.one(), formatters)
+                page.count = len(page.data)
+                self.digest.update(page.data)
+                if self.checker is not None:
+                    self.checker.add_page(page.data, page=len(self.pages))
+                if self.tuner is not None:
+                    self.tuner.page_fetched(len(self.pages), page.data, latency)
+                if self.trace:
+                    with timing.phase('tracing'):
+                        self.traces.append(self._page_trace(len(self.pages) - 1))
+                if not self.keep_data:
+                    page.data = []
+
+                timing.count('pages')
+                timing.count('paged_rows', page.count)
+                return page
+            return None
+    
+    def _page_trace(self, index):
+        # the driver keeps the execution info of every page fetched
+        infos = self.results.getAllExecutionInfo()
+        trace = infos[index].getQueryTrace() if index < len(infos) else None
+        if trace is None:
+            return None
+        summary = summarize_trace(trace.getDurationMicros(), trace.getCoordinator().getHostAddress(), trace_events(trace))
+        timing.count('traced_pages')
+        timing.count('trace_tombstones', summary['tombstones'])
+        return summary
+
+    def trace_summary(self):
+        """Summary of the traces of all the pages fetched so far."""
+        return merge_summaries(summary for summary in self.traces if summary is not None)
+
+    def pagecount(self):
+        return len(self.pages)
+    
+    def num_results(self, page_num):
+        # change page_num to zero-index value
+        return self.pages[page_num-1].count
+    
+    def num_results_all_pages(self):
+        return [page.count for page in self.pages]
+    
+    def all_data(self):
+        """
+        Returns all retrieved data flattened into a single list
+        (instead of separated into Page objects)
+        """
+        all_pages_combined = []
+        for page in self.pages:
+            all_pages_combined.extend(page.data[:])
+        
+        return all_pages_combined
+
+class PagedQuery(object):
+    """
+    A statement for run_paged_queries, with the RowDigest of the rows it
+    should return if it is to be checked. Holds the outcome once run.
+    """
+    def __init__(self, statement, expected=None, name=None):
+        self.statement = statement
+        self.expected = expected
+        self.name = name or statement.getQueryString()
+        self.rows = 0
+        self.pages = 0
+        # seconds each page took, the first one including the query itself
+        self.page_latencies = []
+        self.digest = None
+        self.error = None
+        self.fetcher = None
+
+    def ok(self):
+        return self.error is None and (self.expected is None or self.digest == self.expected)
+
+def percentile(values, fraction):
+    """The value below which fraction of the (sorted) values are."""
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def run_paged_queries(session, queries, formatters, workers=32, keep_data=False):
+    """
+    Pages through every PagedQuery from a pool of worker threads sharing
+    the session, so many paged queries are in progress on the coordinators
+    at once. Rows are only digested, unless keep_data; the PageFetcher of
+    each query is left in query.fetcher. Returns aggregate stats:
+    rows, seconds, rows_per_sec and page latency percentiles; the
+    outcome of each query is left in it.
+    """
+    pending = Queue.Queue()
+    for query in queries:
+        pending.put(query)
+
+    def work():
+        while True:
+            try:
+                query = pending.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                started = time.time()
+                pf = query.fetcher = PageFetcher(session.execute(query.statement), formatters, keep_data=keep_data)
+                while pf.get_page() is not None:
+                    now = time.time()
+                    query.page_latencies.append(now - started)
+                    started = now
+                query.rows = sum(pf.num_results_all_pages())
+                query.pages = pf.pagecount()
+                query.digest = pf.digest
+            except:
+                # java exceptions included
+                query.error = sys.exc_info()[1]
+
+    with timing.phase('paging'):
+        start = time.time()
+        threads = [threading.Thread(target=work) for _ in range(min(workers, len(queries)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+    latencies = sorted(latency for query in queries for latency in query.page_latencies)
+    rows = sum(query.rows for query in queries)
+    return {
+        'queries': len(queries),
+        'workers': len(threads),
+        'rows': rows,
+        'seconds': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed else 0.0,
+        'page_latency': {
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else 0.0,
+        },
+    }
+
+# token range of the Murmur3Partitioner, no key having the lowest token
+MIN_TOKEN = -2 ** 63
+MAX_TOKEN = 2 ** 63 - 1
+
+def split_token_ranges(tokens, splits=1):
+    """
+    Splits the ring of the given node tokens into (start, end] ranges
+    covering it all, each range between two tokens being split again
+    into splits ranges of about the same width.
+    """
+    bounds = [MIN_TOKEN] + sorted(set(int(token) for token in tokens if MIN_TOKEN < int(token) < MAX_TOKEN)) + [MAX_TOKEN]
+    ranges = []
+    for start, end in zip(bounds, bounds[1:]):
+        step = max((end - start) // splits, 1)
+        edges = [start + i * step for i in range(splits) if start + i * step < end] + [end]
+        ranges.extend(zip(edges, edges[1:]))
+    return ranges
+
+class TokenRangeScan(object):
+    """
+    Full scan of a table split in token ranges, each paged by its own
+    query, all at once (see run_paged_queries), rather than one query
+    paged by a single coordinator.
+
+    make_statement turns a query string into a statement (SimpleStatement).
+    key is the partition key, as token() takes it ('id' or 'a, b').
+    After run(), pages and digest hold the pages of all the ranges, in
+    token order, and the RowDigest of all the rows, like a PageFetcher.
+    """
+    def __init__(self, session, table, key, tokens, formatters, make_statement,
+                 fetch_size=5000, splits=1, keep_data=False):
+        self.session = session
+        self.formatters = formatters
+        self.keep_data = keep_data
+        self.queries = []
+        for start, end in split_token_ranges(tokens, splits):
+            query = "SELECT * FROM {table} WHERE token({key}) > {start} AND token({key}) <= {end}".format(
+                table=table, key=key, start=start, end=end)
+            self.queries.append(PagedQuery(make_statement(query).setFetchSize(fetch_size)))
+        self.pages = []
+        self.digest = None
+        self.stats = None
+
+    def run(self, workers=32):
+        """Scans the table, returning the stats of run_paged_queries."""
+        self.stats = run_paged_queries(self.session, self.queries, self.formatters, workers=workers,
+                                       keep_data=self.keep_data)
+        errors = [query for query in self.queries if query.error is not None]
+        if errors:
+            raise errors[0].error
+        self.digest = RowDigest()
+        self.pages = []
+        for query in self.queries:
+            self.digest.merge(query.digest)
+            self.pages.extend(query.fetcher.pages)
+        return self.stats
+
+    def pagecount(self):
+        return len(self.pages)
+
+    def all_data(self):
+        all_pages_combined = []
+        for page in self.pages:
+            all_pages_combined.extend(page.data)
+        return all_pages_combined
+
+class PageAssertionMixin(object):
+    """Can be added to subclasses of unittest.Tester"""
+    def assertEqualIgnoreOrder(self, one, two):
+        """
+        Compares rows regardless of their order (a row must be there as
+        many times on both sides). Elements compared should be one of:
+        structure returned by parse_data_into_lists (expected data)
+        or data from PageFetcher.all_data() (actual data)
+        or a PageFetcher, whose rows are then located by page on failure.
+        """
+        one, one_pages = self._rows_and_pages(one)
+        two, two_pages = self._rows_and_pages(two)
+        if RowDigest(one) != RowDigest(two):
+            diff = diff_rows(one, two, expected_pages=one_pages, actual_pages=two_pages)
+            self.fail("Rows differ, taking the first ones as expected:\n%s" % diff)
+
+    def _rows_and_pages(self, rows):
+        if isinstance(rows, PageFetcher):
+            return rows.all_data(), rows.num_results_all_pages()
+        return rows, None
+    
+    def assertIsSubsetOf(self, subset, superset):
+        assert flatten_into_set(subset).issubset(flatten_into_set(superset))
+
+    def assertPagedQueriesOk(self, queries):
+        """Fails if any PagedQuery run by run_paged_queries failed or returned other rows."""
+        failed = [query for query in queries if not query.ok()]
+        if failed:
+            self.fail("%d of %d paged queries failed, e.g.: %s" % (len(failed), len(queries), '; '.join(
+                '%s: %s' % (query.name, query.error if query.error is not None else
+                            '%d rows not matching the %d expected' % (query.rows, query.expected.count))
+                for query in failed[:5])))
+
+    def assertPagedUnderLoad(self, rows, stable, key, volatile):
+        """
+        Checks rows paged while being written to (see loadrunner): no
+        primary key (key(row)) shows up twice, and the rows no write
+        touches are all there, unchanged, the others being volatile(row).
+        """
+        rows, pages = self._rows_and_pages(rows)
+        seen = set()
+        twice = []
+        for row in rows:
+            if key(row) in seen:
+                twice.append(row)
+            seen.add(key(row))
+        if twice:
+            self.fail("%d rows paged more than once under load, e.g. %s" % (len(twice), twice[:5]))
+        kept = [index for index, row in enumerate(rows) if not volatile(row)]
+        if RowDigest(rows[index] for index in kept) != RowDigest(stable):
+            diff = diff_rows(stable, [rows[index] for index in kept])
+            self.fail("Rows not written to changed under load:\n%s" % diff)
+
+    def assertPagedExactlyOnce(self, checker, expected_ids=None):
+        """Fails unless the PagingChecker saw every expected row exactly once."""
+        report = checker.finish(expected_ids)
+        if not report.ok():
+            self.fail("Rows not paged exactly once: %s" % report)
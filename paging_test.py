@@ -1,139 +1,32 @@
 import time, uuid
 import unittest
-from base import HybridTester
+from base import HybridTester, SCALING_MATRIX, debug, wait_for_binary_interface
 
-from datahelp import create_rows, parse_data_into_lists, flatten_into_set, cql_str
+from datahelp import create_rows, parse_data_into_lists, cql_str
+from loadrunner import MixedWrites
+from tracehelp import format_summary
+from pagehelp import FetchSizeTuner, PageFetcher, PageAssertionMixin, PagedQuery, PagingChecker, TokenRangeScan, run_paged_queries
 
 #java
 from com.datastax.driver.core import SimpleStatement, BoundStatement, exceptions
 
 def wait_for_node_alive(node):
-    # for now let's just pause
-    time.sleep(10)
-
-class Page(object):
-    data = None
-    
-    def __init__(self):
-        self.data = []
-
-    def add_row(self, row, formatters):
-        """
-        See PageContainer for an explanation of formatters
-        """
-        if row is None:
-            return
-        
-        values = []
-        
-        for (colname, methodname, cast_func) in formatters:
-            jmethod = getattr(row, methodname)
-            # calls java method to get named column
-            # analogous to: str(row.getInt('id')) but would differ
-            # depending on the provided formatters
-            values.append(
-                cast_func(jmethod(colname))
-                )
-        
-        self.data.append(values)
-                        
-class PageFetcher(object):
-    """
-    Fethches result rows and breaks into pages.
-    """
-    pages = None
-    formatters = None
-    results = None
-    
-    def __init__(self, results, formatters):
-        """
-        For a given results set, automagically breaks the results into pages.
-        
-        The formatters value should be provided as a list of tuples, like so:
-        [('id', 'getInt', str), ('value', 'getString', str), ...]
-        This tells the pager where to get the data, how to get it from the java driver,
-        and finally how to cast it for easy comparison.
-        """
-        self.pages = []
-        self.formatters = formatters
-        self.results = results
-
-    def get_all_pages(self):
-        results = self.results
-
-        while not results.isExhausted():
-            self.get_page()
-        
-        return self.pages
-    
-    def get_remaining_pages(self):
-        # for better intent in tests
-        return self.get_all_pages()
-    
-    def get_page(self):
-        """Returns next page"""
-        results = self.results
-        formatters = self.formatters
-        
-        if not results.isExhausted():
-            page = Page()
-            self.pages.append(page)
-            
-            while results.getAvailableWithoutFetching() > 0:
-                page.add_row(results.one(), formatters)
-        
-            return page
-        return None
-    
-    def pagecount(self):
-        return len(self.pages)
-    
-    def num_results(self, page_num):
-        # change page_num to zero-index value
-        return len(self.pages[page_num-1].data)
-    
-    def num_results_all_pages(self):
-        return [len(page.data) for page in self.pages]
-    
-    def all_data(self):
-        """
-        Returns all retrieved data flattened into a single list
-        (instead of separated into Page objects)
-        """
-        all_pages_combined = []
-        for page in self.pages:
-            all_pages_combined.extend(page.data[:])
-        
-        return all_pages_combined
-
-class PageAssertionMixin(object):
-    """Can be added to subclasses of unittest.Tester"""
-    def assertEqualIgnoreOrder(self, one, two):
-        """
-        Flattens data into a set and then compare.
-        Elements compared should be one of:
-        structure returned by parse_data_into_lists (expected data)
-        or data from PageFetcher.all_data() (actual data)
-        """
-        self.assertEqual(
-            flatten_into_set(one),
-            flatten_into_set(two)
-            )
-    
-    def assertIsSubsetOf(self, subset, superset):
-        assert flatten_into_set(subset).issubset(flatten_into_set(superset))
+    # start_cluster already waits for this, so it normally returns at once
+    wait_for_binary_interface(node)
 
 class TestPagingSize(HybridTester, PageAssertionMixin):
     """
     Basic tests relating to page size (relative to results set)
     and validation of page size setting.
     """
+    cluster_profiles = ('fast-boot',)
+
     def test_with_no_results(self):
         """
         No errors when a page is requested and query has no results.
         """
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -149,7 +42,7 @@ class TestPagingSize(HybridTester, PageAssertionMixin):
         
     def test_with_less_results_than_page_size(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -183,7 +76,7 @@ class TestPagingSize(HybridTester, PageAssertionMixin):
     
     def test_with_more_results_than_page_size(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -222,7 +115,7 @@ class TestPagingSize(HybridTester, PageAssertionMixin):
     
     def test_with_equal_results_to_page_size(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -260,21 +153,18 @@ class TestPagingSize(HybridTester, PageAssertionMixin):
         If the page size <= 0 then the default fetch size is used.
         """
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
         self.create_ks(cursor, 'test_paging_size', 2)
         cursor.execute("CREATE TABLE paging_test ( id uuid PRIMARY KEY, value text )")
 
-        def random_txt(text):
-            return "{random}".format(random=uuid.uuid1())
-
         data = """
               | id     |value   |
-         *5001| [uuid] |testing |
+         *5001| @uuid  |testing |
             """
-        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(random_txt, cql_str))
+        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, cql_str))
         time.sleep(5)
 
         stmt = SimpleStatement("select * from paging_test")
@@ -297,13 +187,15 @@ class TestPagingWithModifiers(HybridTester, PageAssertionMixin):
     """
     Tests concerned with paging when CQL modifiers (such as order, limit, allow filtering) are used.
     """
+    cluster_profiles = ('fast-boot',)
+
     def test_with_order_by(self):
         """"
         Paging over a single partition with ordering should work.
         (Spanning multiple partitions won't though, by design. See CASSANDRA-6722).
         """
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -356,7 +248,7 @@ class TestPagingWithModifiers(HybridTester, PageAssertionMixin):
     
     def test_with_limit(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -408,7 +300,7 @@ class TestPagingWithModifiers(HybridTester, PageAssertionMixin):
     
     def test_with_allow_filtering(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -457,23 +349,22 @@ class TestPagingWithModifiers(HybridTester, PageAssertionMixin):
             ))
 
 class TestPagingData(HybridTester, PageAssertionMixin):
+    cluster_profiles = ('fast-boot', 'paging-stress')
+
     def test_paging_a_single_wide_row(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
         self.create_ks(cursor, 'test_paging_size', 2)
         cursor.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
 
-        def random_txt(text):
-            return "'{random}'".format(random=uuid.uuid1())
-
         data = """
-              | id | value                  |
-        *10000| 1  | [replaced with random] |
+              | id | value     |
+        *10000| 1  | @text(36) |
             """
-        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, random_txt))
+        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, cql_str))
         
         stmt = SimpleStatement("select * from paging_test where id = 1")
         stmt.setFetchSize(3000)
@@ -491,22 +382,19 @@ class TestPagingData(HybridTester, PageAssertionMixin):
     
     def test_paging_across_multi_wide_rows(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
         self.create_ks(cursor, 'test_paging_size', 2)
         cursor.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
 
-        def random_txt(text):
-            return "'{random}'".format(random=uuid.uuid1())
-
         data = """
-              | id | value                  |
-         *5000| 1  | [replaced with random] |
-         *5000| 2  | [replaced with random] |
+              | id | value     |
+         *5000| 1  | @text(36) |
+         *5000| 2  | @text(36) |
             """
-        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, random_txt))
+        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, cql_str))
         
         stmt = SimpleStatement("select * from paging_test where id in (1,2)")
         stmt.setFetchSize(3000)
@@ -522,9 +410,79 @@ class TestPagingData(HybridTester, PageAssertionMixin):
         
         self.assertEqualIgnoreOrder(pf.all_data(), expected_data)
         
+    def test_paging_storage_states(self):
+        """
+        Page through the same wide row left in memtables, flushed, spread
+        over several sstables and major compacted, comparing page latency.
+        """
+        cluster = self.cluster
+        self.start_cluster(3)
+        node1, node2, node3 = cluster.nodelist()
+        wait_for_node_alive(node1)
+        cursor = self.cql_connection(node1).cursor()
+        self.create_ks(cursor, 'test_paging_size', 2)
+
+        data = """
+               | id | mytext    |
+         *10000| 1  | @text(36) |
+            """
+        formatters = [('id', 'getInt', str), ('mytext', 'getString', cql_str)]
+        for state in ('memtable', 'flushed', 'sstables:8', 'compacted'):
+            table = 'paging_test_' + state.replace(':', '_')
+            cursor.execute("CREATE TABLE %s ( id int, mytext text, PRIMARY KEY (id, mytext) )" % table)
+            expected_data = self.create_rows_in_state(cursor, 'test_paging_size', table, data, state,
+                                                      format_funcs=(str, cql_str))
+            query = PagedQuery(SimpleStatement("select * from %s where id = 1" % table).setFetchSize(500),
+                               expected=expected_data.digest(), name=state)
+            stats = run_paged_queries(cursor, [query], formatters, workers=1)
+            debug("paging {}: {rows_per_sec:.0f} rows/s, page latency p50 {page_latency[p50]:.3f}s "
+                  "p99 {page_latency[p99]:.3f}s".format(state, **stats))
+            self.assertPagedQueriesOk([query])
+            self.assertEqual(query.pages, 20)
+
+        # the partition is on 2 of the 3 nodes
+        sstables = dict((entry['state'], sorted(entry['sstables'].values())) for entry in self.storage_states)
+        self.assertEqual(sstables['sstables:8'], [0, 8, 8])
+        self.assertEqual(sstables['compacted'], [0, 1, 1])
+
+    def test_paging_bulk_loaded_wide_row(self):
+        """
+        Pages through a partition too big to insert row by row in a test.
+        """
+        cluster = self.cluster
+        self.start_cluster(3)
+        node1, node2, node3 = cluster.nodelist()
+        wait_for_node_alive(node1)
+        cursor = self.cql_connection(node1).cursor()
+        self.create_ks(cursor, 'test_paging_size', 2)
+        cursor.execute("CREATE TABLE paging_test ( id int, value text, PRIMARY KEY (id, value) )")
+
+        data = """
+               | id | value     |
+        *200000| 1  | @text(36) |
+            """
+        expected_data = self.bulk_loader(cursor, 'test_paging_size').load(
+            'paging_test', data, format_funcs=(str, cql_str), compare_inserts=1000)
+
+        stmt = SimpleStatement("select * from paging_test where id = 1")
+        stmt.setFetchSize(5000)
+
+        results = cursor.execute(stmt)
+
+        # rows are checked page by page rather than kept
+        checker = PagingChecker(key=lambda row: row[1], capacity=len(expected_data))
+        pf = PageFetcher(
+            results, formatters = [('id', 'getInt', str), ('value', 'getString', cql_str)],
+            keep_data=False, checker=checker
+            )
+        pf.get_all_pages()
+        self.assertEqual(pf.num_results_all_pages(), [5000] * 40)
+        self.assertEqual(pf.digest, expected_data.digest())
+        self.assertPagedExactlyOnce(checker, expected_ids=(row[1] for row in expected_data))
+
     def test_paging_using_secondary_indexes(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -558,9 +516,11 @@ class TestPagingSizeChange(HybridTester, PageAssertionMixin):
     """
     Tests concerned with paging when the page size is changed between page retrievals.
     """
+    cluster_profiles = ('fast-boot',)
+
     def test_page_size_change(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -600,7 +560,7 @@ class TestPagingSizeChange(HybridTester, PageAssertionMixin):
     
     def test_page_size_set_multiple_times_before(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -634,7 +594,7 @@ class TestPagingSizeChange(HybridTester, PageAssertionMixin):
         Confirm that page size change does nothing after results are exhausted.
         """
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -665,13 +625,50 @@ class TestPagingSizeChange(HybridTester, PageAssertionMixin):
         stmt.setFetchSize(1000)
         self.assertEqual(results.one(), None)
 
+    def test_adaptive_page_size(self):
+        """
+        Let a FetchSizeTuner resize every page of a query, aiming at pages
+        of about 64KB, and make sure no row is lost or repeated.
+        """
+        cluster = self.cluster
+        self.start_cluster(3)
+        node1, node2, node3 = cluster.nodelist()
+        wait_for_node_alive(node1)
+        cursor = self.cql_connection(node1).cursor()
+        self.create_ks(cursor, 'test_paging_size', 2)
+        cursor.execute("CREATE TABLE paging_test ( id int, sometext text, PRIMARY KEY (id, sometext) )")
+
+        data = """
+               | id | sometext   |
+         *20000| 1  | @text(100) |
+            """
+        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, cql_str))
+        stmt = SimpleStatement("select * from paging_test where id = 1")
+        stmt.setFetchSize(50)
+
+        tuner = FetchSizeTuner(stmt, target_bytes=64 * 1024, log=debug)
+        results = cursor.execute(stmt)
+        pf = PageFetcher(
+            results, formatters = [('id', 'getInt', str), ('sometext', 'getString', cql_str)],
+            tuner=tuner
+            )
+        pf.get_all_pages()
+
+        sizes = pf.num_results_all_pages()
+        # 50, doubling up to the ~630 rows of 64KB
+        self.assertEqual(sizes[:4], [50, 100, 200, 400])
+        self.assertTrue(all(600 <= size <= 650 for size in sizes[5:-1]), sizes)
+        self.assertEqual(pf.digest, expected_data.digest())
+
 class TestPagingDatasetChanges(HybridTester, PageAssertionMixin):
     """
     Tests concerned with paging when the queried dataset changes while pages are being retrieved.
     """
+    cluster_profiles = ('fast-boot',)
+
     def test_data_change_impacting_earlier_page(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -712,7 +709,7 @@ class TestPagingDatasetChanges(HybridTester, PageAssertionMixin):
     
     def test_data_change_impacting_later_page(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -754,7 +751,7 @@ class TestPagingDatasetChanges(HybridTester, PageAssertionMixin):
     
     def test_data_delete_removing_remainder(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -791,7 +788,7 @@ class TestPagingDatasetChanges(HybridTester, PageAssertionMixin):
     
     def test_row_TTL_expiry_during_paging(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -837,7 +834,7 @@ class TestPagingDatasetChanges(HybridTester, PageAssertionMixin):
     
     def test_cell_TTL_expiry_during_paging(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
@@ -903,23 +900,98 @@ class TestPagingDatasetChanges(HybridTester, PageAssertionMixin):
         
         # TODO: modify test to TTL more than one column after CASSANDRA-6782 is resolved.
     
+    def test_paging_under_write_load(self):
+        """
+        Page through a partition while a background load inserts, updates,
+        deletes and TTLs other rows of it, comparing paging throughput and
+        latency with the same scan without the load.
+        """
+        cluster = self.cluster
+        self.start_cluster(3)
+        node1, node2, node3 = cluster.nodelist()
+        wait_for_node_alive(node1)
+        cursor = self.cql_connection(node1).cursor()
+        self.create_ks(cursor, 'test_paging_size', 2)
+        cursor.execute("CREATE TABLE paging_test ( id int, mytext text, value text, PRIMARY KEY (id, mytext) )")
+
+        data = """
+               | id | mytext    | value |
+         *20000| 1  | @text(36) | 'x'   |
+            """
+        stable_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, cql_str, str))
+        formatters = [('id', 'getInt', str), ('mytext', 'getString', cql_str), ('value', 'getString', cql_str)]
+
+        def scan():
+            query = PagedQuery(SimpleStatement("select * from paging_test where id = 1").setFetchSize(200))
+            stats = run_paged_queries(cursor, [query], formatters, workers=1, keep_data=True)
+            if query.error is not None:
+                raise query.error
+            return stats, query.fetcher
+
+        idle, _ = scan()
+        runner = self.start_load(cursor, MixedWrites('paging_test', {'id': '1'}, 'mytext', 'value', keys=5000), rate=500)
+        loaded, pf = scan()
+        load = runner.stop()
+
+        for name, stats in (('idle', idle), ('under load', loaded)):
+            debug("paging {}: {rows_per_sec:.0f} rows/s, page latency p50 {page_latency[p50]:.3f}s "
+                  "p99 {page_latency[p99]:.3f}s".format(name, **stats))
+        self.assertEqual(load['errors'], 0)
+        self.assertGreater(load['writes'], 0)
+        self.assertPagedUnderLoad(pf, stable_data, key=lambda row: tuple(row[:2]),
+                                  volatile=lambda row: MixedWrites.is_churn(row[1]))
+
+    def test_traced_paging_over_tombstones(self):
+        """
+        Trace every page of a partition with deleted cells, to see the
+        tombstones the replicas read and where each page's time went.
+        """
+        cluster = self.cluster
+        self.start_cluster(3)
+        node1, node2, node3 = cluster.nodelist()
+        wait_for_node_alive(node1)
+        cursor = self.cql_connection(node1).cursor()
+        self.create_ks(cursor, 'test_paging_size', 2)
+        cursor.execute("CREATE TABLE paging_test ( id int, mytext text, value text, PRIMARY KEY (id, mytext) )")
+
+        data = """
+              | id | mytext    | value |
+         *1000| 1  | @text(36) | 'x'   |
+            """
+        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, cql_str, str))
+        for row in expected_data[:500]:
+            cursor.execute("DELETE value FROM paging_test WHERE id = 1 AND mytext = %s" % row[1])
+
+        stmt = SimpleStatement("select * from paging_test where id = 1").setFetchSize(100).enableTracing()
+        pf = PageFetcher(
+            cursor.execute(stmt), formatters = [('id', 'getInt', str), ('mytext', 'getString', cql_str)],
+            trace=True
+            )
+        pf.get_all_pages()
+        for page, summary in enumerate(pf.traces):
+            debug("page {}: {}".format(page + 1, format_summary(summary)))
+
+        self.assertEqual(pf.pagecount(), 10)
+        self.assertEqual(len(pf.traces), 10)
+        self.assertNotIn(None, pf.traces)
+        total = pf.trace_summary()
+        self.assertGreater(total['tombstones'], 0)
+        self.assertGreaterEqual(total['live_cells'], 1000)
+
     def test_node_unavailabe_during_paging(self):
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
         self.create_ks(cursor, 'test_paging_size', 1)
         cursor.execute("CREATE TABLE paging_test ( id uuid, mytext text, PRIMARY KEY (id, mytext) )")
 
-        def make_uuid(text):
-            return str(uuid.uuid4())
-
         expected_data = create_rows("""
                 | id      | mytext |
-          *10000| [uuid]  | foo    |
+          *10000| @uuid   | foo    |
             """,
-            cursor, 'paging_test', format_funcs=(make_uuid, cql_str)
+            cursor, 'paging_test', format_funcs=(str, cql_str)
             )
         
         stmt = SimpleStatement("select * from paging_test where mytext = 'foo' allow filtering")
@@ -943,35 +1015,37 @@ class TestPagingQueryIsolation(HybridTester, PageAssertionMixin):
     """
     Tests concerned with isolation of paged queries (queries can't affect each other).
     """
+    cluster_profiles = ('fast-boot', 'paging-stress')
+
     def test_query_isolation(self):
         """
         Interleave some paged queries and make sure nothing bad happens.
         """
         cluster = self.cluster
-        cluster.populate(3).start()
+        self.start_cluster(3)
         node1, node2, node3 = cluster.nodelist()
         wait_for_node_alive(node1)
         cursor = self.cql_connection(node1).cursor()
         self.create_ks(cursor, 'test_paging_size', 2)
         cursor.execute("CREATE TABLE paging_test ( id int, mytext text, PRIMARY KEY (id, mytext) )")
 
-        def random_txt(text):
-            return "'{random}'".format(random=uuid.uuid1())
-
         data = """
-               | id | mytext   |
-          *5000| 1  | [random] |
-          *5000| 2  | [random] |
-          *5000| 3  | [random] |
-          *5000| 4  | [random] |
-          *5000| 5  | [random] |
-          *5000| 6  | [random] |
-          *5000| 7  | [random] |
-          *5000| 8  | [random] |
-          *5000| 9  | [random] |
-          *5000| 10 | [random] |
+               | id | mytext    |
+          *5000| 1  | @text(36) |
+          *5000| 2  | @text(36) |
+          *5000| 3  | @text(36) |
+          *5000| 4  | @text(36) |
+          *5000| 5  | @text(36) |
+          *5000| 6  | @text(36) |
+          *5000| 7  | @text(36) |
+          *5000| 8  | @text(36) |
+          *5000| 9  | @text(36) |
+          *5000| 10 | @text(36) |
             """
-        expected_data = create_rows(data, cursor, 'paging_test', format_funcs=(str, random_txt))
+        # 50k rows, written through every node rather than node1 alone
+        writer = self.token_aware_writer('test_paging_size')
+        expected_data = self.create_cached_rows(
+            cursor, 'test_paging_size', 'paging_test', data, format_funcs=(str, cql_str), writer=writer)
         
         stmts = [
             SimpleStatement("select * from paging_test where id in (1)").setFetchSize(500),
@@ -1018,17 +1092,123 @@ class TestPagingQueryIsolation(HybridTester, PageAssertionMixin):
         self.assertEqual(page_fetchers[9].pagecount(), 4)
         self.assertEqual(page_fetchers[10].pagecount(), 34)
         
-        self.assertEqualIgnoreOrder(page_fetchers[0].all_data(), expected_data[:5000])
-        self.assertEqualIgnoreOrder(page_fetchers[1].all_data(), expected_data[5000:10000])
-        self.assertEqualIgnoreOrder(page_fetchers[2].all_data(), expected_data[10000:15000])
-        self.assertEqualIgnoreOrder(page_fetchers[3].all_data(), expected_data[15000:20000])
-        self.assertEqualIgnoreOrder(page_fetchers[4].all_data(), expected_data[20000:25000])
-        self.assertEqualIgnoreOrder(page_fetchers[5].all_data(), expected_data[:5000])
-        self.assertEqualIgnoreOrder(page_fetchers[6].all_data(), expected_data[5000:10000])
-        self.assertEqualIgnoreOrder(page_fetchers[7].all_data(), expected_data[10000:15000])
-        self.assertEqualIgnoreOrder(page_fetchers[8].all_data(), expected_data[15000:20000])
-        self.assertEqualIgnoreOrder(page_fetchers[9].all_data(), expected_data[20000:25000])
-        self.assertEqualIgnoreOrder(page_fetchers[10].all_data(), expected_data[:50000])
+        self.assertEqual(page_fetchers[0].digest, expected_data[:5000].digest())
+        self.assertEqual(page_fetchers[1].digest, expected_data[5000:10000].digest())
+        self.assertEqual(page_fetchers[2].digest, expected_data[10000:15000].digest())
+        self.assertEqual(page_fetchers[3].digest, expected_data[15000:20000].digest())
+        self.assertEqual(page_fetchers[4].digest, expected_data[20000:25000].digest())
+        self.assertEqual(page_fetchers[5].digest, expected_data[:5000].digest())
+        self.assertEqual(page_fetchers[6].digest, expected_data[5000:10000].digest())
+        self.assertEqual(page_fetchers[7].digest, expected_data[10000:15000].digest())
+        self.assertEqual(page_fetchers[8].digest, expected_data[15000:20000].digest())
+        self.assertEqual(page_fetchers[9].digest, expected_data[20000:25000].digest())
+        self.assertEqual(page_fetchers[10].digest, expected_data[:50000].digest())
+
+    def test_concurrent_query_isolation(self):
+        """
+        Page through hundreds of queries at once, each with its own fetch
+        size, and make sure each gets its own partition's rows exactly.
+        """
+        cluster = self.cluster
+        self.start_cluster(3)
+        node1, node2, node3 = cluster.nodelist()
+        wait_for_node_alive(node1)
+        cursor = self.cql_connection(node1).cursor()
+        self.create_ks(cursor, 'test_paging_size', 2)
+        cursor.execute("CREATE TABLE paging_test ( id int, mytext text, PRIMARY KEY (id, mytext) )")
+
+        data = """
+               | id | mytext    |
+          *5000| 1  | @text(36) |
+          *5000| 2  | @text(36) |
+          *5000| 3  | @text(36) |
+          *5000| 4  | @text(36) |
+          *5000| 5  | @text(36) |
+          *5000| 6  | @text(36) |
+          *5000| 7  | @text(36) |
+          *5000| 8  | @text(36) |
+          *5000| 9  | @text(36) |
+          *5000| 10 | @text(36) |
+            """
+        writer = self.token_aware_writer('test_paging_size')
+        expected_data = self.create_cached_rows(
+            cursor, 'test_paging_size', 'paging_test', data, format_funcs=(str, cql_str), writer=writer)
+        digests = dict((i, expected_data[(i - 1) * 5000:i * 5000].digest()) for i in range(1, 11))
+
+        queries = []
+        for i in range(300):
+            partition = i % 10 + 1
+            stmt = SimpleStatement("select * from paging_test where id = %d" % partition).setFetchSize(100 + (i * 37) % 1900)
+            queries.append(PagedQuery(stmt, expected=digests[partition]))
+
+        stats = run_paged_queries(cursor, queries, [('id', 'getInt', str), ('mytext', 'getString', cql_str)], workers=64)
+        debug("{queries} paged queries over {workers} threads: {rows_per_sec:.0f} rows/s, page latency "
+              "p50 {page_latency[p50]:.3f}s p95 {page_latency[p95]:.3f}s max {page_latency[max]:.3f}s".format(**stats))
+        self.assertPagedQueriesOk(queries)
+        self.assertEqual(stats['rows'], 300 * 5000)
+
+    def test_token_range_scan(self):
+        """
+        Scan a whole table split in token ranges paged concurrently, and
+        make sure it sees the same rows as a single paged scan.
+        """
+        cluster = self.cluster
+        self.start_cluster(3)
+        node1, node2, node3 = cluster.nodelist()
+        wait_for_node_alive(node1)
+        cursor = self.cql_connection(node1).cursor()
+        self.create_ks(cursor, 'test_paging_size', 2)
+        cursor.execute("CREATE TABLE paging_test ( id int PRIMARY KEY, mytext text )")
+
+        data = """
+                 | id   | mytext    |
+          *100000| @seq | @text(36) |
+            """
+        writer = self.token_aware_writer('test_paging_size')
+        expected_data = self.create_cached_rows(
+            cursor, 'test_paging_size', 'paging_test', data, format_funcs=(str, cql_str), writer=writer)
+        formatters = [('id', 'getInt', str), ('mytext', 'getString', cql_str)]
+
+        start = time.time()
+        single = PageFetcher(cursor.execute(SimpleStatement("select * from paging_test").setFetchSize(5000)),
+                             formatters, keep_data=False)
+        single.get_all_pages()
+        single_rate = single.digest.count / (time.time() - start)
+
+        scan = TokenRangeScan(cursor, 'paging_test', 'id', self.ring_tokens(), formatters, SimpleStatement,
+                              fetch_size=5000, splits=8)
+        stats = scan.run(workers=24)
+        debug("token range scan: {queries} ranges, {rows_per_sec:.0f} rows/s vs {single:.0f} rows/s "
+              "with a single paged query".format(single=single_rate, **stats))
+
+        self.assertEqual(single.digest, expected_data.digest())
+        self.assertEqual(scan.digest, expected_data.digest())
+        self.assertEqual(stats['rows'], 100000)
+
+@unittest.skipUnless(SCALING_MATRIX, "set SCALING_MATRIX=yes to run the scaling matrix")
+class TestPagingScaling(HybridTester, PageAssertionMixin):
+    """
+    Paging cost across cluster sizes, replication factors and consistency
+    levels (see scaling.py).
+    """
+    cluster_profiles = ('fast-boot',)
+
+    def test_paging_scaling_matrix(self):
+        def setup(cursor):
+            cursor.execute("CREATE TABLE paging_test ( id int, mytext text, PRIMARY KEY (id, mytext) )")
+            data = """
+                   | id | mytext    |
+             *20000| 1  | @text(36) |
+             *20000| 2  | @text(36) |
+                """
+            return create_rows(data, cursor, 'paging_test', format_funcs=(str, cql_str))
+
+        cells = self.run_matrix(setup, "select * from paging_test where id in (1, 2)",
+                                [('id', 'getInt', str), ('mytext', 'getString', cql_str)],
+                                queries=4, workers=4)
+        failed = [cell for cell in cells if cell.error is not None]
+        self.assertEqual(failed, [], "failed cells: %s" % [cell.as_dict() for cell in failed])
+        self.assertEqual(len(cells), 45)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
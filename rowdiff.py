@@ -0,0 +1,139 @@
+"""
+Diff of two row streams ignoring order, for assertion messages on results
+too big to compare as sets and print. Both sides are sorted, spilling
+sorted runs to temporary files past SPILL_ROWS rows, then walked side by
+side, so a diff of millions of rows takes a bounded amount of memory.
+Rows are compared as multisets: a row expected once and seen twice is a
+duplicate.
+"""
+import heapq, itertools, os, shutil, tempfile
+
+from datahelp import flatten_row
+
+# rows sorted in memory before a run is spilled to disk
+SPILL_ROWS = 100000
+# rows of each kind a RowDiff keeps
+MAX_REPORTED = 20
+
+def _keyed(rows):
+    # flattened rows escaped to a line each, with their index in the stream
+    for index, row in enumerate(rows):
+        yield flatten_row(row).encode('string_escape'), index
+
+def _read_run(path):
+    with open(path) as f:
+        for line in f:
+            key, index = line.rstrip('\n').rsplit('\t', 1)
+            yield key, int(index)
+
+def sorted_rows(rows, tmpdir, spill_rows=SPILL_ROWS):
+    """Yields (key, index) of the rows, sorted by key."""
+    runs = []
+    rows = _keyed(rows)
+    while True:
+        run = sorted(itertools.islice(rows, spill_rows))
+        if not runs and len(run) < spill_rows:
+            # fits in memory
+            for item in run:
+                yield item
+            return
+        if not run:
+            break
+        path = os.path.join(tmpdir, 'run%d' % len(runs))
+        with open(path, 'w') as f:
+            for key, index in run:
+                f.write('%s\t%d\n' % (key, index))
+        runs.append(path)
+        del run
+    for item in heapq.merge(*[_read_run(path) for path in runs]):
+        yield item
+
+def _grouped(items):
+    # (key, [indexes]) of the sorted (key, index) items
+    for key, group in itertools.groupby(items, key=lambda item: item[0]):
+        yield key, [index for _, index in group]
+
+class RowDiff(object):
+    """
+    Rows only in the expected stream (missing), only in the actual one
+    (extra), and in the actual one more often than expected (duplicated),
+    with their positions: the row index, or (page, row in page) when the
+    page sizes of the stream are known.
+    """
+    def __init__(self, expected_pages=None, actual_pages=None, max_reported=MAX_REPORTED):
+        self.expected_pages = expected_pages
+        self.actual_pages = actual_pages
+        self.max_reported = max_reported
+        self.missing, self.missing_count = [], 0
+        self.extra, self.extra_count = [], 0
+        self.duplicated, self.duplicated_count = [], 0
+        self.expected_rows = self.actual_rows = 0
+
+    def _add(self, kind, key, positions, pages, count):
+        setattr(self, kind + '_count', getattr(self, kind + '_count') + count)
+        found = getattr(self, kind)
+        if len(found) < self.max_reported:
+            found.append((key.decode('string_escape'), [self.position(index, pages) for index in positions[:10]]))
+
+    @staticmethod
+    def position(index, page_sizes):
+        """Row index as (page number, row in page), 1-based, when the page sizes are known."""
+        if page_sizes is None:
+            return index
+        for page, size in enumerate(page_sizes):
+            if index < size:
+                return page + 1, index + 1
+            index -= size
+        return index
+
+    def ok(self):
+        return not (self.missing_count or self.extra_count or self.duplicated_count)
+
+    def __str__(self):
+        lines = ["%d rows expected, %d seen" % (self.expected_rows, self.actual_rows)]
+        for name, count, found, where in (('missing', self.missing_count, self.missing, 'expected at'),
+                                          ('extra', self.extra_count, self.extra, 'at'),
+                                          ('duplicated', self.duplicated_count, self.duplicated, 'at')):
+            if count:
+                lines.append("%d %s:" % (count, name))
+                lines.extend("  %s (%s %s)" % (key, where, ', '.join(map(str, positions))) for key, positions in found)
+                if count > len(found):
+                    lines.append("  ...")
+        return '\n'.join(lines)
+
+def diff_rows(expected, actual, expected_pages=None, actual_pages=None,
+              max_reported=MAX_REPORTED, spill_rows=SPILL_ROWS):
+    """
+    Returns the RowDiff of two iterables of rows. expected_pages and
+    actual_pages are the page sizes of the streams, if they were paged.
+    """
+    diff = RowDiff(expected_pages, actual_pages, max_reported)
+    tmpdir = tempfile.mkdtemp(prefix='dtest-rowdiff-')
+    try:
+        os.mkdir(os.path.join(tmpdir, 'expected'))
+        os.mkdir(os.path.join(tmpdir, 'actual'))
+        sides = [_grouped(sorted_rows(expected, os.path.join(tmpdir, 'expected'), spill_rows)),
+                 _grouped(sorted_rows(actual, os.path.join(tmpdir, 'actual'), spill_rows))]
+        exp, act = next(sides[0], None), next(sides[1], None)
+        while exp is not None or act is not None:
+            if act is None or (exp is not None and exp[0] < act[0]):
+                diff.expected_rows += len(exp[1])
+                diff._add('missing', exp[0], exp[1], expected_pages, len(exp[1]))
+                exp = next(sides[0], None)
+            elif exp is None or act[0] < exp[0]:
+                diff.actual_rows += len(act[1])
+                diff._add('extra', act[0], act[1], actual_pages, len(act[1]))
+                act = next(sides[1], None)
+            else:
+                key, expected_at, actual_at = exp[0], exp[1], act[1]
+                diff.expected_rows += len(expected_at)
+                diff.actual_rows += len(actual_at)
+                if len(actual_at) > len(expected_at):
+                    diff._add('duplicated', key, actual_at, actual_pages, len(actual_at) - len(expected_at))
+                elif len(actual_at) < len(expected_at):
+                    diff._add('missing', key, expected_at[len(actual_at):], expected_pages,
+                              len(expected_at) - len(actual_at))
+                exp, act = next(sides[0], None), next(sides[1], None)
+    finally:
+        shutil.rmtree(tmpdir)
+    return diff
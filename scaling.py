@@ -0,0 +1,51 @@
+"""
+Scaling matrix: the same paging workload run on clusters of several sizes,
+with several replication factors and consistency levels, to see how paging
+cost grows with the replicas read and the number of nodes on one machine.
+
+HybridTester.run_matrix builds a fresh cluster for each node count, a
+keyspace for each replication factor, and pages through the workload's
+query at each consistency level, giving one MatrixCell per combination.
+"""
+
+# node counts, replication factors and consistency levels of a default matrix
+DEFAULT_NODES = (1, 2, 3, 4, 5, 6)
+DEFAULT_RFS = (1, 2, 3)
+DEFAULT_CLS = ('ONE', 'QUORUM', 'ALL')
+
+def matrix_cells(nodes=DEFAULT_NODES, rfs=DEFAULT_RFS, cls=DEFAULT_CLS):
+    """
+    (nodes, rf, cl) combinations, grouped by node count then rf, leaving
+    out replication factors higher than the node count.
+    """
+    return [(n, rf, cl) for n in nodes for rf in rfs if rf <= n for cl in cls]
+
+class MatrixCell(object):
+    """Paging stats of one (nodes, rf, cl) combination, as run_paged_queries returns them."""
+    def __init__(self, nodes, rf, cl, stats=None, error=None):
+        self.nodes = nodes
+        self.rf = rf
+        self.cl = cl
+        self.stats = stats
+        self.error = error
+
+    def as_dict(self):
+        cell = {'nodes': self.nodes, 'rf': self.rf, 'cl': self.cl}
+        if self.stats is not None:
+            cell.update(rows=self.stats['rows'], rows_per_sec=self.stats['rows_per_sec'],
+                        page_latency=self.stats['page_latency'])
+        if self.error is not None:
+            cell['error'] = str(self.error)
+        return cell
+
+def format_matrix(cells):
+    """Table of rows/sec and page latencies, a line per cell."""
+    lines = ["nodes  rf  cl          rows/s   p50 page  p99 page"]
+    for cell in cells:
+        if cell.stats is None:
+            lines.append("%5d %3d  %-7s  failed: %s" % (cell.nodes, cell.rf, cell.cl, cell.error))
+        else:
+            latency = cell.stats['page_latency']
+            lines.append("%5d %3d  %-7s %9.0f %8.3fs %8.3fs" % (
+                cell.nodes, cell.rf, cell.cl, cell.stats['rows_per_sec'], latency['p50'], latency['p99']))
+    return '\n'.join(lines)
@@ -0,0 +1,111 @@
+"""
+Server side metrics of the nodes, from nodetool tpstats and cfstats, so a
+test's cost on the server (tombstones scanned, reads served, dropped
+messages...) can be seen next to its client side timings.
+
+A snapshot is a flat dict of metric name to number for one node:
+
+    tpstats.ReadStage.completed      thread pool counters
+    dropped.READ                     dropped messages
+    <ks>.<table>.local_read_count    per table stats (system keyspaces left out)
+
+metrics_delta turns the snapshots taken before and after a test into what
+the test did. HybridTester takes them with SERVER_METRICS=yes.
+"""
+import re
+
+# keyspaces whose tables are left out of snapshots
+SYSTEM_KEYSPACES = ('system', 'system_auth', 'system_traces')
+# metrics counting since the node started, whose increase is reported
+# (dropped.* messages are counters too)
+COUNTERS = frozenset([
+    'completed', 'all_time_blocked',
+    'local_read_count', 'local_write_count', 'memtable_switch_count', 'bloom_filter_false_positives',
+    'dropped_mutations',
+])
+# metrics whose value is a level rather than a count, reported as they end up
+GAUGES = frozenset([
+    'active', 'pending', 'blocked',
+    'sstable_count', 'space_used', 'space_used_bytes', 'space_used_by_snapshots', 'off_heap_memory_used',
+    'sstable_compression_ratio', 'number_of_keys', 'pending_tasks', 'pending_flushes',
+    'memtable_cell_count', 'memtable_columns_count', 'memtable_data_size', 'memtable_off_heap_memory_used',
+    'local_read_latency', 'local_write_latency',
+    'bloom_filter_false_ratio', 'bloom_filter_space_used', 'bloom_filter_off_heap_memory_used',
+    'index_summary_off_heap_memory_used', 'compression_metadata_off_heap_memory_used',
+    'compacted_partition_minimum_bytes', 'compacted_partition_maximum_bytes', 'compacted_partition_mean_bytes',
+    'compacted_row_minimum_size', 'compacted_row_maximum_size', 'compacted_row_mean_size',
+    'average_live_cells_per_slice', 'maximum_live_cells_per_slice',
+    'average_tombstones_per_slice', 'maximum_tombstones_per_slice',
+])
+
+NUMBER_RE = re.compile(r'^-?\d+(\.\d+)?(E-?\d+)?')
+
+def _name(label):
+    # 'Local read latency' -> 'local_read_latency'
+    label = re.sub(r'\(.*?\)', '', label)
+    return re.sub(r'[^a-z0-9]+', '_', label.lower()).strip('_')
+
+def _number(text):
+    m = NUMBER_RE.match(text.strip())
+    if m is None:
+        return None
+    return float(m.group(0)) if m.group(1) or m.group(2) else int(m.group(0))
+
+def parse_tpstats(output):
+    """Snapshot of the output of nodetool tpstats."""
+    metrics = {}
+    columns = None
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if line.startswith('Pool Name'):
+            columns = [_name(col) for col in re.split(r'\s{2,}', line.strip())[1:]]
+        elif line.startswith('Message type'):
+            columns = 'dropped'
+        elif columns == 'dropped' and len(fields) == 2 and fields[1].isdigit():
+            metrics['dropped.%s' % fields[0]] = int(fields[1])
+        elif columns and len(fields) == len(columns) + 1 and all(f.isdigit() for f in fields[1:]):
+            for column, value in zip(columns, fields[1:]):
+                metrics['tpstats.%s.%s' % (fields[0], column)] = int(value)
+    return metrics
+
+def parse_cfstats(output):
+    """Snapshot of the per table stats in the output of nodetool cfstats."""
+    metrics = {}
+    keyspace = table = None
+    for line in output.splitlines():
+        if ':' not in line:
+            continue
+        label, value = [part.strip() for part in line.split(':', 1)]
+        if label == 'Keyspace':
+            keyspace, table = value, None
+        elif label in ('Table', 'Column Family'):
+            table = value
+        elif table is not None and keyspace not in SYSTEM_KEYSPACES:
+            number = _number(value)
+            if number is not None:
+                metrics['%s.%s.%s' % (keyspace, table, _name(label))] = number
+    return metrics
+
+def is_counter(name):
+    return name.startswith('dropped.') or name.rsplit('.', 1)[-1] in COUNTERS
+
+def is_gauge(name):
+    return name.rsplit('.', 1)[-1] in GAUGES
+
+def metrics_delta(before, after):
+    """
+    What changed between two snapshots of a node: the increase of every
+    counter and the final value of every gauge, leaving zeros out, and
+    metrics that are neither, which can't be told how to report.
+    """
+    delta = {}
+    for name, value in after.items():
+        if is_counter(name):
+            value = value - before.get(name, 0)
+        elif not is_gauge(name):
+            continue
+        if value:
+            delta[name] = value
+    return delta
@@ -0,0 +1,125 @@
+"""
+Soak mode: the suite run over and over for SOAK_MINUTES, on clusters kept
+from one test to the next, to catch slow leaks a single pass can't show.
+
+After every test, noserunner's SoakMonitor records a sample: the heap the
+client JVM uses after a GC, the resident memory of the nodes, and the
+rows/sec and page latency of the test's paging. detect_drift then looks
+for throughput or latency drifting from one pass to the next, and for
+memory growing steadily over the run.
+"""
+
+# how much worse the last third of the passes may page than the first
+THROUGHPUT_DROP = 0.2
+LATENCY_RISE = 0.3
+# how much memory may grow over the run, as a fraction of where it started
+MEMORY_GROWTH = 0.2
+
+def paging_sample(timings):
+    """
+    rows/sec of a test's paging and the mean time the driver took to fetch
+    a page, from its phase timings, or None if it didn't page.
+    """
+    if not timings:
+        return None
+    counters = timings.get('counters', {})
+    rows = counters.get('paged_rows', 0)
+    seconds = timings.get('phases', {}).get('paging', 0.0)
+    if not rows or not seconds:
+        return None
+    fetched = counters.get('fetched_pages', 0)
+    return {'rows_per_sec': rows / seconds,
+            'page_latency': counters.get('fetch_seconds', 0.0) / fetched if fetched else None}
+
+def slope(points):
+    """Least squares slope of (x, y) points."""
+    if len(points) < 2:
+        return 0.0
+    n = float(len(points))
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+def _thirds(values):
+    third = max(len(values) // 3, 1)
+    return values[:third], values[-third:]
+
+def _mean(values):
+    return sum(values) / float(len(values))
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def steady_growth(points):
+    """
+    Growth of a series of (time, value) points over the run, as a fraction
+    of its start, if it grows steadily: the fitted line goes up and the
+    lowest value of the last third is above the highest of the first
+    (so a sawtooth, as a collected heap draws, doesn't count). Else 0.
+    """
+    points = [(x, y) for x, y in points if y is not None]
+    if len(points) < 3:
+        return 0.0
+    first, last = _thirds([y for _, y in points])
+    if min(last) <= max(first):
+        return 0.0
+    start = first[0] or 1
+    return max(slope(points) * (points[-1][0] - points[0][0]) / start, 0.0)
+
+def paging_ratios(samples, metric):
+    """
+    Per test, the mean of metric over the last third of its samples
+    divided by the mean over the first third.
+    """
+    by_test = {}
+    for sample in samples:
+        if sample.get(metric) is not None:
+            by_test.setdefault(sample['test'], []).append(sample[metric])
+    ratios = {}
+    for test, values in by_test.items():
+        if len(values) >= 2:
+            first, last = _thirds(values)
+            if _mean(first):
+                ratios[test] = _mean(last) / _mean(first)
+    return ratios
+
+def detect_drift(samples, throughput_drop=THROUGHPUT_DROP, latency_rise=LATENCY_RISE, memory_growth=MEMORY_GROWTH):
+    """
+    Messages describing the drift in samples (dicts with time, test,
+    heap_used, cluster, rss_kb, rows_per_sec and page_latency), empty if
+    none. Node memory is followed node by node, within a kept cluster.
+    Paging drift is the median over the tests, so one noisy test doesn't
+    decide.
+    """
+    flags = []
+    throughput = paging_ratios(samples, 'rows_per_sec')
+    if throughput and _median(throughput.values()) < 1 - throughput_drop:
+        flags.append("paging throughput dropped to %.0f%% of the first passes (median over %d tests)" % (
+            100 * _median(throughput.values()), len(throughput)))
+    latency = paging_ratios(samples, 'page_latency')
+    if latency and _median(latency.values()) > 1 + latency_rise:
+        flags.append("page latency rose to %.0f%% of the first passes (median over %d tests)" % (
+            100 * _median(latency.values()), len(latency)))
+    growth = steady_growth([(sample['time'], sample.get('heap_used')) for sample in samples])
+    if growth > memory_growth:
+        flags.append("client heap grew steadily by %.0f%%" % (100 * growth))
+    growth, node = max([(steady_growth(points), node) for node, points in node_rss(samples).items()] or [(0.0, None)])
+    if growth > memory_growth:
+        flags.append("resident memory of %s grew steadily by %.0f%%" % (node[1], 100 * growth))
+    return flags
+
+def node_rss(samples):
+    """
+    (time, rss) points of every node, by (cluster, node name): a node of
+    one kept cluster isn't the node of the same name of another.
+    """
+    points = {}
+    for sample in samples:
+        for name, rss in (sample.get('rss_kb') or {}).items():
+            if rss is not None:
+                points.setdefault((sample.get('cluster'), name), []).append((sample['time'], rss))
+    return points
@@ -0,0 +1,49 @@
+"""
+Thin client for the warm test daemon (see testdaemon.py). Start the
+daemon with `ant start_daemon`, then run tests with any python:
+
+    python testclient.py paging_test:TestPagingSize.test_with_no_results
+
+Arguments are passed to nose as they would be on the command line, and
+the client's environment (DEBUG, KEEP_LOGS, CLUSTER_PROFILES...) is used
+for the run. `python testclient.py --stop` shuts the daemon down.
+
+The daemon runs whatever it is asked to with the environment it is given,
+so it only takes requests with the token it writes to TOKEN_FILE when it
+starts, which only the user running it can read.
+"""
+import json, os, socket, sys
+
+DAEMON_PORT = int(os.environ.get('DTEST_DAEMON_PORT', '9797'))
+# last line of a response, followed by the exit code
+EXIT_MARKER = '__dtest_exit__'
+# written by the daemon, readable by its owner only
+TOKEN_FILE = os.path.expanduser(os.environ.get('DTEST_DAEMON_TOKEN', '~/.cassandra-dtest-jython/daemon-token'))
+
+def main(args):
+    try:
+        sock = socket.create_connection(('127.0.0.1', DAEMON_PORT))
+        with open(TOKEN_FILE) as f:
+            token = f.read().strip()
+    except (socket.error, IOError) as e:
+        sys.stderr.write("Can't reach the test daemon on port %d (%s), start it with `ant start_daemon`\n" % (DAEMON_PORT, e))
+        return 2
+
+    if args == ['--stop']:
+        request = {'command': 'stop'}
+    else:
+        request = {'command': 'run', 'argv': args, 'env': dict(os.environ), 'cwd': os.getcwd()}
+    request['token'] = token
+    # python 2 or 3
+    sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+
+    for line in sock.makefile('r'):
+        if line.startswith(EXIT_MARKER):
+            return int(line.split()[1])
+        sys.stdout.write(line)
+        sys.stdout.flush()
+    sys.stderr.write("Lost the connection to the test daemon\n")
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,161 @@
+"""
+Long-lived jython that keeps ccmlib, nose, yaml and the driver classes
+loaded and runs the tests testclient.py asks for, so re-running a test
+doesn't pay for a cold JVM and all the imports every time.
+
+It listens on localhost, but running tests means running any code with
+any environment, so requests must carry the token it writes to
+testclient.TOKEN_FILE (mode 0600) when it starts.
+
+Start it with `ant start_daemon`. The modules of this checkout (tests,
+base, datahelp...) are reloaded for every run so edits are picked up;
+only third party modules stay warm.
+"""
+import json, logging, os, socket, sys, traceback
+
+# warm up everything a test run needs
+import nose, yaml, ccmlib.cluster, ccmlib.node
+import base, datahelp, timing, noserunner
+
+# java
+from java.lang import Class, ClassNotFoundException
+from com.datastax.driver.core import Cluster as JCluster
+
+from testclient import DAEMON_PORT, EXIT_MARKER, TOKEN_FILE
+
+# driver classes loaded up front, as the first run would otherwise pay for them
+WARM_CLASSES = [
+    'com.datastax.driver.core.SimpleStatement',
+    'com.datastax.driver.core.BoundStatement',
+    'com.datastax.driver.core.ResultSet',
+    'com.datastax.driver.core.Row',
+    'com.datastax.driver.core.SessionManager',
+    'com.datastax.driver.core.Connection',
+    'com.datastax.driver.core.exceptions.InvalidQueryException',
+    'com.datastax.driver.core.exceptions.UnavailableException',
+]
+
+CHECKOUT_DIR = os.path.abspath(os.path.dirname(__file__))
+
+class SocketWriter(object):
+    """File-like object streaming test output to the client."""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.conn.sendall(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+def warm_up():
+    for name in WARM_CLASSES:
+        try:
+            Class.forName(name)
+        except ClassNotFoundException:
+            # not in this driver version
+            pass
+    # builds (but doesn't connect) a driver cluster, loading most of its plumbing
+    JCluster.builder().addContactPoint('127.0.0.1').build().close()
+
+def forget_checkout_modules():
+    """Drops the modules of this checkout so the next run imports them afresh."""
+    for name, module in sys.modules.items():
+        path = getattr(module, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == CHECKOUT_DIR and name != '__main__':
+            del sys.modules[name]
+
+def run_tests(argv, env, out):
+    """
+    Runs nose with argv (plus the options noserunner.py uses) in env,
+    writing everything to out. Returns the exit code.
+    """
+    saved_env = dict(os.environ)
+    saved_streams = sys.stdout, sys.stderr
+    os.environ.clear()
+    os.environ.update((key.encode('utf-8'), value.encode('utf-8')) for key, value in env.items())
+    sys.stdout = sys.stderr = out
+    # base's logging.basicConfig only set a handler up the first time,
+    # on the stderr of the time
+    root = logging.getLogger()
+    saved_handlers = root.handlers[:]
+    handler = logging.StreamHandler(out)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root.handlers = [handler]
+    try:
+        forget_checkout_modules()
+        import noserunner
+        program = nose.core.TestProgram(
+            argv=['nosetests', '--with-xunit', '--with-phase-timing', '--nocapture', '--nologcapture'] + argv,
+            addplugins=[noserunner.PhaseTiming()], exit=False)
+        return 0 if program.success else 1
+    finally:
+        root.handlers = saved_handlers
+        sys.stdout, sys.stderr = saved_streams
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+def write_token(path=TOKEN_FILE):
+    """Writes a new random token to path, readable by the current user only, and returns it."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0700)
+    if os.path.exists(path):
+        os.remove(path)
+    token = os.urandom(16).encode('hex')
+    f = os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600), 'w')
+    try:
+        f.write(token + '\n')
+    finally:
+        f.close()
+    return token
+
+def serve(port=DAEMON_PORT):
+    token = write_token()
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(5)
+    print "test daemon listening on 127.0.0.1:%d" % port
+
+    while True:
+        conn, _ = server.accept()
+        out = SocketWriter(conn)
+        stop = False
+        try:
+            request = json.loads(conn.makefile('r').readline())
+            if request.get('token') != token:
+                # any local user can connect, only the owner can read the token
+                out.write("test daemon: missing or wrong token (see %s)\n" % TOKEN_FILE)
+                code = 2
+            elif request['command'] == 'stop':
+                out.write("test daemon stopping\n")
+                code, stop = 0, True
+            elif os.path.abspath(request.get('cwd', CHECKOUT_DIR)) != CHECKOUT_DIR:
+                out.write("test daemon serves %s, not %s\n" % (CHECKOUT_DIR, request['cwd']))
+                code = 2
+            else:
+                code = run_tests(request['argv'], request.get('env', os.environ), out)
+            out.write('%s %d\n' % (EXIT_MARKER, code))
+        except Exception:
+            try:
+                out.write(traceback.format_exc())
+                out.write('%s %d\n' % (EXIT_MARKER, 2))
+            except socket.error:
+                pass
+        finally:
+            conn.close()
+        if stop:
+            break
+    server.close()
+
+if __name__ == '__main__':
+    os.chdir(CHECKOUT_DIR)
+    warm_up()
+    serve()
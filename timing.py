@@ -0,0 +1,124 @@
+"""
+Per-test phase timings.
+
+HybridTester starts a PhaseTimer for every test, and the harness helpers
+(cluster lifecycle, create_ks, create_rows, PageFetcher) record into the
+current one, so tests get a breakdown of where their time goes without
+timing anything themselves.
+
+Time is always attributed to exactly one phase, so the phases of a test
+add up to its total. Time not covered by a named phase goes to 'test'.
+Only the thread that started the timer records phases; helpers called
+from other threads are expected to be wrapped in a phase by their caller.
+Counters can be bumped from any thread.
+"""
+import time, threading
+from contextlib import contextmanager
+
+DEFAULT_PHASE = 'test'
+
+_current = None
+
+class PhaseTimer(object):
+    def __init__(self, test_id, phase=DEFAULT_PHASE):
+        self.test_id = test_id
+        self.phases = {}
+        self.counters = {}
+        self._counters_lock = threading.Lock()
+        self.thread = threading.current_thread()
+        self.started = time.time()
+        self._since = self.started
+        # (name, open_ended) pairs, the last one being the phase timed right now
+        self._stack = [(DEFAULT_PHASE, False)]
+        if phase != DEFAULT_PHASE:
+            self.begin(phase)
+
+    def _account(self):
+        now = time.time()
+        name = self._stack[-1][0]
+        self.phases[name] = self.phases.get(name, 0.0) + (now - self._since)
+        self._since = now
+
+    def _close_open_ended(self):
+        while self._stack[-1][1]:
+            self._stack.pop()
+
+    def begin(self, name):
+        """
+        Starts an open ended phase, which lasts until another phase starts
+        or the enclosing phase ends.
+        """
+        self._account()
+        self._close_open_ended()
+        self._stack.append((name, True))
+
+    def push(self, name):
+        self._account()
+        self._close_open_ended()
+        self._stack.append((name, False))
+
+    def pop(self):
+        self._account()
+        self._close_open_ended()
+        if len(self._stack) > 1:
+            self._stack.pop()
+
+    def count(self, name, amount=1):
+        with self._counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def stop(self):
+        """
+        Stops timing and returns the timings as a dict
+        (test, total, phases, counters).
+        """
+        self._account()
+        return {
+            'test': self.test_id,
+            'total': self._since - self.started,
+            'phases': dict(self.phases),
+            'counters': dict(self.counters),
+        }
+
+def start(test_id, phase=DEFAULT_PHASE):
+    """Starts timing a test, replacing any current timer."""
+    global _current
+    _current = PhaseTimer(test_id, phase)
+    return _current
+
+def stop():
+    """Stops the current timer and returns its timings (or None if there was none)."""
+    global _current
+    timer, _current = _current, None
+    if timer is None:
+        return None
+    return timer.stop()
+
+def _recording():
+    timer = _current
+    if timer is not None and timer.thread is threading.current_thread():
+        return timer
+    return None
+
+def begin(name):
+    timer = _recording()
+    if timer is not None:
+        timer.begin(name)
+
+def count(name, amount=1):
+    timer = _current
+    if timer is not None:
+        timer.count(name, amount)
+
+@contextmanager
+def phase(name):
+    """Attributes the time spent in the with block to the named phase."""
+    timer = _recording()
+    if timer is None:
+        yield
+        return
+    timer.push(name)
+    try:
+        yield
+    finally:
+        timer.pop()
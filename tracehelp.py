@@ -0,0 +1,81 @@
+"""
+Where the time of a traced query went, from its trace events: per node,
+and per kind of work (memtable, sstable, messaging, other), along with
+the cells, tombstones and sstables the replicas read.
+
+The statement must be traced (stmt.enableTracing()) for the driver to
+give a QueryTrace with every page it fetches; PageFetcher(trace=True)
+summarizes the trace of each page with summarize_trace.
+"""
+import re
+
+LIVE_TOMBSTONES_RE = re.compile(r'Read (\d+) live and (\d+) tombstoned cells')
+SSTABLES_RE = re.compile(r'Merging data from memtables and (\d+) sstables')
+SEQ_SCAN_RE = re.compile(r'Executing seq scan across (\d+) sstables')
+
+def event_kind(description):
+    """Kind of work a trace event describes: memtable, sstable, messaging or other."""
+    description = description.lower()
+    if 'memtable' in description and 'sstable' not in description:
+        return 'memtable'
+    if any(word in description for word in ('sstable', 'data file', 'partition index', 'bloom filter', 'key cache')):
+        return 'sstable'
+    if 'message' in description or 'response' in description:
+        return 'messaging'
+    return 'other'
+
+def trace_events(trace):
+    """(description, source, elapsed micros on source) of the events of a driver QueryTrace."""
+    return [(event.getDescription(), event.getSource().getHostAddress(), event.getSourceElapsedMicros())
+            for event in trace.getEvents()]
+
+def summarize_trace(duration_micros, coordinator, events):
+    """
+    Summary of a trace, its events being (description, source, elapsed
+    micros on source) tuples. The time of an event is the time since
+    the previous event of the same node.
+    """
+    summary = {
+        'duration_ms': duration_micros / 1000.0 if duration_micros is not None else None,
+        'coordinator': coordinator,
+        'nodes': {},
+        'by_kind': {},
+        'live_cells': 0,
+        'tombstones': 0,
+        'sstables': 0,
+    }
+    previous = {}
+    for description, source, elapsed in sorted(events, key=lambda event: (event[1], event[2])):
+        ms = (elapsed - previous.get(source, 0)) / 1000.0
+        previous[source] = elapsed
+        summary['nodes'][source] = summary['nodes'].get(source, 0.0) + ms
+        kind = event_kind(description)
+        summary['by_kind'][kind] = summary['by_kind'].get(kind, 0.0) + ms
+        m = LIVE_TOMBSTONES_RE.search(description)
+        if m:
+            summary['live_cells'] += int(m.group(1))
+            summary['tombstones'] += int(m.group(2))
+        m = SSTABLES_RE.search(description) or SEQ_SCAN_RE.search(description)
+        if m:
+            summary['sstables'] += int(m.group(1))
+    return summary
+
+def merge_summaries(summaries):
+    """Summary of several traces (e.g. every page of a query), adding up their figures."""
+    total = {'duration_ms': 0.0, 'traces': 0, 'nodes': {}, 'by_kind': {}, 'live_cells': 0, 'tombstones': 0, 'sstables': 0}
+    for summary in summaries:
+        total['traces'] += 1
+        total['duration_ms'] += summary['duration_ms'] or 0.0
+        for key in ('nodes', 'by_kind'):
+            for name, ms in summary[key].items():
+                total[key][name] = total[key].get(name, 0.0) + ms
+        for key in ('live_cells', 'tombstones', 'sstables'):
+            total[key] += summary[key]
+    return total
+
+def format_summary(summary):
+    """One line description of a summary, for logs and assertion messages."""
+    return "{:.1f}ms, {} live cells, {} tombstones, {} sstables; by kind: {}; by node: {}".format(
+        summary['duration_ms'] or 0.0, summary['live_cells'], summary['tombstones'], summary['sstables'],
+        ', '.join('%s %.1fms' % item for item in sorted(summary['by_kind'].items())),
+        ', '.join('%s %.1fms' % item for item in sorted(summary['nodes'].items())))